@@ -1,18 +1,35 @@
 # app/admin.py
 from fastapi import APIRouter, Request, Form
-from fastapi.responses import RedirectResponse, HTMLResponse
-from fastapi.templating import Jinja2Templates
-from app.database import get_conn, upsert_user, get_user_role, log_admin_action, get_admin_log
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, StreamingResponse
+from app.database import get_conn, upsert_user, get_user_role, log_admin_action, get_admin_log, iter_traffic, list_users
+from app.database import get_quotas, set_quota, delete_quota
 from app.auth import get_username_from_request, create_user
-import subprocess, secrets, string, smtplib
-from email.mime.text import MIMEText
+from app.settings import settings
+from app.templating import templates
+from app.jobs import jobs
+from app.quotas import quotas, SCOPES, PERIODS
+from datetime import datetime, timezone
+import csv, io, json, secrets
 
 router = APIRouter()
-templates = Jinja2Templates(directory="templates")
 
-SMTP_SERVER = "localhost"  # or your relay (e.g. smtp.gmail.com)
-SMTP_PORT = 25
-SMTP_FROM = "pivpn@local"
+SMTP_SERVER = settings.smtp_server
+SMTP_PORT = settings.smtp_port
+SMTP_FROM = settings.smtp_from
+
+
+def send_email(to: str, subject: str, body: str):
+    """Send a plain-text mail through the configured relay."""
+    # smtplib and the email package are only needed here; keep them off the import path
+    import smtplib
+    from email.mime.text import MIMEText
+
+    msg = MIMEText(body)
+    msg["Subject"] = subject
+    msg["From"] = SMTP_FROM
+    msg["To"] = to
+    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as s:
+        s.send_message(msg)
 
 def require_admin(request: Request):
     username = get_username_from_request(request)
@@ -22,25 +39,71 @@ def require_admin(request: Request):
     return username if role == "admin" else None
 
 
+USERS_PAGE = 50
+LOG_PAGE = 25
+MAX_PAGE = 200
+
+
+def _page(rows, limit, key):
+    """Trim a limit+1 query result to a page plus the cursor for the next one."""
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"items": rows, "next": rows[-1][key] if more and rows else None}
+
+
+def render_admin(request: Request, admin: str, **context):
+    """
+    Render admin.html with the first page of users and of the audit log.
+    Every admin page/POST goes through here, so each costs two bounded queries;
+    further pages load from /admin/api/users and /admin/api/log.
+    """
+    users = _page(list_users(limit=USERS_PAGE + 1), USERS_PAGE, "username")
+    logs = _page(get_admin_log(limit=LOG_PAGE + 1), LOG_PAGE, "id")
+    ctx = {
+        "request": request,
+        "username": admin,
+        "users": users["items"],
+        "users_next": users["next"],
+        "logs": logs["items"],
+        "logs_next": logs["next"],
+        "password": None,
+        "new_user": None,
+    }
+    ctx.update(context)
+    return templates.TemplateResponse("admin.html", ctx)
+
+
 @router.get("/admin", response_class=HTMLResponse)
 def admin_page(request: Request):
     user = require_admin(request)
     if not user:
         return RedirectResponse("/")
+    return render_admin(request, user)
 
-    conn = get_conn()
-    users = conn.execute("SELECT username, role, email FROM users ORDER BY username").fetchall()
-    conn.close()
 
-    logs = get_admin_log(limit=10)
-    return templates.TemplateResponse("admin.html", {
-        "request": request,
-        "username": user,
-        "users": users,
-        "logs": logs,
-        "password": None,
-        "new_user": None
-    })
+@router.get("/admin/api/users")
+def api_users(request: Request, after: str = "", q: str = "", role: str = "", limit: int = USERS_PAGE):
+    """Keyset-paginated user list: pass the returned `next` as `after`."""
+    if not require_admin(request):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    limit = max(1, min(limit, MAX_PAGE))
+    return _page(list_users(limit=limit + 1, after=after or None, q=q or None, role=role or None), limit, "username")
+
+
+@router.get("/admin/api/log")
+def api_admin_log(request: Request, before: int = 0, admin: str = "", action: str = "", target: str = "",
+                  since: str = "", until: str = "", limit: int = LOG_PAGE):
+    """Keyset-paginated audit log, newest first: pass the returned `next` as `before`."""
+    if not require_admin(request):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    try:
+        since_ts, until_ts = _to_db_ts(since), _to_db_ts(until)
+    except ValueError:
+        return JSONResponse({"error": "since/until must be epoch seconds or ISO 8601"}, status_code=400)
+    limit = max(1, min(limit, MAX_PAGE))
+    rows = get_admin_log(limit=limit + 1, before=before or None, admin=admin or None, action=action or None,
+                         target=target or None, since=since_ts, until=until_ts)
+    return _page(rows, limit, "id")
 
 
 @router.post("/admin/add_user", response_class=HTMLResponse)
@@ -71,37 +134,18 @@ def add_user(
     # Log action
     log_admin_action(admin, "add_user", username, f"role={role}, email={email}")
 
-    # Send email if address provided and password created
+    # Send email if address provided and password created (queued; SMTP can take seconds)
     if email and new_password:
-        try:
-            msg = MIMEText(
-                f"Hello {username},\n\nYour WG Dashboard account has been created.\n"
-                f"Temporary password: {new_password}\n"
-                f"Please change it on first login.\n\n-- WG Dashboard"
-            )
-            msg["Subject"] = "Your WG Dashboard Account"
-            msg["From"] = SMTP_FROM
-            msg["To"] = email
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as s:
-                s.send_message(msg)
-        except Exception as e:
-            print("Email send failed:", e)
+        jobs.submit("send_email", f"email:{email}", {
+            "to": email,
+            "subject": "Your WG Dashboard Account",
+            "body": f"Hello {username},\n\nYour WG Dashboard account has been created.\n"
+                    f"Temporary password: {new_password}\n"
+                    f"Please change it on first login.\n\n-- WG Dashboard",
+        }, admin)
 
     # Reload admin page
-    conn = get_conn()
-    users = conn.execute("SELECT username, role, email FROM users ORDER BY username").fetchall()
-    conn.close()
-    logs = get_admin_log(limit=10)
-    
-    return templates.TemplateResponse("admin.html", {
-        "request": request,
-        "success": message,
-        "username": admin,
-        "users": users,
-        "logs": logs,
-        "new_user": username if new_password else None,
-        "password": None
-    })
+    return render_admin(request, admin, success=message, new_user=username if new_password else None)
 
 
 @router.post("/admin/update")
@@ -128,3 +172,123 @@ def delete_user(request: Request, username: str = Form(...)):
     conn.close()
     log_admin_action(admin, "delete_user", username)
     return RedirectResponse("/admin", status_code=303)
+
+
+@router.get("/admin/api/quotas")
+def api_quotas(request: Request):
+    """Quotas with usage: live on the collector, else as of the last checkpoint."""
+    if not require_admin(request):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    live = quotas.usage()
+    items = []
+    for row in get_quotas():
+        usage = live.get((row["scope"], row["target"]))
+        items.append({
+            "scope": row["scope"],
+            "target": row["target"],
+            "period": row["period"],
+            "limit_bytes": row["limit_bytes"],
+            "used_bytes": usage["used"] if usage else (row["bytes"] or 0),
+            "period_start": usage["period_start"] if usage else row["period_start"],
+        })
+    return {"items": items}
+
+
+@router.post("/admin/api/quotas")
+async def api_set_quota(request: Request):
+    """Create or change a quota. Body: {"scope": "peer"|"user", "target", "period": "day"|"month", "limit_bytes"}."""
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    try:
+        body = await request.json()
+        scope, target, period = body["scope"], str(body["target"]).strip(), body.get("period", "month")
+        limit_bytes = int(body["limit_bytes"])
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse({"error": "Expected JSON with scope, target, period and limit_bytes"}, status_code=400)
+    if scope not in SCOPES or period not in PERIODS or not target or limit_bytes <= 0:
+        return JSONResponse({"error": f"scope must be one of {SCOPES}, period one of {PERIODS}, "
+                                      "target non-empty and limit_bytes positive"}, status_code=400)
+    set_quota(scope, target, period, limit_bytes)
+    log_admin_action(admin, "set_quota", f"{scope}:{target}", f"{limit_bytes} bytes per {period}")
+    return {"ok": True}
+
+
+@router.delete("/admin/api/quotas/{scope}/{target}")
+def api_delete_quota(request: Request, scope: str, target: str):
+    """Remove a quota; peers it disabled are re-enabled by the collector's next checkpoint."""
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if not delete_quota(scope, target):
+        return JSONResponse({"error": "Quota not found"}, status_code=404)
+    log_admin_action(admin, "delete_quota", f"{scope}:{target}")
+    return {"ok": True}
+
+
+def _to_db_ts(value: str):
+    """Accept epoch seconds or ISO 8601 and return traffic_log's UTC 'YYYY-MM-DD HH:MM:SS'."""
+    if not value:
+        return None
+    if value.isdigit():
+        dt = datetime.fromtimestamp(int(value), tz=timezone.utc)
+    else:
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc)
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+_EXPORT_FIELDS = ["id", "ts", "client_name", "bytes_in", "bytes_out"]
+
+
+def _csv_chunks(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(_EXPORT_FIELDS)
+    for rows in chunks:
+        writer.writerows([r[f] for f in _EXPORT_FIELDS] for r in rows)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _ndjson_chunks(chunks):
+    for rows in chunks:
+        yield "".join(json.dumps(r, separators=(",", ":")) + "\n" for r in rows)
+
+
+@router.get("/admin/export/traffic")
+def export_traffic(
+    request: Request,
+    format: str = "csv",
+    client: str = "",
+    user: str = "",
+    since: str = "",
+    until: str = "",
+):
+    """
+    Stream traffic_log as CSV or NDJSON, filtered by client, linked user and time range
+    (since/until as epoch seconds or ISO 8601). Memory use is one DB chunk regardless of size.
+    """
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if format not in ("csv", "ndjson"):
+        return JSONResponse({"error": "format must be csv or ndjson"}, status_code=400)
+    try:
+        since_ts, until_ts = _to_db_ts(since), _to_db_ts(until)
+    except ValueError:
+        return JSONResponse({"error": "since/until must be epoch seconds or ISO 8601"}, status_code=400)
+
+    log_admin_action(admin, "export_traffic", client or user or "all", f"format={format}, since={since}, until={until}")
+    chunks = iter_traffic(client_name=client or None, username=user or None, since=since_ts, until=until_ts)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    if format == "csv":
+        body, media_type = _csv_chunks(chunks), "text/csv"
+    else:
+        body, media_type = _ndjson_chunks(chunks), "application/x-ndjson"
+    headers = {"Content-Disposition": f"attachment; filename=traffic-{stamp}.{format}"}
+    return StreamingResponse(body, media_type=media_type, headers=headers)
@@ -0,0 +1,90 @@
+# app/agent.py
+"""
+Headless collector that pushes this server's peers to a hub dashboard.
+
+    HUB_URL=http://hub:8000 HUB_TOKEN=secret NODE_NAME=site-a python -m app.agent
+
+Runs the same parser as the dashboard (get_connected_clients) every
+POLL_INTERVAL seconds and sends only the peers that changed since the last
+batch the hub acknowledged (see app/hub.py for the format). Any error or a
+409 from the hub makes the next batch a full one.
+"""
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from app.hub import compact_peer
+from app.pivpn import get_connected_clients, get_total_clients
+from app.settings import settings
+
+
+class Agent:
+    def __init__(self, hub_url: str, node: str, token: str):
+        self.url = hub_url.rstrip("/") + "/api/hub/ingest"
+        self.node = node
+        self.token = token
+        self.sent = {}  # peer name -> row last acknowledged by the hub
+        self.seq = 0
+        self.full = True
+
+    def build_batch(self, clients, total):
+        rows = {c["name"]: compact_peer(c) for c in clients}
+        if self.full:
+            upsert, remove = list(rows.values()), []
+        else:
+            upsert = [r for n, r in rows.items() if self.sent.get(n) != r]
+            remove = [n for n in self.sent if n not in rows]
+        batch = {"node": self.node, "seq": self.seq + 1, "full": self.full, "total": total,
+                 "ts": int(time.time()), "upsert": upsert, "remove": remove}
+        return batch, rows
+
+    def _post(self, batch) -> int:
+        req = urllib.request.Request(
+            self.url,
+            data=json.dumps(batch, separators=(",", ":")).encode(),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {self.token}"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=10) as r:
+                return r.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except (urllib.error.URLError, OSError) as e:
+            print("Hub unreachable:", e)
+            return 0
+
+    def run_once(self):
+        batch, rows = self.build_batch(get_connected_clients(), get_total_clients())
+        status = self._post(batch)
+        if status == 200:
+            self.sent, self.seq, self.full = rows, batch["seq"], False
+        else:
+            # 409 means the hub lost our sequence; anything else means we can't tell what it applied
+            if status != 409:
+                print("Hub rejected batch:", status)
+            self.full = True
+        return status
+
+    def run(self, interval: float):
+        while True:
+            self.run_once()
+            time.sleep(interval)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Push WireGuard peer state to a WG Dashboard hub")
+    ap.add_argument("--hub", default=settings.hub_url, help="hub base URL (HUB_URL)")
+    ap.add_argument("--node", default=settings.node_name, help="label for this server (NODE_NAME)")
+    ap.add_argument("--token", default=settings.hub_token, help="shared secret (HUB_TOKEN)")
+    ap.add_argument("--interval", type=float, default=settings.poll_interval)
+    args = ap.parse_args(argv)
+    if not args.hub:
+        ap.error("--hub or HUB_URL is required")
+    Agent(args.hub, args.node, args.token).run(args.interval)
+
+
+if __name__ == "__main__":
+    main()
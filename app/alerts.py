@@ -0,0 +1,311 @@
+# app/alerts.py
+"""
+Alert rules evaluated by the collector on every tick.
+
+Rules are read from ALERT_RULES, a JSON list such as:
+
+    [
+      {"name": "big-transfer", "type": "transfer", "bytes": 10e9, "window": 3600},
+      {"name": "site-b-down", "type": "handshake", "peers": ["site-b"], "max_age": 180},
+      {"name": "mass-disconnect", "type": "connected_drop", "ratio": 0.5, "window": 600}
+    ]
+
+- transfer: a peer moved more than `bytes` (rx + tx) within `window` seconds
+- handshake: a peer's latest handshake is older than `max_age` seconds
+- connected_drop: the connected count fell to `ratio` of its peak over
+  `window` seconds (ignored while the peak is below `min_peak`, default 4)
+
+`peers` (a list of names; hub mode also accepts "node/name") limits a rule
+to those peers; it defaults to all. Handshake and drop alerts send a
+"resolved" notice when the condition clears. A rule that fired for a peer
+stays quiet for `cooldown` seconds (default: the rule's window).
+
+The engine keeps the previous tick's (rx, tx, handshake) per peer and only
+hands peers whose row changed to the rules; time-based checks use a deadline
+heap, so a tick costs O(changed peers) rule work. Alerts are queued in memory
+and sent by Notifier in batches through the job queue (SMTP via
+app.admin.send_email, and ALERT_WEBHOOK), at most ALERT_MAX_PER_HOUR batches
+per hour, so the poll loop never waits on delivery.
+"""
+
+import asyncio
+import heapq
+import json
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+from app.jobs import jobs
+from app.settings import settings
+
+QUEUE_SIZE = 1000  # alerts held while rate limited; older ones are dropped first
+
+
+class Rule:
+    default_window = 0.0
+
+    def __init__(self, spec: dict):
+        self.name = str(spec.get("name") or spec["type"])
+        peers = spec.get("peers")
+        self.peers = None if peers in (None, "*") else set(peers)
+        self.cooldown = float(spec.get("cooldown", spec.get("window", self.default_window)))
+        self._last_fired: Dict[str, float] = {}
+
+    def watches(self, key: str, name: str) -> bool:
+        return self.peers is None or key in self.peers or name in self.peers
+
+    def _fire(self, emit, key, message, now, state="firing"):
+        if state == "firing":
+            if now - self._last_fired.get(key, -1e18) < self.cooldown:
+                return
+            self._last_fired[key] = now
+        emit({"rule": self.name, "peer": key, "state": state, "message": message, "ts": int(now)})
+
+    def on_change(self, key, row, prev, now, emit):
+        pass
+
+    def forget(self, key):
+        self._last_fired.pop(key, None)
+
+    def on_tick(self, now, connected, emit):
+        pass
+
+
+class TransferRule(Rule):
+    """Sliding-window byte count per peer, kept in per-minute buckets."""
+
+    default_window = 3600.0
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.limit = float(spec["bytes"])
+        self.window = float(spec.get("window", self.default_window))
+        self._buckets: Dict[str, deque] = {}
+        self._sums: Dict[str, int] = {}
+
+    def on_change(self, key, row, prev, now, emit):
+        if prev is None:
+            return
+        delta = 0
+        for cur, old in ((row[0], prev[0]), (row[1], prev[1])):
+            delta += cur - old if cur >= old else cur  # counter reset
+        if delta <= 0:
+            return
+        buckets = self._buckets.setdefault(key, deque())
+        minute = int(now // 60)
+        if buckets and buckets[-1][0] == minute:
+            buckets[-1][1] += delta
+        else:
+            buckets.append([minute, delta])
+        total = self._sums.get(key, 0) + delta
+        horizon = (now - self.window) // 60
+        while buckets and buckets[0][0] <= horizon:
+            total -= buckets.popleft()[1]
+        self._sums[key] = total
+        if total > self.limit:
+            self._fire(emit, key, f"{key} transferred {total / 1e9:.2f} GB in the last {int(self.window)}s", now)
+
+    def forget(self, key):
+        super().forget(key)
+        self._buckets.pop(key, None)
+        self._sums.pop(key, None)
+
+
+class HandshakeRule(Rule):
+    """Deadline heap of (handshake + max_age); entries for superseded handshakes are skipped."""
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.max_age = float(spec.get("max_age", 180))
+        self._handshake: Dict[str, int] = {}
+        self._heap: List[tuple] = []
+        self._down = set()
+
+    def on_change(self, key, row, prev, now, emit):
+        hs = row[2]
+        if prev is not None and prev[2] == hs:
+            return
+        self._handshake[key] = hs
+        # a peer that never handshook gets max_age from when we first saw it
+        heapq.heappush(self._heap, ((hs or now) + self.max_age, key, hs))
+        if key in self._down and hs and now - hs <= self.max_age:
+            self._down.discard(key)
+            self._fire(emit, key, f"{key} handshaking again", now, state="resolved")
+
+    def forget(self, key):
+        super().forget(key)
+        self._handshake.pop(key, None)
+        self._down.discard(key)
+
+    def on_tick(self, now, connected, emit):
+        while self._heap and self._heap[0][0] <= now:
+            _, key, hs = heapq.heappop(self._heap)
+            if self._handshake.get(key) != hs or key in self._down:
+                continue
+            self._down.add(key)
+            age = f"{int(now - hs)}s ago" if hs else "never"
+            self._fire(emit, key, f"{key} has not handshaken in {int(self.max_age)}s (last: {age})", now)
+
+
+class ConnectedDropRule(Rule):
+    """Peak connected count over the window via a monotonic deque."""
+
+    default_window = 600.0
+
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.ratio = float(spec.get("ratio", 0.5))
+        self.window = float(spec.get("window", self.default_window))
+        self.min_peak = int(spec.get("min_peak", 4))
+        self._peaks = deque()  # (ts, count), counts decreasing
+        self._dropped = False
+
+    def on_tick(self, now, connected, emit):
+        while self._peaks and self._peaks[0][0] <= now - self.window:
+            self._peaks.popleft()
+        while self._peaks and self._peaks[-1][1] <= connected:
+            self._peaks.pop()
+        self._peaks.append((now, connected))
+        peak = self._peaks[0][1]
+        if not self._dropped and peak >= self.min_peak and connected <= peak * self.ratio:
+            self._dropped = True
+            self._fire(emit, "*", f"Connected peers dropped from {peak} to {connected} within {int(self.window)}s", now)
+        elif self._dropped and connected > peak * self.ratio:
+            self._dropped = False
+            self._fire(emit, "*", f"Connected peers back to {connected}", now, state="resolved")
+
+
+RULE_TYPES = {"transfer": TransferRule, "handshake": HandshakeRule, "connected_drop": ConnectedDropRule}
+
+
+def load_rules(path) -> List[Rule]:
+    """Parse the rules file; a missing file means no rules. Raises ValueError on a bad rule."""
+    try:
+        with open(path) as f:
+            specs = json.load(f)
+    except FileNotFoundError:
+        return []
+    rules = []
+    for spec in specs:
+        try:
+            rules.append(RULE_TYPES[spec["type"]](spec))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Bad alert rule {spec!r}: {e!r}")
+    return rules
+
+
+class AlertEngine:
+    def __init__(self, rules: List[Rule], emit: Callable[[dict], None]):
+        self.rules = rules
+        self.emit = emit
+        self._peer_rules = [r for r in rules if type(r).on_change is not Rule.on_change]
+        self._last: Dict[str, tuple] = {}
+
+    def evaluate(self, clients: List[dict], connected: int, now: Optional[float] = None):
+        """Feed one tick of peer state (the snapshot's `list`) to the rules."""
+        now = time.time() if now is None else now
+        current = {}
+        for c in clients:
+            key = f"{c['node']}/{c['name']}" if c.get("node") else c["name"]
+            row = (c.get("rx_raw", 0), c.get("tx_raw", 0), c.get("latest_handshake", 0))
+            current[key] = row
+            prev = self._last.get(key)
+            if prev != row:
+                for rule in self._peer_rules:
+                    if rule.watches(key, c["name"]):
+                        rule.on_change(key, row, prev, now, self.emit)
+        for key in self._last.keys() - current.keys():
+            for rule in self._peer_rules:
+                rule.forget(key)
+        self._last = current
+        for rule in self.rules:
+            rule.on_tick(now, connected, self.emit)
+
+
+class Notifier:
+    """Batches queued alerts every `interval` seconds and hands each batch to the job queue."""
+
+    def __init__(self, email, webhook: str, interval: float, max_per_hour: int):
+        self.email = tuple(email)
+        self.webhook = webhook
+        self.interval = interval
+        self.max_per_hour = max_per_hour
+        self._queue = deque(maxlen=QUEUE_SIZE)
+        self._dropped = 0
+        self._sent = deque()  # send times within the last hour
+        self._task = None
+
+    def push(self, alert: dict):
+        if len(self._queue) == self._queue.maxlen:
+            self._dropped += 1
+        self._queue.append(alert)
+
+    async def start(self):
+        if not self._task and (self.email or self.webhook):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print("Alert delivery failed:", e)
+
+    async def flush(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        while self._sent and self._sent[0] <= now - 3600:
+            self._sent.popleft()
+        if not self._queue or len(self._sent) >= self.max_per_hour:
+            return  # keep collecting; the next allowed batch carries everything
+        batch, dropped = list(self._queue), self._dropped
+        self._queue.clear()
+        self._dropped = 0
+        self._sent.append(now)
+        await asyncio.to_thread(self._submit, batch, dropped)
+
+    def _submit(self, batch: List[dict], dropped: int):
+        firing = sum(1 for a in batch if a["state"] == "firing")
+        subject = f"[WG Dashboard] {firing} alert(s), {len(batch) - firing} resolved"
+        lines = [f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(a['ts']))}  "
+                 f"{a['state'].upper():8}  {a['rule']}: {a['message']}" for a in batch]
+        if dropped:
+            lines.append(f"({dropped} older alerts were dropped while rate limited)")
+        for to in self.email:
+            jobs.submit("send_email", f"email:{to}", {"to": to, "subject": subject, "body": "\n".join(lines)})
+        if self.webhook:
+            jobs.submit("send_webhook", "webhook", {"url": self.webhook,
+                                                    "payload": {"alerts": batch, "dropped": dropped}})
+
+
+class Alerts:
+    """Rules + notifier, driven by the collector (WSManager.poll_once)."""
+
+    def __init__(self):
+        self.notifier = Notifier(settings.alert_email, settings.alert_webhook,
+                                 settings.alert_batch_interval, settings.alert_max_per_hour)
+        self.engine: Optional[AlertEngine] = None
+
+    async def start(self):
+        try:
+            rules = load_rules(settings.alert_rules)
+        except (OSError, ValueError) as e:
+            print("Alert rules not loaded:", e)
+            return
+        if rules:
+            self.engine = AlertEngine(rules, self.notifier.push)
+            await self.notifier.start()
+
+    async def stop(self):
+        await self.notifier.stop()
+
+    def evaluate(self, payload: dict):
+        if self.engine is not None:
+            self.engine.evaluate(payload.get("list", ()), payload.get("connected", 0), payload.get("ts"))
+
+
+alerts = Alerts()
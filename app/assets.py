@@ -0,0 +1,177 @@
+# app/assets.py
+"""
+Fingerprinted, precompressed static assets.
+
+On first use (the app's startup) every file in STATIC_DIR is read once,
+hashed, and compressed with gzip and, if the optional `brotli` package is
+installed, brotli. Templates link assets through `asset_url("app.js")`,
+which returns `/static/app.<hash>.js`; those URLs are served from memory
+with the best encoding the client accepts and `Cache-Control: immutable`,
+so a browser fetches each version of a file exactly once. Changing a file
+changes its URL on the next restart.
+
+Plain `/static/<name>` paths keep working through StaticFiles as before.
+
+`CompressAPIMiddleware` gzips responses of the large JSON endpoints.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import parse_qsl
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from app.settings import settings
+
+MAX_INLINE_SIZE = 2 * 1024 * 1024  # larger files are only served unfingerprinted, from disk
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def _brotli(data: bytes) -> Optional[bytes]:
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """{coding: q} from an Accept-Encoding header; a q-value that does not parse counts as 0."""
+    prefs = {}
+    for part in accept_encoding.split(","):
+        token, *params = part.split(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        prefs[token] = q
+    return prefs
+
+
+def accepts(accept_encoding: str, encoding: str) -> bool:
+    """Whether the client takes `encoding`: named with q > 0, or covered by `*` and not refused."""
+    prefs = accepted_encodings(accept_encoding)
+    return prefs.get(encoding, prefs.get("*", 0.0)) > 0
+
+
+class Asset:
+    __slots__ = ("name", "url", "etag", "media_type", "variants")
+
+    def __init__(self, name: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        path = Path(name)
+        self.name = name
+        self.url = "/static/" + str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+        self.etag = f'"{digest}"'
+        self.media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        self.variants: Dict[str, bytes] = {"identity": data}
+        # keep an encoding only where it pays off (icons and images barely shrink)
+        for encoding, compress in (("br", _brotli), ("gzip", lambda d: gzip.compress(d, 9, mtime=0))):
+            packed = compress(data)
+            if packed is not None and len(packed) < len(data) * 0.9:
+                self.variants[encoding] = packed
+
+    def pick(self, accept_encoding: str) -> str:
+        prefs = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in self.variants and prefs.get(encoding, prefs.get("*", 0.0)) > 0:
+                return encoding
+        return "identity"
+
+
+class AssetManifest:
+    def __init__(self, static_dir):
+        self.static_dir = Path(static_dir)
+        self._by_name: Dict[str, Asset] = {}
+        self._by_path: Dict[str, Asset] = {}  # fingerprinted path relative to /static/
+        self._built = False
+        self._lock = threading.Lock()
+
+    def build(self):
+        with self._lock:
+            if self._built:
+                return
+            for path in sorted(self.static_dir.rglob("*")):
+                rel = path.relative_to(self.static_dir).as_posix()
+                if not path.is_file() or rel.startswith(".") or "/." in rel or path.stat().st_size > MAX_INLINE_SIZE:
+                    continue
+                asset = Asset(rel, path.read_bytes())
+                self._by_name[rel] = asset
+                self._by_path[asset.url[len("/static/"):]] = asset
+            self._built = True
+
+    def url(self, name: str) -> str:
+        """Template helper: fingerprinted URL of a static file (plain /static path if unknown)."""
+        self.build()
+        asset = self._by_name.get(name)
+        return asset.url if asset else f"/static/{name}"
+
+    def lookup(self, path: str) -> Optional[Asset]:
+        self.build()
+        return self._by_path.get(path)
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles that serves fingerprinted names from the manifest, precompressed and immutable."""
+
+    def __init__(self, manifest: AssetManifest, **kwargs):
+        super().__init__(directory=str(manifest.static_dir), **kwargs)
+        self.manifest = manifest
+
+    async def get_response(self, path: str, scope) -> Response:
+        asset = self.manifest.lookup(path.replace("\\", "/"))
+        if asset is None:
+            return await super().get_response(path, scope)
+        headers = dict((k.decode().lower(), v.decode()) for k, v in scope.get("headers", ()))
+        base = {"ETag": asset.etag, "Cache-Control": IMMUTABLE, "Vary": "Accept-Encoding"}
+        if headers.get("if-none-match") == asset.etag:
+            return Response(status_code=304, headers=base)
+        encoding = asset.pick(headers.get("accept-encoding", ""))
+        if encoding != "identity":
+            base["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.media_type, headers=base)
+
+
+class CompressAPIMiddleware:
+    """
+    Gzip only the listed API responses. Streaming endpoints (exports, ZIPs,
+    event streams) are left alone, since gzip would hold back their chunks.
+    Requests with one of the `skip_params` query parameters are passed through
+    too: their handlers compress themselves (the ?since= long-poll reuses one
+    gzip body per snapshot version), and not every Starlette release leaves a
+    response that already has a Content-Encoding alone.
+    """
+
+    def __init__(self, app, exact=(), prefixes=(), skip_params=(), minimum_size: int = 1024):
+        self.app = app
+        self.exact = frozenset(exact)
+        self.prefixes = tuple(prefixes)
+        self.skip_params = frozenset(skip_params)
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] == "http" and (scope["path"] in self.exact or scope["path"].startswith(self.prefixes))
+                and not self._skipped(scope)):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    def _skipped(self, scope) -> bool:
+        if not self.skip_params:
+            return False
+        params = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        return any(key in self.skip_params for key, _ in params)
+
+
+assets = AssetManifest(settings.static_dir)
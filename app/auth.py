@@ -16,7 +16,6 @@ import secrets
 import time
 from typing import Optional
 from fastapi import Request
-from passlib.context import CryptContext
 from app.database import (
     get_conn,
     save_session,
@@ -28,8 +27,17 @@ from app.database import (
     set_user_password_hash,
 )
 
-# bcrypt context
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt context, built on first use: passlib is slow to import and most
+# requests only need a session lookup
+_pwd_ctx = None
+
+
+def _get_pwd_ctx():
+    global _pwd_ctx
+    if _pwd_ctx is None:
+        from passlib.context import CryptContext
+        _pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_ctx
 
 # session TTL (seconds) - optional usage if you want to expire sessions
 SESSION_TTL = 60 * 60 * 24 * 7  # 7 days
@@ -39,12 +47,12 @@ SESSION_TTL = 60 * 60 * 24 * 7  # 7 days
 # User & password helpers
 # ----------------------
 def hash_password(password: str) -> str:
-    return pwd_ctx.hash(password)
+    return _get_pwd_ctx().hash(password)
 
 
 def verify_password_hash(password: str, hash_: str) -> bool:
     try:
-        return pwd_ctx.verify(password, hash_)
+        return _get_pwd_ctx().verify(password, hash_)
     except Exception:
         return False
 
@@ -0,0 +1,83 @@
+# app/collector.py
+"""
+Single-collector coordination for multi-worker deployments.
+
+When the app runs under several workers (gunicorn -w N) every worker has its
+own WSManager, but only one of them should fork `wg` and write traffic_log.
+
+- CollectorLock: a non-blocking flock() on a per-box lock file. Whoever holds
+  it is the collector; the kernel drops it when that process dies, and the
+  next follower to retry takes over.
+- SnapshotStore: the collector publishes each tick's encoded payload to a file
+  in /dev/shm (write + rename, so readers never see a torn snapshot). Followers
+  stat it cheaply and only re-read when it changed.
+"""
+
+import fcntl
+import os
+from pathlib import Path
+from typing import Optional
+
+
+class CollectorLock:
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """Try once to become the collector. Never blocks."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class SnapshotStore:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._seen = None  # (inode, mtime_ns, size) of the last snapshot read
+
+    def publish(self, data: bytes):
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path)
+
+    def read(self) -> Optional[bytes]:
+        """Return the current snapshot, or None if none was published yet."""
+        try:
+            return self.path.read_bytes()
+        except OSError:
+            return None
+
+    def read_if_changed(self) -> Optional[bytes]:
+        """Return the snapshot only if it changed since the last call."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key == self._seen:
+            return None
+        data = self.read()
+        if data is not None:
+            self._seen = key
+        return data
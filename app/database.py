@@ -1,10 +1,12 @@
 # app/database.py
+import json
 import sqlite3
 import threading
+import time
 from pathlib import Path
+from app.settings import settings
 
-DB_PATH = Path(__file__).resolve().parents[1] / "data" / "dashboard.db"
-DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+DB_PATH = Path(settings.db_path)
 
 _conn_lock = threading.Lock()
 
@@ -15,6 +17,7 @@ def get_conn():
     return conn
 
 def init_db():
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     with _conn_lock:
         conn = get_conn()
         cur = conn.cursor()
@@ -62,6 +65,85 @@ def init_db():
             bytes_in INTEGER,
             bytes_out INTEGER
         )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_traffic_ts ON traffic_log(ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_traffic_client ON traffic_log(client_name, id)")
+        # keyset pagination / filters for the admin page
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_log_admin ON admin_log(admin, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_log_action ON admin_log(action, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_log_target ON admin_log(target, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_admin_log_ts ON admin_log(ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, username)")
+
+        # background jobs (app/jobs.py)
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            target TEXT NOT NULL,
+            params TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress TEXT,
+            result TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_by TEXT,
+            created_ts REAL,
+            updated_ts REAL,
+            run_after REAL DEFAULT 0
+        )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, run_after)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_target ON jobs(target, status)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_ts)")
+        # connect/disconnect history derived by the collector (app/sessions.py); times are epoch seconds
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS peer_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            client_name TEXT NOT NULL,
+            start_ts INTEGER NOT NULL,
+            end_ts INTEGER,
+            endpoint TEXT,
+            rx_start INTEGER,
+            tx_start INTEGER,
+            rx_bytes INTEGER,
+            tx_bytes INTEGER
+        )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_peer_sessions_client ON peer_sessions(client_name, start_ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_peer_sessions_end ON peer_sessions(end_ts, start_ts)")
+        # data quotas (app/quotas.py): limits, checkpointed usage, and the peers they disabled
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quotas (
+            scope TEXT NOT NULL,
+            target TEXT NOT NULL,
+            period TEXT NOT NULL,
+            limit_bytes INTEGER NOT NULL,
+            PRIMARY KEY (scope, target)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quota_usage (
+            scope TEXT NOT NULL,
+            target TEXT NOT NULL,
+            period_start INTEGER NOT NULL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, target)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS quota_blocks (
+            client_name TEXT PRIMARY KEY,
+            scope TEXT NOT NULL,
+            target TEXT NOT NULL
+        )""")
+        # collector counter checkpoint, written in the same transaction as the traffic rows
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS collector_state (
+            public_key TEXT PRIMARY KEY,
+            interface TEXT,
+            epoch TEXT,
+            rx INTEGER NOT NULL,
+            tx INTEGER NOT NULL,
+            ts REAL NOT NULL
+        )""")
+        # WAL lets long readers (exports, API queries) run alongside the collector's writes
+        cur.execute("PRAGMA journal_mode=WAL")
         conn.commit()
         conn.close()
 
@@ -138,19 +220,106 @@ def insert_traffic_sample(client_name, bytes_in, bytes_out):
         conn.commit()
         conn.close()
 
+def record_traffic_tick(samples, state):
+    """
+    One collector tick in one transaction: the traffic rows [(client_name, bytes_in, bytes_out)]
+    and the counter checkpoint rows [(public_key, interface, epoch, rx, tx, ts)] that produced them.
+    A crash leaves both or neither, so a restart never loses or double-counts a delta.
+    """
+    with _conn_lock:
+        conn = get_conn()
+        conn.executemany("INSERT INTO traffic_log(client_name, bytes_in, bytes_out) VALUES (?,?,?)", samples)
+        conn.executemany(
+            "INSERT OR REPLACE INTO collector_state (public_key, interface, epoch, rx, tx, ts) VALUES (?,?,?,?,?,?)",
+            state,
+        )
+        conn.commit()
+        conn.close()
+
+def load_collector_state(max_age):
+    """Checkpointed counters as {public_key: (epoch, rx, tx)}; peers unseen for max_age seconds are dropped."""
+    with _conn_lock:
+        conn = get_conn()
+        conn.execute("DELETE FROM collector_state WHERE ts < ?", (time.time() - max_age,))
+        conn.commit()
+        rows = conn.execute("SELECT public_key, epoch, rx, tx FROM collector_state").fetchall()
+        conn.close()
+    return {r[0]: (r[1], r[2], r[3]) for r in rows}
+
 def query_traffic(client_name=None, hours=24):
+    # the window modifier has to be bound as a whole; a '?' inside the literal is not a parameter
+    window = f"-{int(hours)} hours"
     with _conn_lock:
         conn = get_conn()
         if client_name:
             rows = conn.execute(
-                "SELECT ts, bytes_in, bytes_out FROM traffic_log WHERE client_name=? AND ts >= datetime('now','-? hour') ORDER BY ts",
-                (client_name, str(hours))
+                "SELECT ts, bytes_in, bytes_out FROM traffic_log WHERE client_name=? AND ts >= datetime('now', ?) ORDER BY ts",
+                (client_name, window)
             ).fetchall()
         else:
             rows = conn.execute(
-                "SELECT ts, client_name, bytes_in, bytes_out FROM traffic_log WHERE ts >= datetime('now','-? hour') ORDER BY ts",
-                (str(hours),)
+                "SELECT ts, client_name, bytes_in, bytes_out FROM traffic_log WHERE ts >= datetime('now', ?) ORDER BY ts",
+                (window,)
             ).fetchall()
+        conn.close()
+        return [dict(r) for r in rows]
+
+def iter_traffic(client_name=None, username=None, since=None, until=None, chunk_size=1000):
+    """
+    Yield lists of traffic_log rows (dicts: id, ts, client_name, bytes_in, bytes_out),
+    oldest first, at most chunk_size per list. since/until are 'YYYY-MM-DD HH:MM:SS' UTC.
+
+    Built for exports of any size: each chunk is a short keyset query on id over a
+    private connection, so neither the global lock nor a read transaction is held
+    between chunks and memory stays at one chunk.
+    """
+    conn = get_conn()
+    try:
+        where, params = [], []
+        if client_name:
+            where.append("client_name = ?")
+            params.append(client_name)
+        if username:
+            # clients.user_id holds the users rowid
+            names = [r["name"] for r in conn.execute(
+                "SELECT name FROM clients WHERE user_id = (SELECT rowid FROM users WHERE username = ?)",
+                (username,))]
+            if not names:
+                return
+            where.append(f"client_name IN ({','.join('?' * len(names))})")
+            params.extend(names)
+        if until:
+            where.append("ts < ?")
+            params.append(until)
+            # ids grow with ts, so rows past the window's end can be cut off by id too
+            r = conn.execute("SELECT MIN(id) AS id FROM traffic_log WHERE ts >= ?", (until,)).fetchone()
+            if r["id"] is not None:
+                where.append("id < ?")
+                params.append(r["id"])
+
+        # jump straight to the first row of the window through idx_traffic_ts
+        last_id = 0
+        if since:
+            r = conn.execute("SELECT MIN(id) AS id FROM traffic_log WHERE ts >= ?", (since,)).fetchone()
+            if r["id"] is None:
+                return
+            last_id = r["id"] - 1
+            where.append("ts >= ?")
+            params.append(since)
+
+        sql = "SELECT id, ts, client_name, bytes_in, bytes_out FROM traffic_log WHERE id > ?"
+        if where:
+            sql += " AND " + " AND ".join(where)
+        sql += " ORDER BY id LIMIT ?"
+
+        while True:
+            rows = conn.execute(sql, (last_id, *params, chunk_size)).fetchall()
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            last_id = rows[-1]["id"]
+    finally:
+        conn.close()
 
 def log_admin_action(admin, action, target, details=""):
     with _conn_lock:
@@ -160,18 +329,196 @@ def log_admin_action(admin, action, target, details=""):
         conn.commit()
         conn.close()
 
-def get_admin_log(limit=100):
+def get_admin_log(limit=100, before=None, admin=None, action=None, target=None, since=None, until=None):
+    """
+    Newest-first page of admin_log. `before` is the id of the last row of the previous
+    page (keyset pagination: no OFFSET scans, however deep the history).
+    since/until are 'YYYY-MM-DD HH:MM:SS' UTC bounds on ts.
+    """
+    where, params = [], []
+    for col, value in (("admin", admin), ("action", action), ("target", target)):
+        if value:
+            where.append(f"{col} = ?")
+            params.append(value)
+    if before:
+        where.append("id < ?")
+        params.append(int(before))
+    if since:
+        where.append("ts >= ?")
+        params.append(since)
+    if until:
+        where.append("ts < ?")
+        params.append(until)
+    sql = "SELECT id, admin, action, target, details, ts FROM admin_log"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC LIMIT ?"
     with _conn_lock:
         conn = get_conn()
-        rows = conn.execute(
-            "SELECT admin, action, target, details, ts FROM admin_log ORDER BY ts DESC LIMIT ?", (limit,)
-        ).fetchall()
+        rows = conn.execute(sql, (*params, limit)).fetchall()
         conn.close()
         return [dict(r) for r in rows]
 
+def list_users(limit=50, after=None, q=None, role=None):
+    """Page of users ordered by username; `after` is the last username of the previous page,
+    `q` a username prefix."""
+    where, params = [], []
+    if role:
+        where.append("role = ?")
+        params.append(role)
+    if q:
+        # prefix match as a range so it stays on the primary key index
+        where.append("username >= ? AND username < ?")
+        params.extend([q, q + "\uffff"])
+    if after:
+        where.append("username > ?")
+        params.append(after)
+    sql = "SELECT username, role, email FROM users"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY username LIMIT ?"
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(sql, (*params, limit)).fetchall()
         conn.close()
         return [dict(r) for r in rows]
 
+def link_clients(pairs):
+    """Record (client_name, username or None) links in the clients table."""
+    with _conn_lock:
+        conn = get_conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO clients (name, user_id) VALUES (?, (SELECT rowid FROM users WHERE username=?))",
+            pairs,
+        )
+        conn.commit()
+        conn.close()
+
+# --------------------
+# Jobs
+# --------------------
+_JOB_COLUMNS = "id, kind, target, params, status, progress, result, error, attempts, created_by, created_ts, updated_ts"
+
+
+def _job_dict(row):
+    job = dict(row)
+    for key in ("params", "result"):
+        job[key] = json.loads(job[key]) if job.get(key) else None
+    return job
+
+
+def enqueue_job(kind, target, params, created_by=None, coalesce=None, supersedes=()):
+    """
+    Queue a job and return (job_id, created).
+
+    coalesce="keep" returns an already queued job of the same kind and target as is,
+    coalesce="replace" overwrites its params (last write wins). Queued jobs of the
+    kinds in `supersedes` for the same target are cancelled.
+    """
+    now = time.time()
+    with _conn_lock:
+        conn = get_conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for other in supersedes:
+                conn.execute("UPDATE jobs SET status='cancelled', updated_ts=? WHERE target=? AND kind=? AND status='queued'",
+                             (now, target, other))
+            if coalesce:
+                row = conn.execute("SELECT id FROM jobs WHERE kind=? AND target=? AND status='queued' ORDER BY id LIMIT 1",
+                                   (kind, target)).fetchone()
+                if row:
+                    if coalesce == "replace":
+                        conn.execute("UPDATE jobs SET params=?, updated_ts=? WHERE id=?", (json.dumps(params), now, row["id"]))
+                    conn.commit()
+                    return row["id"], False
+            cur = conn.execute(
+                "INSERT INTO jobs (kind, target, params, created_by, created_ts, updated_ts) VALUES (?,?,?,?,?,?)",
+                (kind, target, json.dumps(params), created_by, now, now),
+            )
+            conn.commit()
+            return cur.lastrowid, True
+        finally:
+            conn.close()
+
+
+def claim_job(now):
+    """Mark the oldest runnable job as running and return it (None if there is none).
+    Jobs on a target that already has a running job wait, so one peer is never changed concurrently."""
+    with _conn_lock:
+        conn = get_conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE status='queued' AND run_after <= ? "
+                "AND target NOT IN (SELECT target FROM jobs WHERE status='running') ORDER BY id LIMIT 1",
+                (now,),
+            ).fetchone()
+            if not row:
+                conn.commit()
+                return None
+            conn.execute("UPDATE jobs SET status='running', attempts=attempts+1, updated_ts=? WHERE id=?", (now, row["id"]))
+            conn.commit()
+            job = _job_dict(row)
+            job["status"], job["attempts"] = "running", job["attempts"] + 1
+            return job
+        finally:
+            conn.close()
+
+
+def update_job(job_id, **fields):
+    """Set any of status, progress, result, error, run_after, params on a job (params=None clears them)."""
+    if "result" in fields:
+        fields["result"] = json.dumps(fields["result"])
+    if fields.get("params") is not None:
+        fields["params"] = json.dumps(fields["params"])
+    fields["updated_ts"] = time.time()
+    cols = ", ".join(f"{k}=?" for k in fields)
+    with _conn_lock:
+        conn = get_conn()
+        conn.execute(f"UPDATE jobs SET {cols} WHERE id=?", (*fields.values(), job_id))
+        conn.commit()
+        conn.close()
+
+
+def get_job(job_id):
+    with _conn_lock:
+        conn = get_conn()
+        r = conn.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id=?", (job_id,)).fetchone()
+        conn.close()
+        return _job_dict(r) if r else None
+
+
+def get_jobs_updated_since(ts, limit=500):
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(
+            f"SELECT {_JOB_COLUMNS} FROM jobs WHERE updated_ts > ? ORDER BY updated_ts LIMIT ?", (ts, limit)
+        ).fetchall()
+        conn.close()
+        return [_job_dict(r) for r in rows]
+
+
+def requeue_running_jobs(exclude=()):
+    """Put jobs left 'running' by a dead process back in the queue; returns how many.
+    `exclude` are ids the calling process is still running itself."""
+    marks = ",".join("?" * len(exclude))
+    with _conn_lock:
+        conn = get_conn()
+        cur = conn.execute("UPDATE jobs SET status='queued', progress='resumed after restart', updated_ts=? "
+                           f"WHERE status='running' AND id NOT IN ({marks})", (time.time(), *exclude))
+        conn.commit()
+        conn.close()
+        return cur.rowcount
+
+
+def prune_jobs(older_than):
+    """Drop finished jobs last updated before `older_than` (epoch seconds)."""
+    with _conn_lock:
+        conn = get_conn()
+        conn.execute("DELETE FROM jobs WHERE status IN ('done','failed','cancelled') AND updated_ts < ?", (older_than,))
+        conn.commit()
+        conn.close()
+
 def get_user_by_username(username):
     with _conn_lock:
         conn = get_conn()
@@ -185,3 +532,146 @@ def set_user_password_hash(username, password_hash):
         conn.execute("UPDATE users SET password_hash = ? WHERE username = ?", (password_hash, username))
         conn.commit()
         conn.close()
+
+# --------------------
+# Peer sessions
+# --------------------
+def get_open_sessions():
+    """Sessions not closed yet, as {client_name: row}."""
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(
+            "SELECT id, client_name, start_ts, endpoint, rx_start, tx_start FROM peer_sessions WHERE end_ts IS NULL"
+        ).fetchall()
+        conn.close()
+    return {r["client_name"]: dict(r) for r in rows}
+
+
+def record_session_transitions(opened, closed):
+    """
+    Apply one tick of transitions in a single transaction.
+    opened: [(client_name, start_ts, endpoint, rx_start, tx_start)], closed: [(end_ts, rx_bytes, tx_bytes, id)].
+    Returns the ids of the opened rows, in order.
+    """
+    with _conn_lock:
+        conn = get_conn()
+        ids = [conn.execute(
+            "INSERT INTO peer_sessions (client_name, start_ts, endpoint, rx_start, tx_start) VALUES (?,?,?,?,?)", row
+        ).lastrowid for row in opened]
+        conn.executemany("UPDATE peer_sessions SET end_ts=?, rx_bytes=?, tx_bytes=? WHERE id=?", closed)
+        conn.commit()
+        conn.close()
+    return ids
+
+
+def get_sessions(client_name, limit=50, before=None):
+    """
+    A peer's sessions, newest first. `before` is the (start_ts, id) of the last row of
+    the previous page, or a bare (start_ts,); the id keeps sessions that share a start
+    second from being skipped between pages.
+    """
+    sql = "SELECT * FROM peer_sessions WHERE client_name=?"
+    args = [client_name]
+    if before is not None:
+        if len(before) > 1:
+            sql += " AND (start_ts < ? OR (start_ts = ? AND id < ?))"
+            args.extend([before[0], before[0], before[1]])
+        else:
+            sql += " AND start_ts < ?"
+            args.append(before[0])
+    sql += " ORDER BY start_ts DESC, id DESC LIMIT ?"
+    args.append(int(limit))
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(sql, args).fetchall()
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def get_sessions_overlapping(since, until, client_name=None):
+    """(start_ts, end_ts or None) of sessions that overlap [since, until)."""
+    sql = ("SELECT start_ts, end_ts FROM peer_sessions WHERE end_ts > ? AND start_ts < ? {0} "
+           "UNION ALL SELECT start_ts, end_ts FROM peer_sessions WHERE end_ts IS NULL AND start_ts < ? {0}")
+    if client_name is None:
+        sql, args = sql.format(""), (since, until, until)
+    else:
+        sql, args = sql.format("AND client_name=?"), (since, until, client_name, until, client_name)
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(sql, args).fetchall()
+        conn.close()
+    return [(r[0], r[1]) for r in rows]
+
+
+# --------------------
+# Quotas
+# --------------------
+def get_quotas():
+    """Quota definitions with their last checkpointed usage (period_start/bytes are None if never used)."""
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(
+            "SELECT q.scope, q.target, q.period, q.limit_bytes, u.period_start, u.bytes "
+            "FROM quotas q LEFT JOIN quota_usage u ON u.scope = q.scope AND u.target = q.target "
+            "ORDER BY q.scope, q.target"
+        ).fetchall()
+        conn.close()
+    return [dict(r) for r in rows]
+
+
+def set_quota(scope, target, period, limit_bytes):
+    with _conn_lock:
+        conn = get_conn()
+        conn.execute("INSERT OR REPLACE INTO quotas (scope, target, period, limit_bytes) VALUES (?,?,?,?)",
+                     (scope, target, period, int(limit_bytes)))
+        conn.commit()
+        conn.close()
+
+
+def delete_quota(scope, target):
+    """Remove a quota; its usage goes with it, its blocks are released by the collector."""
+    with _conn_lock:
+        conn = get_conn()
+        cur = conn.execute("DELETE FROM quotas WHERE scope=? AND target=?", (scope, target))
+        conn.execute("DELETE FROM quota_usage WHERE scope=? AND target=?", (scope, target))
+        conn.commit()
+        conn.close()
+    return cur.rowcount > 0
+
+
+def save_quota_usage(rows):
+    """Checkpoint [(scope, target, period_start, bytes)] in one transaction."""
+    with _conn_lock:
+        conn = get_conn()
+        conn.executemany("INSERT OR REPLACE INTO quota_usage (scope, target, period_start, bytes) VALUES (?,?,?,?)", rows)
+        conn.commit()
+        conn.close()
+
+
+def get_quota_blocks():
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute("SELECT client_name, scope, target FROM quota_blocks").fetchall()
+        conn.close()
+    return {r["client_name"]: (r["scope"], r["target"]) for r in rows}
+
+
+def set_quota_blocks(added, removed):
+    """added: [(client_name, scope, target)], removed: [client_name]."""
+    with _conn_lock:
+        conn = get_conn()
+        conn.executemany("INSERT OR REPLACE INTO quota_blocks (client_name, scope, target) VALUES (?,?,?)", added)
+        conn.executemany("DELETE FROM quota_blocks WHERE client_name=?", [(n,) for n in removed])
+        conn.commit()
+        conn.close()
+
+
+def get_client_owners():
+    """{client_name: username} for every linked client."""
+    with _conn_lock:
+        conn = get_conn()
+        rows = conn.execute(
+            "SELECT c.name, u.username FROM clients c JOIN users u ON u.rowid = c.user_id"
+        ).fetchall()
+        conn.close()
+    return {r[0]: r[1] for r in rows}
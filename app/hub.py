@@ -0,0 +1,140 @@
+# app/hub.py
+"""
+Fleet state for hub mode (DASHBOARD_MODE=hub).
+
+Agents (python -m app.agent) run the normal collector on each WireGuard
+server and push compact delta batches to POST /api/hub/ingest:
+
+    {"node": "site-a", "seq": 42, "full": false, "total": 140, "ts": 1700000000,
+     "upsert": [[name, endpoint, virtual_ip, rx_raw, tx_raw, latest_handshake], ...],
+     "remove": [name, ...]}
+
+`seq` increases by one per accepted batch. A full batch replaces the node's
+peers and is accepted at any seq; a delta that does not follow the last seq
+is refused so the agent resends in full. Memory is bounded by
+HUB_MAX_NODES x HUB_MAX_PEERS rows, and nodes silent for NODE_TTL are dropped.
+"""
+
+import time
+from typing import Dict, List, Optional
+from app.pivpn import build_peer_entry
+from app.settings import settings
+
+
+class FleetFull(Exception):
+    """Raised when a new node would exceed HUB_MAX_NODES."""
+
+
+def compact_peer(c: dict) -> list:
+    """Agent side: reduce a client dict to the row format carried in batches."""
+    return [c["name"], c.get("remote_ip", ""), c.get("virtual_ip", ""),
+            c.get("rx_raw", 0), c.get("tx_raw", 0), c.get("latest_handshake", 0)]
+
+
+def _node_name(name) -> str:
+    return str(name)[:64]
+
+
+def _parse_row(row) -> tuple:
+    name, endpoint, vip, rx, tx, hs = row
+    return (str(name), str(endpoint), str(vip), int(rx), int(tx), int(hs))
+
+
+class NodeState:
+    __slots__ = ("name", "peers", "seq", "total", "last_seen")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.peers: Dict[str, tuple] = {}
+        self.seq = -1
+        self.total = 0
+        self.last_seen = 0.0
+
+
+class FleetState:
+    def __init__(self, stale_after: float, ttl: float, max_nodes: int, max_peers: int):
+        self.stale_after = stale_after
+        self.ttl = ttl
+        self.max_nodes = max_nodes
+        self.max_peers = max_peers
+        self.nodes: Dict[str, NodeState] = {}
+
+    def apply(self, batch: dict, now: Optional[float] = None) -> bool:
+        """
+        Merge one agent batch. Returns False if the agent must resend a full batch.
+        Raises ValueError/KeyError/TypeError on a malformed batch (nothing is applied).
+        """
+        now = time.time() if now is None else now
+        name = _node_name(batch["node"])
+        seq = int(batch["seq"])
+        full = bool(batch.get("full"))
+        upsert = [_parse_row(r) for r in batch.get("upsert", ())]
+        remove = [str(n) for n in batch.get("remove", ())]
+
+        node = self.nodes.get(name)
+        if node is None:
+            if not full:
+                return False
+            self._expire(now)
+            if len(self.nodes) >= self.max_nodes:
+                raise FleetFull(name)
+            node = self.nodes[name] = NodeState(name)
+
+        if full:
+            node.peers = {}
+        elif seq != node.seq + 1:
+            return False
+
+        for peer in remove:
+            node.peers.pop(peer, None)
+        for row in upsert:
+            if row[0] not in node.peers and len(node.peers) >= self.max_peers:
+                continue
+            node.peers[row[0]] = row
+
+        node.seq = seq
+        node.total = int(batch.get("total", len(node.peers)))
+        node.last_seen = now
+        return True
+
+    def expected_seq(self, name) -> int:
+        node = self.nodes.get(_node_name(name))
+        return node.seq + 1 if node else 0
+
+    def _expire(self, now: float):
+        for name in [n for n, node in self.nodes.items() if now - node.last_seen > self.ttl]:
+            del self.nodes[name]
+
+    def view(self, now: Optional[float] = None) -> dict:
+        """Merged fleet snapshot in the same shape as a local tick, plus per-node status."""
+        now = time.time() if now is None else now
+        self._expire(now)
+        clients: List[dict] = []
+        nodes: List[dict] = []
+        total = connected = 0
+        for node in sorted(self.nodes.values(), key=lambda n: n.name):
+            stale = now - node.last_seen > self.stale_after
+            node_connected = 0
+            for peer in node.peers.values():
+                entry = build_peer_entry(*peer, now=now)
+                entry["node"] = node.name
+                entry["stale"] = stale
+                if entry["connected"]:
+                    node_connected += 1
+                clients.append(entry)
+            total += node.total
+            if not stale:
+                connected += node_connected
+            nodes.append({
+                "node": node.name,
+                "last_seen": int(node.last_seen),
+                "age": round(now - node.last_seen, 1),
+                "stale": stale,
+                "total": node.total,
+                "peers": len(node.peers),
+                "connected": node_connected,
+            })
+        return {"total": total, "connected": connected, "list": clients, "nodes": nodes, "ts": int(now)}
+
+
+fleet = FleetState(settings.node_stale_after, settings.node_ttl, settings.hub_max_nodes, settings.hub_max_peers)
@@ -0,0 +1,276 @@
+# app/jobs.py
+"""
+Persistent background jobs for slow admin operations.
+
+Request handlers call `jobs.submit(...)` and return the job id at once; the
+work (pivpn runs, config toggles, SMTP, webhooks) happens in a bounded pool of worker
+tasks, each running the blocking handler in a thread.
+
+- The queue is the `jobs` table, so jobs survive restarts: anything left
+  'running' by a dead collector is re-queued when the next one takes over.
+- Only the collector process (see app/collector.py) runs workers, so
+  JOB_WORKERS bounds the pool for the whole box.
+- Every process watches the table and pushes job status changes to its own
+  WebSocket clients as {"type": "job", "id", "kind", "status"} messages.
+  /ws/clients is not authenticated, so progress, results and errors (which
+  can hold email addresses or pivpn output) are only served by
+  GET /api/jobs/{id}, to admins and the job's creator.
+- Failures are retried with exponential backoff up to JOB_MAX_ATTEMPTS,
+  unless the handler raises JobError(retry=False).
+- Conflicting jobs on the same peer are coalesced at submit time (see the
+  `coalesce`/`supersedes` arguments of @handler) and never run concurrently.
+"""
+
+import asyncio
+import json
+import subprocess
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Dict, Optional
+from app.database import (
+    enqueue_job,
+    claim_job,
+    update_job,
+    get_jobs_updated_since,
+    requeue_running_jobs,
+    prune_jobs,
+    link_clients,
+)
+from app.pivpn import config_exists, delete_config, pivpn_lock, set_client_enabled, toggle_config
+from app.settings import settings
+
+POLL_INTERVAL = 1.0  # seconds between queue checks when idle
+WATCH_INTERVAL = 0.5  # seconds between job-update checks for WebSocket pushes
+PUBLIC_FIELDS = ("id", "kind", "status")  # all that /ws/clients subscribers see of a job
+
+
+class JobError(Exception):
+    """Raised by a handler to fail a job; retry=False skips the remaining attempts."""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class JobContext:
+    def __init__(self, job: dict):
+        self.job = job
+
+    def progress(self, message: str):
+        update_job(self.job["id"], progress=message)
+
+
+_HANDLERS: Dict[str, dict] = {}
+
+
+def handler(kind: str, coalesce: Optional[str] = None, supersedes=(), scrub: bool = False):
+    """
+    Register fn(ctx, **params) -> result (JSON-serialisable) for a job kind.
+    scrub=True clears the params once the job is done or failed, for kinds whose
+    params hold secrets that must not sit in the table until the job is pruned.
+    """
+    def register(fn):
+        _HANDLERS[kind] = {"fn": fn, "coalesce": coalesce, "supersedes": tuple(supersedes), "scrub": scrub}
+        return fn
+    return register
+
+
+# ---------------------- Handlers ----------------------
+
+@handler("add_client", coalesce="keep")
+def _add_client(ctx, name, link_user=None):
+    # a config already present here can only come from an earlier attempt of this job,
+    # since the endpoint refuses names that exist at submit time
+    with pivpn_lock():
+        if not config_exists(name):
+            ctx.progress("running pivpn -a")
+            proc = subprocess.run(["pivpn", "-a", "-n", name, "-ip", "auto"], capture_output=True, text=True, timeout=60)
+            if proc.returncode != 0:
+                raise JobError(f"Failed to add client: {proc.stderr.strip()}", retry=False)
+    ctx.progress("linking user")
+    link_clients([(name, link_user or None)])
+    return {"name": name, "linked_user": link_user}
+
+
+@handler("delete_config", coalesce="keep", supersedes=("toggle_config", "set_client_enabled"))
+def _delete_config(ctx, name):
+    ctx.progress("running pivpn -r")
+    if not delete_config(name):
+        raise JobError(f"Failed to remove client {name}", retry=False)
+    return {"deleted": True}
+
+
+@handler("toggle_config", coalesce="replace")
+def _toggle_config(ctx, name, enable):
+    if not toggle_config(name, enable):
+        raise JobError(f"Failed to {'enable' if enable else 'disable'} {name}")
+    return {"enabled": enable}
+
+
+@handler("set_client_enabled", coalesce="replace")
+def _set_client_enabled(ctx, name, enable):
+    ctx.progress(f"running pivpn {'-on' if enable else '-off'}")
+    if not set_client_enabled(name, enable):
+        raise JobError(f"Failed to {'enable' if enable else 'disable'} {name}")
+    return {"enabled": enable}
+
+
+@handler("send_email", scrub=True)  # the body can carry a temporary password
+def _send_email(ctx, to, subject, body):
+    from app.admin import send_email  # admin imports this module
+    send_email(to, subject, body)
+    return {"sent": to}
+
+
+@handler("send_webhook")
+def _send_webhook(ctx, url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                 headers={"Content-Type": "application/json"}, method="POST")
+    try:
+        with urllib.request.urlopen(req, timeout=10) as r:
+            return {"status": r.status}
+    except urllib.error.HTTPError as e:
+        # a 4xx will not get better by retrying
+        raise JobError(f"Webhook returned {e.code}", retry=e.code >= 500)
+    except (urllib.error.URLError, OSError) as e:
+        raise JobError(f"Webhook unreachable: {e}")
+
+
+# ---------------------- Queue ----------------------
+
+class JobQueue:
+    def __init__(self, workers: int, max_attempts: int, retention: float):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self._tasks = []
+        self._wake = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # the workers' loop, set by start()
+        self._is_active: Callable[[], bool] = lambda: True
+        self._broadcast = None
+        self._recovered = False
+        # recovery and claims take turns, so a requeue never hits a job another worker just claimed
+        self._claiming = asyncio.Lock()
+        self._running = set()  # ids of the jobs this process is running
+
+    def submit(self, kind: str, target: str, params: dict, created_by: Optional[str] = None) -> int:
+        spec = _HANDLERS[kind]
+        job_id, _ = enqueue_job(kind, target, params, created_by, spec["coalesce"], spec["supersedes"])
+        self._wake_workers()
+        return job_id
+
+    def _wake_workers(self):
+        """Set _wake from any thread; sync routes and to_thread callers submit off the loop."""
+        loop = self._loop
+        if loop is None:
+            return  # no workers in this process; whoever runs jobs finds it on its next poll
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            self._wake.set()
+        else:
+            try:
+                loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass  # loop already closed (shutdown)
+
+    async def start(self, is_active: Callable[[], bool], broadcast):
+        """is_active: whether this process should run jobs; broadcast: async fn(dict) for updates."""
+        if self._tasks:
+            return
+        self._is_active = is_active
+        self._broadcast = broadcast
+        self._loop = asyncio.get_running_loop()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._watch()))
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+        self._loop = None
+
+    async def _idle(self):
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self):
+        while True:
+            try:
+                if not self._is_active():
+                    self._recovered = False
+                    await asyncio.sleep(POLL_INTERVAL)
+                    continue
+                async with self._claiming:
+                    if not self._recovered:
+                        await self._recover()
+                    job = await asyncio.to_thread(claim_job, time.time())
+                    if job is not None:
+                        self._running.add(job["id"])
+                if job is None:
+                    await self._idle()
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Job worker error:", e)
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _recover(self):
+        """We just became the job runner: adopt what the previous one left behind. Runs once per takeover."""
+        n = await asyncio.to_thread(requeue_running_jobs, tuple(self._running))
+        if n:
+            print(f"Resumed {n} interrupted job(s)")
+        await asyncio.to_thread(prune_jobs, time.time() - self.retention)
+        self._recovered = True
+
+    async def _run(self, job: dict):
+        self._running.add(job["id"])
+        try:
+            await self._execute(job)
+        finally:
+            self._running.discard(job["id"])
+
+    async def _execute(self, job: dict):
+        spec = _HANDLERS.get(job["kind"])
+        if spec is None:
+            await asyncio.to_thread(update_job, job["id"], status="failed", error=f"unknown job kind {job['kind']}")
+            return
+        finished = {"params": None} if spec["scrub"] else {}
+        try:
+            result = await asyncio.to_thread(spec["fn"], JobContext(job), **(job["params"] or {}))
+        except Exception as e:
+            retry = getattr(e, "retry", True) and job["attempts"] < self.max_attempts
+            if retry:
+                backoff = 2 ** job["attempts"]
+                await asyncio.to_thread(update_job, job["id"], status="queued", error=str(e),
+                                        progress=f"retrying in {backoff}s", run_after=time.time() + backoff)
+            else:
+                await asyncio.to_thread(update_job, job["id"], status="failed", error=str(e), **finished)
+            return
+        await asyncio.to_thread(update_job, job["id"], status="done", result=result, progress=None, error=None,
+                                **finished)
+
+    async def _watch(self):
+        last = time.time()
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            try:
+                rows = await asyncio.to_thread(get_jobs_updated_since, last)
+            except Exception as e:
+                print("Job watch error:", e)
+                continue
+            for job in rows:
+                last = max(last, job["updated_ts"])
+                if self._broadcast:
+                    await self._broadcast({"type": "job", **{k: job[k] for k in PUBLIC_FIELDS}})
+
+
+jobs = JobQueue(settings.job_workers, settings.job_max_attempts, settings.job_retention)
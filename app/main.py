@@ -1,36 +1,49 @@
 # app/main.py
-from fastapi import FastAPI, Request, Form, WebSocket, WebSocketDisconnect, Response, Depends
+from fastapi import FastAPI, Request, Form, WebSocket, WebSocketDisconnect, Response, Depends, Query
 from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse, PlainTextResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
-import uvicorn
+from contextlib import asynccontextmanager
 import asyncio
-from app.database import init_db, query_traffic, get_conn, log_admin_action, get_user_role, get_admin_log
+from app.database import init_db, query_traffic, log_admin_action, get_user_role
 from app.auth import verify_user, create_session_for_user, get_username_from_request, logout_token, change_password
-from app.admin import require_admin
-from app.pivpn import get_connected_clients, get_total_clients, get_qr_png
-from app.pivpn import list_configs, read_config, delete_config, toggle_config
+from app.admin import require_admin, render_admin
+from app.pivpn import get_connected_clients, get_total_clients
+from app.pivpn import list_configs, config_exists, config_cache, iter_configs_zip
+from app.jobs import jobs
+from app.alerts import alerts
+from app.database import get_job, link_clients, get_sessions, get_sessions_overlapping
 from app.wsmanager import wsmanager
+from app.hub import fleet, FleetFull
+from app.sessions import concurrency, uptime
+from app.provision import NAME_RE, ApplyError, ProvisionError, parse_bulk_csv, provision_clients
+from app.settings import settings
+from app.templating import templates
+from app.assets import AssetFiles, CompressAPIMiddleware, accepts, assets
 from app import admin
-import subprocess, secrets
-
-app = FastAPI()
-templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
-app.include_router(admin.router)
+import secrets
+import time
+from email.utils import formatdate, parsedate_to_datetime
 
 
-# Initialize DB
-init_db()
-
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema setup runs here rather than at import so importing the app stays cheap
+    init_db()
+    assets.build()  # hash + precompress static files once, before the first page render
     await wsmanager.start()
-
-@app.on_event("shutdown")
-async def shutdown_event():
+    await jobs.start(is_active=lambda: wsmanager.is_collector, broadcast=wsmanager.broadcast)
+    await alerts.start()
+    yield
+    await alerts.stop()
+    await jobs.stop()
     await wsmanager.stop()
 
+app = FastAPI(lifespan=lifespan)
+app.mount("/static", AssetFiles(assets), name="static")
+# the big JSON payloads; /api/clients/* streams are excluded on purpose
+app.add_middleware(CompressAPIMiddleware, exact=("/api/clients", "/api/fleet"), prefixes=("/api/traffic/",),
+                   skip_params=("since",))
+app.include_router(admin.router)
+
 # --------------------
 # Pages & Auth
 # --------------------
@@ -121,43 +134,13 @@ async def admin_reset_password(request: Request, username: str = Form(...)):
     admin = require_admin(request)
     if not admin:
         return RedirectResponse("/")
-    
-    conn = get_conn()
-    users = conn.execute("SELECT username, role, email FROM users ORDER BY username").fetchall()
-    conn.close()
-    
-    logs = get_admin_log(limit=30)
-    
+
     # Generate a random temporary password
     temp_pass = secrets.token_urlsafe(8)
     if change_password(username, temp_pass):
-        message = f"Password for '{username}' reset to: {temp_pass}"
-        return templates.TemplateResponse(
-            "admin.html",
-            {
-                "request": request,
-                "success": message,                
-                "username": admin,
-                "users": users,
-                "logs": logs,
-                "password": None,
-                "new_user": None
-            },
-        )
+        return render_admin(request, admin, success=f"Password for '{username}' reset to: {temp_pass}")
     else:
-        return templates.TemplateResponse(
-            "admin.html",
-            {
-                "request": request,
-                "error": f"Failed to reset password for {username}.",
-                "username": admin,
-                "users": users,
-                "logs": logs,
-                "password": None,
-                "new_user": None
-                
-            },
-        )
+        return render_admin(request, admin, error=f"Failed to reset password for {username}.")
 
 # Add a new client configuration
 @app.post("/admin/add_client")
@@ -174,81 +157,152 @@ async def add_client(request: Request,
     if role != "admin":
         return JSONResponse({"error": "Forbidden"}, status_code=403)
         
-    # call pivpn add
-    proc = subprocess.run(["pivpn", "-a", "-n", client_name, "-ip", "auto"], capture_output=True, text=True, timeout=10)
-        
-    if proc.returncode != 0:
-        error_client = f"Failed to add client: {proc.stderr}"
-        return templates.TemplateResponse(
-            "admin.html",
-            {
-                "request": request,
-                "username": current_user,
-                "error_client": error_client,
-                "users": get_conn().execute("SELECT username, role, email FROM users").fetchall(),
-                "logs": get_admin_log(limit=30),
-            },
-        )
+    if config_exists(client_name):
+        return render_admin(request, current_user, error_client=f"Failed to add client: '{client_name}' already exists")
    
-    # Link to user if provided
-    conn = get_conn()
-    if link_user:
-        conn.execute(
-            "INSERT INTO clients (name, user_id) VALUES (?, (SELECT id FROM users WHERE username=?))",
-            (client_name, link_user),
-        )
-    else:
-        conn.execute("INSERT INTO clients (name) VALUES (?)", (client_name,))
-    conn.commit()
-    conn.close()
+    # pivpn -a and the user link run in the background; progress arrives over the WebSocket
+    job_id = jobs.submit("add_client", client_name, {"name": client_name, "link_user": link_user}, current_user)
 
-    
-    return templates.TemplateResponse(
-        "admin.html",
-        {
-            "request": request,
-            "username": current_user,
-            "success_client": True,
-            "new_client": client_name,
-            "linked_user": link_user,
-            "users": get_conn().execute("SELECT username, role, email FROM users").fetchall(),
-            "logs": get_admin_log(limit=30),
-        },
-    )
+    return render_admin(request, current_user, success_client=True, job_id=job_id,
+                        new_client=client_name, linked_user=link_user)
+
+@app.post("/admin/bulk_clients")
+async def bulk_add_clients(request: Request):
+    """
+    Create many clients in one batch without pivpn.
+    Body: JSON [{"name": ..., "user": ...}, ...] (or a list of names), a CSV body
+    (`name,user` per line), or a multipart form with the CSV in `file`.
+    """
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+
+    ctype = request.headers.get("content-type", "")
+    try:
+        if ctype.startswith("application/json"):
+            data = await request.json()
+            rows = [r if isinstance(r, dict) else {"name": r} for r in data]
+        elif ctype.startswith("multipart/form-data"):
+            form = await request.form()
+            rows = parse_bulk_csv((await form["file"].read()).decode())
+        else:
+            rows = parse_bulk_csv((await request.body()).decode())
+        names = [str(r["name"]).strip() for r in rows]
+        pairs = [(name, r.get("user") or None) for name, r in zip(names, rows)]
+    except (KeyError, TypeError, ValueError, UnicodeDecodeError):
+        return JSONResponse({"error": "Expected a JSON list or CSV of name[,user]"}, status_code=400)
+    if not names:
+        return JSONResponse({"error": "No clients given"}, status_code=400)
+
+    try:
+        created = await asyncio.to_thread(provision_clients, names)
+    except ApplyError as e:
+        # the peers were written and only the reload failed, so they still get their links
+        link_clients(pairs)
+        log_admin_action(admin, "bulk_add_clients", f"{len(names)} clients", f"reload failed: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+    except ProvisionError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # Link to users in one transaction
+    link_clients(pairs)
+    log_admin_action(admin, "bulk_add_clients", f"{len(created)} clients", ", ".join(names[:20]))
+    return {"created": created}
 
 @app.get("/api/configs")
 async def api_configs():
     """Return a list of all client configs"""
     return {"configs": list_configs()}
 
+def _validators(request: Request, entry):
+    """
+    Caching headers for a cached config, and whether the client's copy is current
+    (If-None-Match wins over If-Modified-Since, as in RFC 9110).
+    """
+    headers = {
+        "ETag": entry.etag,
+        "Last-Modified": formatdate(entry.mtime, usegmt=True),
+        "Cache-Control": "private, no-cache",  # configs hold private keys: revalidate, never share
+    }
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        fresh = inm.strip() == "*" or entry.etag in [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return headers, fresh
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return headers, int(entry.mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            pass
+    return headers, False
+
+def _config_response(request: Request, entry, body, media_type, extra=None):
+    headers, fresh = _validators(request, entry)
+    if fresh:
+        # a 304 repeats the validators and Cache-Control the 200 would carry (RFC 9110 15.4.5)
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers={**headers, **(extra or {})})
+
 @app.get("/api/config/{name}", response_class=PlainTextResponse)
-async def api_config(name: str):
+async def api_config(request: Request, name: str):
     """Show config text"""
-    conf = read_config(name)
-    if not conf:
+    entry = config_cache.get(name)
+    if not entry:
         return PlainTextResponse("Config not found", status_code=404)
-    return PlainTextResponse(conf, media_type="text/plain")
+    return _config_response(request, entry, entry.text, "text/plain")
 
 @app.get("/api/config/{name}/download")
-async def api_download_config(name: str):
+async def api_download_config(request: Request, name: str):
     """Download config"""
-    conf = read_config(name)
-    if not conf:
+    entry = config_cache.get(name)
+    if not entry:
         return PlainTextResponse("Config not found", status_code=404)
-    headers = {"Content-Disposition": f"attachment; filename={name}.conf"}
-    return PlainTextResponse(conf, headers=headers, media_type="text/plain")
+    return _config_response(request, entry, entry.text, "text/plain",
+                            {"Content-Disposition": f"attachment; filename={name}.conf"})
+
+@app.get("/api/configs/zip")
+def api_configs_zip(request: Request, names: str = "", qr: bool = False):
+    """
+    Stream a ZIP of client configs: `names` is a comma-separated list (default: all),
+    `qr=1` adds NAME.png QR codes. Built member by member, so memory stays flat.
+    """
+    admin = require_admin(request)
+    if not admin:
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    if names:
+        selected = list(dict.fromkeys(n.strip() for n in names.split(",") if n.strip()))
+        bad = [n for n in selected if not NAME_RE.match(n)]
+        if bad:
+            return JSONResponse({"error": f"Invalid client names: {', '.join(bad[:10])}"}, status_code=400)
+    else:
+        selected = sorted(list_configs())
+    log_admin_action(admin, "download_configs", f"{len(selected)} clients", "with qr" if qr else "")
+    headers = {"Content-Disposition": "attachment; filename=wireguard-configs.zip", "Cache-Control": "no-store"}
+    return StreamingResponse(iter_configs_zip(selected, with_qr=qr), media_type="application/zip", headers=headers)
 
 @app.delete("/api/config/{name}")
-async def api_delete_config(name: str):
-    """Delete config file"""
-    ok = delete_config(name)
-    return {"deleted": ok}
+async def api_delete_config(request: Request, name: str):
+    """Queue deletion of a client (pivpn -r); returns the job id"""
+    job_id = jobs.submit("delete_config", name, {"name": name}, get_username_from_request(request))
+    return {"job_id": job_id}
 
 @app.post("/api/config/{name}/toggle")
-async def api_toggle_config(name: str, enable: bool = Form(...)):
-    """Enable or disable config file"""
-    ok = toggle_config(name, enable)
-    return {"ok": ok}
+async def api_toggle_config(request: Request, name: str, enable: bool = Form(...)):
+    """Queue enabling or disabling a config file; returns the job id"""
+    job_id = jobs.submit("toggle_config", name, {"name": name, "enable": enable}, get_username_from_request(request))
+    return {"job_id": job_id}
+
+@app.get("/api/jobs/{job_id}")
+async def api_job(request: Request, job_id: int):
+    """Status, progress and result of a background job, for admins and the user who started it"""
+    username = get_username_from_request(request)
+    if not username:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    job = get_job(job_id)
+    if not job or (job["created_by"] != username and get_user_role(username) != "admin"):
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    del job["params"]  # may hold mail bodies with temporary passwords
+    return job
 
 
 # --------------------
@@ -268,25 +322,145 @@ async def websocket_endpoint(websocket: WebSocket):
 # --------------------
 # REST endpoints
 # --------------------
+LONG_POLL_MAX = 60.0  # seconds a ?since= request may hang
+SSE_KEEPALIVE = 15.0  # seconds between comment lines on an idle event stream
+
 @app.get("/api/clients")
-async def api_clients():
-    clients = get_connected_clients() # contains array of client configs
-    total = get_total_clients() # contains the total number of config files
+async def api_clients(request: Request, since: int = None, timeout: float = Query(25.0, ge=0, le=LONG_POLL_MAX)):
+    """
+    Current peers. With ?since=<version> this is a long-poll: it returns the next
+    snapshot after that version (same JSON as a WebSocket message, carrying its own
+    `version`) as soon as the collector publishes it, or 204 after `timeout` seconds.
+    """
+    if since is not None:
+        if not await wsmanager.wait_newer(since, timeout):
+            return Response(status_code=204, headers={"X-Snapshot-Version": str(wsmanager.version)})
+        headers = {"X-Snapshot-Version": str(wsmanager.version), "Cache-Control": "no-store", "Vary": "Accept-Encoding"}
+        if accepts(request.headers.get("accept-encoding", ""), "gzip"):
+            # compressed once per version here; the gzip middleware skips ?since= requests
+            headers["Content-Encoding"] = "gzip"
+            return Response(wsmanager.body("gzip"), media_type="application/json", headers=headers)
+        return Response(wsmanager.body(), media_type="application/json", headers=headers)
+
+    snapshot = wsmanager.snapshot
+    if snapshot is not None:
+        # served from the collector's last tick; no extra wg fork per request
+        clients, total = snapshot["list"], snapshot["total"]
+    else:
+        clients = get_connected_clients() # contains array of client configs
+        total = get_total_clients() # contains the total number of config files
     active = [c for c in clients if c.get("connected")] # contans array the active clients
     return {"total": total, "connected": active, "clients": clients}
 
+@app.get("/api/clients/events")
+async def api_clients_events(request: Request):
+    """
+    Server-Sent Events stream of snapshots (`event: snapshot`, `id` = version), for
+    consumers that cannot hold a WebSocket. Resumes after Last-Event-ID if given.
+    """
+    try:
+        last = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last = -1
+
+    async def stream():
+        nonlocal last
+        yield b"retry: 3000\n\n"
+        while True:
+            if await wsmanager.wait_newer(last, SSE_KEEPALIVE):
+                last = wsmanager.version
+                yield wsmanager.body("sse")
+            else:
+                yield b": keepalive\n\n"
+
+    headers = {"Cache-Control": "no-store", "X-Accel-Buffering": "no"}  # keep nginx from buffering the stream
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+@app.get("/api/fleet")
+async def api_fleet():
+    """Per-node status in hub mode (empty on a standalone dashboard)"""
+    snapshot = wsmanager.snapshot or {}
+    return {"nodes": snapshot.get("nodes", [])}
+
+@app.post("/api/hub/ingest")
+async def api_hub_ingest(request: Request):
+    """Receive a peer batch from an agent (see app/hub.py)"""
+    if settings.mode != "hub" or not settings.hub_token:
+        return JSONResponse({"error": "Hub mode disabled"}, status_code=404)
+    auth = request.headers.get("authorization", "")
+    if not secrets.compare_digest(auth, f"Bearer {settings.hub_token}"):
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if not wsmanager.is_collector:
+        # fleet state lives in the collector worker only
+        return JSONResponse({"error": "Not the collector worker, retry"}, status_code=503)
+    try:
+        batch = await request.json()
+        ok = fleet.apply(batch)
+    except FleetFull:
+        return JSONResponse({"error": "Too many nodes"}, status_code=429)
+    except (KeyError, TypeError, ValueError):
+        return JSONResponse({"error": "Malformed batch"}, status_code=400)
+    if not ok:
+        return JSONResponse({"resync": True, "expected_seq": fleet.expected_seq(batch["node"])}, status_code=409)
+    return {"ok": True, "seq": batch["seq"]}
+
 @app.get("/api/traffic/{client_name}")
 async def api_traffic(client_name: str, hours: int = 24):
     rows = query_traffic(client_name=client_name, hours=hours)
     return {"client": client_name, "hours": hours, "rows": rows}
 
+MAX_HOURS = 366 * 24  # session queries look back at most a year
+
+@app.get("/api/client/{name}/sessions")
+def api_client_sessions(name: str, limit: int = 50, before: str = None):
+    """
+    Connect/disconnect history, newest first. Pass the returned `next` as `before`.
+    An open session has end_ts null and its bytes so far from the latest snapshot.
+    """
+    limit = max(1, min(limit, 500))
+    try:
+        # "start_ts:id" of the last row of the previous page; ids break ties within a second
+        cursor = tuple(int(v) for v in before.split(":", 1)) if before else None
+    except ValueError:
+        return JSONResponse({"error": "before must be a cursor returned as next"}, status_code=400)
+    rows = get_sessions(name, limit=limit + 1, before=cursor)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    c = next((c for c in (wsmanager.snapshot or {}).get("list", ()) if c["name"] == name), None)
+    for r in rows:
+        if r["end_ts"] is None and c is not None:
+            r["rx_bytes"] = max(0, c.get("rx_raw", 0) - (r["rx_start"] or 0))
+            r["tx_bytes"] = max(0, c.get("tx_raw", 0) - (r["tx_start"] or 0))
+        del r["rx_start"], r["tx_start"]
+    return {"client": name, "items": rows, "next": f"{rows[-1]['start_ts']}:{rows[-1]['id']}" if more else None}
+
+@app.get("/api/client/{name}/uptime")
+def api_client_uptime(name: str, hours: int = Query(24, ge=1, le=MAX_HOURS)):
+    """Seconds connected over the last `hours`, from the session table."""
+    now = time.time()
+    since = now - hours * 3600
+    rows = get_sessions_overlapping(since, now, client_name=name)
+    up = uptime(rows, since, now, now)
+    return {"client": name, "hours": hours, "uptime_seconds": up,
+            "ratio": round(up / (hours * 3600), 4), "sessions": len(rows)}
+
+@app.get("/api/sessions/concurrency")
+def api_sessions_concurrency(hours: int = Query(24, ge=1, le=MAX_HOURS), bucket: int = Query(300, ge=1, le=86400)):
+    """Peak concurrent connections per `bucket` seconds over the last `hours`."""
+    now = time.time()
+    since = now - hours * 3600
+    points = concurrency(get_sessions_overlapping(since, now), since, now, bucket, now)
+    return {"hours": hours, "bucket": points[1]["ts"] - points[0]["ts"] if len(points) > 1 else bucket, "points": points}
+
 @app.get("/api/client/{name}/qr")
-async def api_client_qr(name: str):
-    png = get_qr_png(name)
+def api_client_qr(request: Request, name: str):
+    entry = config_cache.get(name)
+    png = entry.qr() if entry else None
     if png is None:
         return HTMLResponse("Not found", status_code=404)
-    return StreamingResponse(iter([png]), media_type="image/png")
+    return _config_response(request, entry, png, "image/png")
 
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=False)
+    import uvicorn
+    uvicorn.run("app.main:app", host=settings.host, port=settings.port, reload=False)
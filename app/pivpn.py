@@ -1,10 +1,21 @@
+import fcntl
+import os
 import subprocess
+import threading
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Optional
 import time
+from app.settings import settings
 
-CONFIG_DIR = "/etc/wireguard/configs"
-WG_CMD = ["sudo", "wg", "show", "all", "dump"]  # tab-separated machine-readable output
+CONFIG_DIR = settings.config_dir
+WG_CMD = list(settings.wg_cmd)  # tab-separated machine-readable output
+CONNECTED_WINDOW = settings.connected_window
+PIVPN_LOCK = settings.pivpn_lock
+SYS_NET = "/sys/class/net"
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
 
 
 # ---------------------- Helper functions ----------------------
@@ -20,13 +31,13 @@ def _human_bytes(n: int) -> str:
     return f"{n:.2f} PB"
 
 
-def _read_client_address_map() -> Dict[str, str]:
+def _read_client_address_map(config_dir=None) -> Dict[str, str]:
     """
     Read each client .conf and build a mapping: {virtual_ip: client_name}.
     Looks for lines like: Address = 10.6.0.2/32
     """
     mapping = {}
-    cfg_dir = Path(CONFIG_DIR)
+    cfg_dir = Path(config_dir or CONFIG_DIR)
     if not cfg_dir.exists():
         return mapping
 
@@ -50,6 +61,39 @@ def _read_client_address_map() -> Dict[str, str]:
     return mapping
 
 
+def _read_client_keys(config_dir=None) -> Dict[str, str]:
+    """
+    Read pivpn's clients.txt ("name public_key created_ts ip" per line) into
+    {public_key: client_name}. Unlike the .conf scan, this still names a client
+    whose config was renamed or whose peer is disabled.
+    """
+    mapping = {}
+    try:
+        text = (Path(config_dir or CONFIG_DIR) / "clients.txt").read_text(errors="ignore")
+    except OSError:
+        return mapping
+    for line in text.splitlines():
+        parts = line.split()
+        if len(parts) >= 2:
+            mapping[parts[1]] = parts[0]
+    return mapping
+
+
+@contextmanager
+def pivpn_lock():
+    """
+    Hold the exclusive flock() that every writer of the server config and
+    clients.txt takes (pivpn -a/-r/-on/-off and bulk provisioning), so they
+    take turns across threads and worker processes. Blocks until it is free.
+    """
+    fd = os.open(PIVPN_LOCK, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # closing the descriptor drops the lock
+
+
 def get_total_clients() -> int:
     """Return total number of client config files (.conf)."""
     try:
@@ -60,6 +104,47 @@ def get_total_clients() -> int:
 
 # ---------------------- Core WireGuard parser ----------------------
 
+def build_peer_entry(name: str, endpoint: str, vip: str, rx: int, tx: int, hs, now=None) -> Dict:
+    """
+    Build one client dict (the shape documented on get_connected_clients) from raw
+    counters. `hs` is the latest handshake in epoch seconds, 0 if never, None if unknown.
+    Also used by the hub to expand the compact peer rows agents send.
+    """
+    now = time.time() if now is None else now
+    connected = False
+    if hs is None:
+        last_seen = "unknown"
+    else:
+        age = now - hs
+        if hs > 0 and age <= CONNECTED_WINDOW:  # within 5 minutes by default
+            connected = True
+        # Then format last_seen (as before)
+        if hs > 0:
+            if age < 60:
+                last_seen = f"{int(age)}s ago"
+            elif age < 3600:
+                last_seen = f"{int(age/60)}m ago"
+            elif age < 86400:
+                last_seen = f"{int(age/3600)}h ago"
+            else:
+                last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(hs))
+        else:
+            last_seen = "offline"
+
+    return {
+        "name": name,
+        "remote_ip": endpoint or "",
+        "virtual_ip": vip,
+        "bytes_received": _human_bytes(rx),
+        "bytes_sent": _human_bytes(tx),
+        "rx_raw": rx,
+        "tx_raw": tx,
+        "latest_handshake": hs or 0,
+        "last_seen": last_seen,
+        "connected": connected
+    }
+
+
 def get_connected_clients() -> List[Dict]:
     """
     Use `sudo wg show all dump` to list active peers and data usage.
@@ -74,8 +159,11 @@ def get_connected_clients() -> List[Dict]:
         "bytes_sent": "8.14 MB",
         "rx_raw": 5481302,
         "tx_raw": 8532001,
+        "latest_handshake": 1700000000,
         "last_seen": "3m ago",
-        "connected": True
+        "connected": True,
+        "public_key": "base64...",
+        "interface": "wg0"
       }
     ]
     """
@@ -133,40 +221,35 @@ def get_connected_clients() -> List[Dict]:
             tx = 0
 
         # Handshake (epoch seconds)
-        connected = False
         try:
             hs = int(latest_handshake)
-            age = time.time() - hs
-            if hs > 0 and age <= 300:  # within 5 minutes
-                connected = True
-            # Then format last_seen (as before)
-            if hs > 0:
-                if age < 60:
-                    last_seen = f"{int(age)}s ago"
-                elif age < 3600:
-                    last_seen = f"{int(age/60)}m ago"
-                elif age < 86400:
-                    last_seen = f"{int(age/3600)}h ago"
-                else:
-                    last_seen = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(hs))
-            else:
-                last_seen = "offline"
         except Exception:
-            last_seen = "unknown"
-
-        clients.append({
-            "name": name,
-            "remote_ip": endpoint or "",
-            "virtual_ip": vip,
-            "bytes_received": _human_bytes(rx),
-            "bytes_sent": _human_bytes(tx),
-            "rx_raw": rx,
-            "tx_raw": tx,
-            "last_seen": last_seen,
-            "connected": connected
-        })
+            hs = None
+
+        entry = build_peer_entry(name, endpoint, vip, rx, tx, hs)
+        # identity for the collector's counter checkpoint (app/wsmanager.py)
+        entry["public_key"] = pubkey
+        entry["interface"] = iface
+        clients.append(entry)
 
     return clients
+
+
+def interface_epoch(iface: str) -> Optional[str]:
+    """
+    Identify the current incarnation of a WireGuard interface as "boot_id:ifindex".
+    The kernel gives a re-created interface a new ifindex, but after a reboot wg0
+    usually gets the same one back, hence the boot id. Either way its transfer
+    counters restarted at 0. Returns None where sysfs is not available.
+    """
+    try:
+        ifindex = Path(SYS_NET, iface, "ifindex").read_text().strip()
+    except OSError:
+        return None
+    try:
+        return f"{Path(BOOT_ID).read_text().strip()}:{ifindex}"
+    except OSError:
+        return ifindex
     
 # --- Config management functions ---
 
@@ -174,12 +257,120 @@ def list_configs() -> List[str]:
     """Return all config file names without extension"""
     return [p.stem for p in Path(CONFIG_DIR).glob("*.conf")]
 
+def config_exists(name: str) -> bool:
+    return (Path(CONFIG_DIR) / f"{name}.conf").exists()
+
+class ConfigFile:
+    """A client config as last read from disk; `qr` is rendered on first use."""
+    __slots__ = ("name", "text", "mtime", "etag", "_key", "_qr")
+
+    def __init__(self, name: str, text: str, st):
+        self.name = name
+        self.text = text
+        self.mtime = st.st_mtime
+        self._key = (st.st_mtime_ns, st.st_size, st.st_ino)
+        self.etag = '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+        self._qr = None
+
+    def qr(self) -> Optional[bytes]:
+        if self._qr is None:
+            try:
+                self._qr = subprocess.run(["qrencode", "-o", "-", "-t", "PNG"], input=self.text.encode(),
+                                          capture_output=True, check=True, timeout=10).stdout
+            except Exception:
+                return None
+        return self._qr
+
+
+class ConfigCache:
+    """
+    LRU of client configs keyed by name and validated by (mtime, size, inode),
+    so a hit costs one stat() and files changed by pivpn are re-read.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ConfigFile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> Optional[ConfigFile]:
+        path = Path(CONFIG_DIR) / f"{name}.conf"
+        try:
+            st = path.stat()
+        except OSError:
+            with self._lock:
+                self._entries.pop(name, None)
+            return None
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry._key == (st.st_mtime_ns, st.st_size, st.st_ino):
+                self._entries.move_to_end(name)
+                return entry
+        try:
+            entry = ConfigFile(name, path.read_text(), st)
+        except OSError:
+            return None
+        with self._lock:
+            self._entries[name] = entry
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+config_cache = ConfigCache(settings.config_cache_size)
+
+
 def read_config(name: str) -> str:
     """Read a specific WireGuard client config"""
-    path = Path(CONFIG_DIR) / f"{name}.conf"
-    if not path.exists():
-        return ""
-    return path.read_text()
+    entry = config_cache.get(name)
+    return entry.text if entry else ""
+
+
+class _ZipSink:
+    """Write-only, unseekable file for ZipFile; drained after every member."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_configs_zip(names: Iterable[str], with_qr: bool = False) -> Iterator[bytes]:
+    """
+    Stream a ZIP of NAME.conf (and NAME.png) members. Each member is yielded as
+    soon as it is written, so memory is bounded by one config plus the central
+    directory. Names without a config are skipped.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name in names:
+            entry = config_cache.get(name)
+            if entry is None:
+                continue
+            stamp = time.gmtime(entry.mtime)[:6]
+            info = zipfile.ZipInfo(f"{name}.conf", date_time=stamp)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o600 << 16
+            zf.writestr(info, entry.text)
+            if with_qr:
+                png = entry.qr()
+                if png:
+                    info = zipfile.ZipInfo(f"{name}.png", date_time=stamp)  # already compressed
+                    info.external_attr = 0o600 << 16
+                    zf.writestr(info, png)
+            yield sink.drain()
+    yield sink.drain()
 
 def delete_config(client_name: str) -> bool:
     """Delete a config file"""
@@ -189,10 +380,12 @@ def delete_config(client_name: str) -> bool:
 
         print(client_name)
         # call pivpn add
-        proc = subprocess.run(["pivpn", "-r", "-y", client_name], capture_output=True, text=True, timeout=10)
+        with pivpn_lock():
+            proc = subprocess.run(["pivpn", "-r", "-y", client_name], capture_output=True, text=True, timeout=10)
         
         if proc.returncode != 0:
-            return JSONResponse({"error": "Failed to remove client", "details": proc.stderr}, status_code=500)
+            print("Failed to remove client:", proc.stderr)
+            return False
         return True
     except Exception as e:
         print("Delete error:", e)
@@ -212,13 +405,25 @@ def toggle_config(name: str, enable: bool) -> bool:
         print("Toggle error:", e)
         return False
 
-def get_qr_png(name: str):
-    # returns raw png bytes by piping config into qrencode
-    p = Path(CONFIG_DIR) / f"{name}.conf"
-    if not p.exists():
-        return None
-    cmd = f"qrencode -o - -t PNG < {str(p)}"
+def set_client_enabled(name: str, enable: bool) -> bool:
+    """
+    Enable or disable a client with `pivpn -on` / `pivpn -off`, which comment its
+    [Peer] block back into or out of the server config and reload the interface,
+    so a disabled peer cannot connect. The client config itself stays in place.
+    """
     try:
-        return subprocess.check_output(cmd, shell=True)
-    except Exception:
-        return None
+        with pivpn_lock():
+            proc = subprocess.run(["pivpn", "-on" if enable else "-off", "-y", name],
+                                  capture_output=True, text=True, timeout=30)
+        if proc.returncode != 0:
+            print(f"Failed to {'enable' if enable else 'disable'} client:", proc.stderr)
+            return False
+        return True
+    except Exception as e:
+        print("Enable/disable error:", e)
+        return False
+
+def get_qr_png(name: str):
+    # returns raw png bytes by piping config into qrencode (cached with the config)
+    entry = config_cache.get(name)
+    return entry.qr() if entry else None
@@ -0,0 +1,349 @@
+# app/provision.py
+"""
+Native bulk peer provisioning, writing the same files `pivpn -a` would.
+
+For a batch of new clients this:
+- generates X25519 keypairs and preshared keys in-process (no `wg genkey` forks)
+- allocates addresses from a bitmap of the pivpn subnet, seeded from the client
+  configs and the server config, so N peers cost one scan instead of N
+- renders configs/NAME.conf and keys/NAME_{priv,pub,psk} like pivpn's makeCONF
+- appends every `### begin NAME ###` peer block to the server config in one
+  atomic rewrite, adds the clients.txt lines, then reloads the interface once
+
+The whole batch, from reading the server config and address index to the
+reload, runs under pivpn_lock(), the flock() the pivpn jobs (-a/-r/-on/-off)
+also hold, so a peer added meanwhile by another worker is neither overwritten
+nor given the same address.
+
+Only IPv4 pivpn installs are supported; IPv6-enabled setups are refused.
+"""
+
+import base64
+import csv
+import io
+import ipaddress
+import os
+import re
+import secrets
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from app.pivpn import _read_client_address_map, pivpn_lock
+from app.settings import settings
+
+# pivpn's own rule for client names
+NAME_RE = re.compile(r"^[a-zA-Z0-9@_-][a-zA-Z0-9.@_-]*$")
+
+class ProvisionError(Exception):
+    """Raised when a batch cannot be provisioned; nothing has been written, or it was rolled back."""
+
+
+class ApplyError(ProvisionError):
+    """Raised when the files were written but reloading the interface failed; the peers exist."""
+
+
+# ---------------------- Keys ----------------------
+
+_P = 2 ** 255 - 19
+_A24 = 121665
+
+
+def _x25519_base(scalar: bytes) -> bytes:
+    """X25519(scalar, 9) per RFC 7748, used when `cryptography` is not installed."""
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    k = int.from_bytes(k, "little")
+    x1, x2, z2, x3, z3, swap = 9, 1, 0, 9, 1, 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        if swap ^ bit:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a, b = x2 + z2, x2 - z2
+        aa, bb = a * a % _P, b * b % _P
+        e = aa - bb
+        c, d = x3 + z3, x3 - z3
+        da, cb = d * a % _P, c * b % _P
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def _public_key(private: bytes) -> bytes:
+    try:
+        from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+        from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+    except ImportError:
+        return _x25519_base(private)
+    return X25519PrivateKey.from_private_bytes(private).public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+
+def generate_keypair():
+    """Return (private, public) as base64 strings, like `wg genkey | wg pubkey`."""
+    private = bytearray(secrets.token_bytes(32))
+    # clamp like wg genkey does, so the stored key is canonical
+    private[0] &= 248
+    private[31] &= 127
+    private[31] |= 64
+    private = bytes(private)
+    return base64.b64encode(private).decode(), base64.b64encode(_public_key(private)).decode()
+
+
+def generate_psk() -> str:
+    return base64.b64encode(secrets.token_bytes(32)).decode()
+
+
+# ---------------------- Address pool ----------------------
+
+class AddressPool:
+    """Free addresses of an IPv4 subnet tracked in a bitmap (1 = used)."""
+
+    def __init__(self, network: ipaddress.IPv4Network):
+        self.network = network
+        self._base = int(network.network_address)
+        self._size = network.num_addresses
+        self._bits = bytearray((self._size + 7) // 8)
+        self._next = 0  # every index below this is known to be used
+        self.mark(network.network_address)
+        self.mark(network.broadcast_address)
+        self.mark(network.network_address + 1)  # the server
+
+    def mark(self, ip):
+        i = int(ipaddress.IPv4Address(ip)) - self._base
+        if 0 <= i < self._size:
+            self._bits[i >> 3] |= 1 << (i & 7)
+
+    def allocate(self) -> ipaddress.IPv4Address:
+        i = self._next
+        while i < self._size:
+            byte = self._bits[i >> 3]
+            if byte == 0xFF:
+                i = (i | 7) + 1  # skip a full byte at once
+                continue
+            if not byte & (1 << (i & 7)):
+                self._bits[i >> 3] |= 1 << (i & 7)
+                self._next = i + 1
+                return ipaddress.IPv4Address(self._base + i)
+            i += 1
+        self._next = self._size
+        raise ProvisionError(f"No free addresses left in {self.network}")
+
+
+# ---------------------- pivpn files ----------------------
+
+def read_setup_vars(path) -> Dict[str, str]:
+    values = {}
+    for line in Path(path).read_text().splitlines():
+        if "=" in line and not line.lstrip().startswith("#"):
+            key, value = line.split("=", 1)
+            values[key.strip()] = value.strip().strip("\"'")
+    return values
+
+
+_ALLOWED_RE = re.compile(r"^\s*AllowedIPs\s*=\s*(.+)$", re.I | re.M)
+_BEGIN_RE = re.compile(r"^### begin (.+) ###$", re.M)
+
+
+class Provisioner:
+    def __init__(self, wg_dir=None, config_dir=None, setup_vars=None, iface=None, apply_cmd=None):
+        self.wg_dir = Path(wg_dir or settings.wg_dir)
+        self.config_dir = Path(config_dir or settings.config_dir)
+        self.setup_vars = Path(setup_vars or settings.pivpn_setup_vars)
+        self.iface = iface or settings.wg_interface
+        self.apply_cmd = [a.replace("{iface}", self.iface) for a in (apply_cmd or settings.wg_apply_cmd)]
+
+    @property
+    def server_conf(self) -> Path:
+        return self.wg_dir / f"{self.iface}.conf"
+
+    def _load(self):
+        try:
+            self.vars = read_setup_vars(self.setup_vars)
+            self.server_pub = (self.wg_dir / "keys" / "server_pub").read_text().strip()
+            self.server_text = self.server_conf.read_text()
+        except OSError as e:
+            raise ProvisionError(f"Cannot read pivpn setup: {e}")
+        if self.vars.get("pivpnenableipv6") == "1":
+            raise ProvisionError("IPv6-enabled pivpn setups are not supported by bulk provisioning")
+
+        try:
+            network = ipaddress.IPv4Network(f"{self.vars['pivpnNET']}/{self.vars.get('subnetClass', '24')}", strict=False)
+        except (KeyError, ValueError) as e:
+            raise ProvisionError(f"No usable pivpnNET/subnetClass in {self.setup_vars}: {e}")
+        self.pool = AddressPool(network)
+        # config index: client .conf Address lines, plus server AllowedIPs (covers .disabled clients)
+        for ip in _read_client_address_map(self.config_dir):
+            self.pool.mark(ip)
+        for allowed in _ALLOWED_RE.findall(self.server_text):
+            for a in allowed.split(","):
+                a = a.strip().split("/")[0]
+                if a.count(".") == 3:
+                    self.pool.mark(a)
+        self.existing = set(_BEGIN_RE.findall(self.server_text))
+        self.existing.update(p.stem for p in self.config_dir.glob("*.conf"))
+        self.existing.update(p.stem for p in self.config_dir.glob("*.disabled"))
+
+    def _validate(self, names: List[str]):
+        errors, seen = [], set()
+        for name in names:
+            if not NAME_RE.match(name or ""):
+                errors.append(f"{name!r}: only letters, digits and .-@_ allowed, not starting with '.'")
+            elif name in self.existing:
+                errors.append(f"{name!r}: already exists")
+            elif name in seen:
+                errors.append(f"{name!r}: duplicated in batch")
+            seen.add(name)
+        if errors:
+            raise ProvisionError("; ".join(errors))
+
+    def _client_conf(self, priv: str, psk: str, ip) -> str:
+        v = self.vars
+        dns = ", ".join(d for d in (v.get("pivpnDNS1"), v.get("pivpnDNS2")) if d)
+        lines = ["[Interface]", f"PrivateKey = {priv}", f"Address = {ip}/{self.pool.network.prefixlen}"]
+        if dns:
+            lines.append(f"DNS = {dns}")
+        if v.get("pivpnMTU"):
+            lines.append(f"MTU = {v['pivpnMTU']}")
+        lines += ["", "[Peer]", f"PublicKey = {self.server_pub}", f"PresharedKey = {psk}",
+                  f"Endpoint = {v.get('pivpnHOST', '')}:{v.get('pivpnPORT', '51820')}",
+                  f"AllowedIPs = {v.get('ALLOWED_IPS', '0.0.0.0/0, ::0/0')}"]
+        if v.get("pivpnPERSISTENTKEEPALIVE"):
+            lines.append(f"PersistentKeepalive = {v['pivpnPERSISTENTKEEPALIVE']}")
+        return "\n".join(lines) + "\n"
+
+    def create(self, names: List[str]) -> List[Dict]:
+        """Provision all `names` or none. Returns [{name, ip, public_key}] in input order."""
+        with pivpn_lock():
+            self._load()  # read under the lock: no other writer can change it until we are done
+            self._validate(names)
+
+            peers = []
+            for name in names:
+                priv, pub = generate_keypair()
+                peers.append({"name": name, "ip": str(self.pool.allocate()), "public_key": pub,
+                              "_priv": priv, "_psk": generate_psk()})
+
+            keys = self.wg_dir / "keys"
+            now = int(time.time())
+            blocks, listing = [], []
+            for p in peers:
+                blocks.append(f"### begin {p['name']} ###\n[Peer]\nPublicKey = {p['public_key']}\n"
+                              f"PresharedKey = {p['_psk']}\nAllowedIPs = {p['ip']}/32\n### end {p['name']} ###\n")
+                listing.append(f"{p['name']} {p['public_key']} {now} {p['ip']}\n")
+
+            created = []  # files this batch created, removed again if a later write fails
+            clients_txt = self.config_dir / "clients.txt"
+            clients_size = clients_txt.stat().st_size if clients_txt.exists() else None
+            server_written = False
+            try:
+                for p in peers:
+                    for suffix, value in (("priv", p["_priv"]), ("pub", p["public_key"]), ("psk", p["_psk"])):
+                        _write_new(keys / f"{p['name']}_{suffix}", value + "\n", created)
+                    _write_new(self.config_dir / f"{p['name']}.conf",
+                               self._client_conf(p["_priv"], p["_psk"], p["ip"]), created)
+
+                # one rewrite of the server config for the whole batch
+                text = self.server_text
+                if text and not text.endswith("\n"):
+                    text += "\n"
+                _atomic_write(self.server_conf, text + "".join(blocks))
+                server_written = True
+                if clients_size is None:
+                    created.append(clients_txt)
+                with open(clients_txt, "a") as f:
+                    f.write("".join(listing))
+                self._copy_to_home(peers, created)
+            except OSError as e:
+                self._rollback(created, server_written, clients_txt, clients_size)
+                raise ProvisionError(f"Cannot write peer files, nothing was added: {e}")
+
+            self.apply()
+            return [{k: v for k, v in p.items() if not k.startswith("_")} for p in peers]
+
+    def _rollback(self, created, server_written, clients_txt, clients_size):
+        """Undo a half-written batch: restore the server config and clients.txt, drop new files."""
+        try:
+            if server_written:
+                _atomic_write(self.server_conf, self.server_text)
+            if clients_size is not None:
+                os.truncate(clients_txt, clients_size)
+        except OSError as e:
+            print("Provisioning rollback incomplete:", e)
+        for path in reversed(created):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print("Provisioning rollback could not remove", path, e)
+
+    def _copy_to_home(self, peers, created):
+        # pivpn also drops a copy in the install user's ~/configs
+        home = self.vars.get("install_home")
+        if not home or not Path(home, "configs").is_dir():
+            return
+        for p in peers:
+            dest = Path(home, "configs", f"{p['name']}.conf")
+            if not dest.exists():
+                created.append(dest)
+            shutil.copyfile(self.config_dir / f"{p['name']}.conf", dest)
+            try:
+                shutil.chown(dest, user=self.vars.get("install_user"), group=self.vars.get("install_user"))
+            except (LookupError, OSError, ValueError):
+                pass
+
+    def apply(self):
+        """Load the server config into the running interface in one call."""
+        try:
+            proc = subprocess.run(self.apply_cmd, capture_output=True, text=True, timeout=30)
+        except (OSError, subprocess.SubprocessError) as e:
+            raise ApplyError(f"Peers written but reload failed: {e}")
+        if proc.returncode != 0:
+            raise ApplyError(f"Peers written but reload failed: {proc.stderr.strip()}")
+
+
+def _write_private(path: Path, text: str):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+
+
+def _write_new(path: Path, text: str, created: list):
+    """_write_private, recording `path` in `created` if it did not exist before."""
+    if not path.exists():
+        created.append(path)
+    _write_private(path, text)
+
+
+def _atomic_write(path: Path, text: str):
+    tmp = path.with_name(f".{path.name}.tmp")
+    _write_private(tmp, text)
+    try:
+        shutil.copymode(path, tmp)
+    except OSError:
+        pass
+    os.replace(tmp, path)
+
+
+def parse_bulk_csv(text: str) -> List[Dict]:
+    """Rows of `name[,user]`; a leading `name,...` header line is skipped."""
+    rows = []
+    for rec in csv.reader(io.StringIO(text)):
+        if not rec or not rec[0].strip() or rec[0].strip().startswith("#"):
+            continue
+        if not rows and rec[0].strip().lower() == "name":
+            continue
+        rows.append({"name": rec[0].strip(), "user": rec[1].strip() if len(rec) > 1 and rec[1].strip() else None})
+    return rows
+
+
+def provision_clients(names: List[str], provisioner: Optional[Provisioner] = None) -> List[Dict]:
+    return (provisioner or Provisioner()).create(names)
@@ -0,0 +1,212 @@
+# app/quotas.py
+"""
+Daily/monthly data quotas per peer or per user, enforced by the collector.
+
+Usage is counted in memory from the per-tick traffic deltas the collector
+already computes: each peer maps to at most one peer quota and one user
+quota, so a tick costs two dict lookups per peer. Counters are checkpointed
+to `quota_usage` every QUOTA_CHECKPOINT seconds (a crash loses at most that
+much usage), and that is also when quota definitions and peer->user links
+are re-read, so admin changes take effect without a restart.
+
+Peers are identified by public key, resolved to their pivpn client name
+through clients.txt, so a peer whose config is missing or renamed is still
+charged to the right quota. A quota that reaches its limit disables its
+peer(s) with `pivpn -off` (the set_client_enabled job), which takes the peer
+off the interface, and records them in `quota_blocks`. At period rollover,
+when a limit is raised above the usage, or when the quota is deleted, only
+the peers it disabled are re-enabled; peers an admin disabled stay disabled.
+Periods follow local time: a day starts at midnight, a month on the 1st.
+"""
+
+import time
+from typing import Dict, List, Optional, Tuple
+from app.database import (
+    get_quotas,
+    save_quota_usage,
+    get_quota_blocks,
+    set_quota_blocks,
+    get_client_owners,
+    log_admin_action,
+)
+from app.pivpn import _read_client_keys
+from app.settings import settings
+
+SCOPES = ("peer", "user")
+PERIODS = ("day", "month")
+
+
+def period_start(period: str, now: float) -> int:
+    t = time.localtime(now)
+    day = t.tm_mday if period == "day" else 1
+    return int(time.mktime((t.tm_year, t.tm_mon, day, 0, 0, 0, 0, 0, -1)))
+
+
+def period_end(period: str, start: float) -> int:
+    t = time.localtime(start)
+    if period == "day":
+        return int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1)))
+    return int(time.mktime((t.tm_year, t.tm_mon + 1, 1, 0, 0, 0, 0, 0, -1)))  # mktime normalises month 13
+
+
+class Quota:
+    __slots__ = ("scope", "target", "period", "limit", "used", "start", "end", "dirty", "enforced")
+
+    def __init__(self, scope, target, period, limit, used, start):
+        self.scope = scope
+        self.target = target
+        self.period = period
+        self.limit = limit
+        self.used = used
+        self.start = start
+        self.end = period_end(period, start)
+        self.dirty = False
+        self.enforced = False  # over the limit and its peers disabled
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.scope, self.target)
+
+
+class QuotaTracker:
+    def __init__(self, checkpoint_interval: float):
+        self.checkpoint_interval = checkpoint_interval
+        self._quotas: Dict[Tuple[str, str], Quota] = {}
+        self._by_peer: Dict[str, Quota] = {}
+        self._by_user: Dict[str, Quota] = {}
+        self._owner: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}  # public key -> client name
+        self._peers_of: Dict[str, List[str]] = {}
+        self._blocked: Dict[str, Tuple[str, str]] = {}  # peers disabled by a quota
+        self._actions: List[Tuple[str, bool]] = []
+        self._next_sync: Optional[float] = None
+        self._next_rollover = float("inf")
+
+    def reset(self):
+        """Drop in-memory state (e.g. on collector handover); the next tick reloads from the DB."""
+        self.__init__(self.checkpoint_interval)
+
+    # ---- per tick ----
+
+    def add(self, name: str, nbytes: int, now: float, public_key: Optional[str] = None):
+        """Count `nbytes` for the peer with `public_key` (`name` if pivpn does not know it). O(1)."""
+        if self._next_sync is None:
+            self.sync(now)
+        if nbytes <= 0:
+            return
+        name = self._names.get(public_key, name)
+        for q in (self._by_peer.get(name), self._by_user.get(self._owner.get(name))):
+            if q is None:
+                continue
+            q.used += nbytes
+            q.dirty = True
+            if q.used >= q.limit and (not q.enforced or name not in self._blocked):
+                self._exceeded(q, name)
+
+    def tick(self, now: float):
+        """Rollover and periodic checkpoint; cheap unless one of them is due."""
+        if self._next_sync is None or now >= self._next_sync:
+            self.sync(now)
+        elif now >= self._next_rollover:
+            self._rollover(now)
+
+    def drain_actions(self) -> List[Tuple[str, bool]]:
+        """(client name, enable) changes decided since the last call."""
+        actions, self._actions = self._actions, []
+        return actions
+
+    # ---- enforcement ----
+
+    def _exceeded(self, q: Quota, name: str):
+        # the first time a user quota trips, all the user's peers go; later only stragglers
+        if q.enforced or q.scope == "peer":
+            names = [name]
+        else:
+            names = [name] + [n for n in self._peers_of.get(q.target, ()) if n != name]
+        q.enforced = True
+        added = []
+        for n in names:
+            if n not in self._blocked:
+                self._blocked[n] = q.key
+                self._actions.append((n, False))
+                added.append((n, q.scope, q.target))
+        if added:
+            set_quota_blocks(added, [])
+            log_admin_action("quota", "quota_disable", f"{q.scope}:{q.target}",
+                             f"{q.used} of {q.limit} bytes this {q.period}: disabled {', '.join(a[0] for a in added)}")
+
+    def _release(self, key: Tuple[str, str], reason: str):
+        if key in self._quotas:
+            self._quotas[key].enforced = False
+        names = [n for n, k in self._blocked.items() if k == key]
+        if not names:
+            return
+        for n in names:
+            del self._blocked[n]
+            self._actions.append((n, True))
+        set_quota_blocks([], names)
+        log_admin_action("quota", "quota_enable", f"{key[0]}:{key[1]}", f"{reason}: enabled {', '.join(names)}")
+
+    def _rollover(self, now: float):
+        for q in self._quotas.values():
+            if now >= q.end:
+                q.start = period_start(q.period, now)
+                q.end = period_end(q.period, q.start)
+                q.used = 0
+                q.dirty = True
+                self._release(q.key, "new period")
+        self._next_rollover = min((q.end for q in self._quotas.values()), default=float("inf"))
+
+    # ---- checkpoint / reload ----
+
+    def sync(self, now: float):
+        """Save usage, then re-read quota definitions, blocks and peer owners."""
+        self.checkpoint()
+        fresh: Dict[Tuple[str, str], Quota] = {}
+        for row in get_quotas():
+            key = (row["scope"], row["target"])
+            old = self._quotas.get(key)
+            if old is not None and old.period == row["period"]:
+                old.limit = row["limit_bytes"]
+                fresh[key] = old
+            elif row["period_start"] is not None and old is None:
+                fresh[key] = Quota(*key, row["period"], row["limit_bytes"], row["bytes"], row["period_start"])
+            else:
+                fresh[key] = Quota(*key, row["period"], row["limit_bytes"], 0, period_start(row["period"], now))
+        self._quotas = fresh
+        self._by_peer = {t: q for (s, t), q in fresh.items() if s == "peer"}
+        self._by_user = {t: q for (s, t), q in fresh.items() if s == "user"}
+        self._owner = get_client_owners()
+        self._names = _read_client_keys()
+        self._peers_of = {}
+        for peer, user in self._owner.items():
+            self._peers_of.setdefault(user, []).append(peer)
+        self._blocked = get_quota_blocks()
+        for key in set(self._blocked.values()):
+            if key in fresh:
+                fresh[key].enforced = True
+
+        # deleted quotas and raised limits give their peers back
+        for key in set(self._blocked.values()):
+            q = fresh.get(key)
+            if q is None:
+                self._release(key, "quota removed")
+            elif q.used < q.limit and now < q.end:
+                self._release(key, "limit raised")
+        self._next_sync = now + self.checkpoint_interval
+        self._next_rollover = min((q.end for q in fresh.values()), default=float("inf"))
+        if now >= self._next_rollover:
+            self._rollover(now)  # also covers a checkpoint left over from an earlier period
+
+    def checkpoint(self):
+        rows = [(q.scope, q.target, q.start, q.used) for q in self._quotas.values() if q.dirty]
+        if rows:
+            save_quota_usage(rows)
+            for q in self._quotas.values():
+                q.dirty = False
+
+    def usage(self) -> Dict[Tuple[str, str], dict]:
+        return {k: {"used": q.used, "period_start": q.start, "period_end": q.end} for k, q in self._quotas.items()}
+
+
+quotas = QuotaTracker(settings.quota_checkpoint)
@@ -0,0 +1,131 @@
+# app/sessions.py
+"""
+Connection sessions derived from handshake transitions.
+
+A peer counts as connected while its latest handshake is within
+CONNECTED_WINDOW (see app/pivpn.py). The collector feeds every tick to
+SessionTracker, which compares it with the previous tick and records only
+the transitions in the `peer_sessions` table:
+
+- disconnected -> connected opens a row (start = that handshake, endpoint,
+  and the transfer counters at that point)
+- connected -> disconnected closes it (end, bytes moved during the session)
+
+Open sessions are reloaded from the table when a process becomes the
+collector, so restarts and collector handovers do not duplicate or lose them.
+Uptime and concurrency queries read these rows only, never traffic_log.
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+from app.database import get_open_sessions, record_session_transitions
+
+# WireGuard re-handshakes every 2 minutes while traffic flows, so a peer was up
+# until at most this long after its last handshake
+REKEY_AFTER = 120
+MAX_POINTS = 2000  # cap on concurrency buckets per request
+
+
+class SessionTracker:
+    def __init__(self):
+        self._open: Optional[Dict[str, dict]] = None  # client name -> open session, None until loaded
+
+    def reset(self):
+        """Forget in-memory state; the next update reloads open sessions from the DB."""
+        self._open = None
+
+    def open_sessions(self) -> Dict[str, dict]:
+        return dict(self._open or {})
+
+    def update(self, clients: List[dict], now: float):
+        """Record the transitions between the previous tick and `clients`. O(peers), one transaction."""
+        if self._open is None:
+            self._open = get_open_sessions()
+        now = int(now)
+        seen = set()
+        opened, opened_rows, closed, gone = [], [], [], []
+        for c in clients:
+            name = c["name"]
+            seen.add(name)
+            session = self._open.get(name)
+            if c.get("connected"):
+                if session is None:
+                    start = int(c.get("latest_handshake") or now)
+                    session = {"client_name": name, "start_ts": start, "endpoint": c.get("remote_ip", ""),
+                               "rx_start": int(c.get("rx_raw", 0)), "tx_start": int(c.get("tx_raw", 0))}
+                    opened.append(session)
+                    opened_rows.append((name, start, session["endpoint"], session["rx_start"], session["tx_start"]))
+                session["last_handshake"] = int(c.get("latest_handshake") or now)
+                session["rx_last"], session["tx_last"] = int(c.get("rx_raw", 0)), int(c.get("tx_raw", 0))
+            elif session is not None:
+                hs = int(c.get("latest_handshake") or 0) or session.get("last_handshake", session["start_ts"])
+                closed.append(self._close(session, min(now, hs + REKEY_AFTER),
+                                          int(c.get("rx_raw", 0)), int(c.get("tx_raw", 0))))
+                gone.append(name)
+        # peers that vanished from the dump (removed, or the interface went down)
+        for name, session in self._open.items():
+            if name not in seen:
+                hs = session.get("last_handshake", session["start_ts"])
+                closed.append(self._close(session, min(now, hs + REKEY_AFTER),
+                                          session.get("rx_last"), session.get("tx_last")))
+                gone.append(name)
+
+        if not opened and not closed:
+            return
+        ids = record_session_transitions(opened_rows, closed)
+        for session, session_id in zip(opened, ids):
+            session["id"] = session_id
+            self._open[session["client_name"]] = session
+        for name in gone:
+            del self._open[name]
+
+    @staticmethod
+    def _close(session: dict, end: int, rx: Optional[int], tx: Optional[int]) -> tuple:
+        end = max(end, session["start_ts"])
+        rx_bytes = tx_bytes = None
+        if rx is not None:
+            # counters restart from zero when the interface is re-created
+            rx_bytes = rx - session["rx_start"] if rx >= session["rx_start"] else rx
+            tx_bytes = tx - session["tx_start"] if tx >= session["tx_start"] else tx
+        return (end, rx_bytes, tx_bytes, session["id"])
+
+
+def uptime(sessions: List[Tuple[int, Optional[int]]], since: float, until: float, now: float) -> int:
+    """Seconds of [since, until) covered by `sessions` ((start, end or None) pairs, non-overlapping per peer)."""
+    total = 0
+    for start, end in sessions:
+        end = now if end is None else end
+        total += max(0, min(end, until) - max(start, since))
+    return int(total)
+
+
+def concurrency(sessions: List[Tuple[int, Optional[int]]], since: float, until: float, bucket: float, now: float) -> List[dict]:
+    """
+    Peak number of simultaneous sessions per bucket of [since, until),
+    by sweeping the start/end events once: O(sessions log sessions + buckets).
+    """
+    bucket = max(bucket, (until - since) / MAX_POINTS, 1)
+    n = max(1, math.ceil((until - since) / bucket))
+    events = []
+    for start, end in sessions:
+        start = max(start, since)
+        end = min(now if end is None else end, until)
+        if end > start:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort()  # at equal times, ends (-1) sort before starts
+    peaks = [0] * n
+    current, t = 0, since
+    for when, delta in events:
+        if current and when > t:
+            first = int((t - since) // bucket)
+            last = min(n - 1, int((when - since - 1e-9) // bucket))
+            for b in range(first, last + 1):
+                if current > peaks[b]:
+                    peaks[b] = current
+        current += delta
+        t = when
+    return [{"ts": int(since + i * bucket), "peak": p} for i, p in enumerate(peaks)]
+
+
+sessions = SessionTracker()
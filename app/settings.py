@@ -0,0 +1,151 @@
+# app/settings.py
+"""
+Typed runtime settings, read once at import.
+
+Values come from (highest priority first):
+- the process environment
+- an env file in systemd EnvironmentFile format (KEY=VALUE per line), taken
+  from WG_DASHBOARD_ENV or ./dashboard.env in the repo root if it exists
+- the defaults below
+
+Each field names the variable it is read from in its metadata.
+"""
+
+import hashlib
+import os
+import shlex
+import socket
+import tempfile
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+
+# Per-box coordination files live in shared memory when available; the tag keeps
+# two checkouts on the same host from electing each other's collector.
+_RUNTIME_DIR = Path("/dev/shm") if Path("/dev/shm").is_dir() else Path(tempfile.gettempdir())
+_INSTANCE_TAG = hashlib.sha1(str(BASE_DIR).encode()).hexdigest()[:8]
+
+
+def _env(name, default):
+    return field(default=default, metadata={"env": name})
+
+
+@dataclass(frozen=True)
+class Settings:
+    # Web server
+    host: str = _env("HOST", "0.0.0.0")
+    port: int = _env("PORT", 8000)
+
+    # WireGuard / PiVPN
+    wg_interface: str = _env("WG_INTERFACE", "wg0")
+    config_dir: str = _env("WG_CONFIG_DIR", "/etc/wireguard/configs")
+    wg_cmd: Tuple[str, ...] = _env("WG_CMD", ("sudo", "wg", "show", "all", "dump"))
+    wg_dir: str = _env("WG_DIR", "/etc/wireguard")  # server config (<interface>.conf) and keys/
+    pivpn_setup_vars: str = _env("PIVPN_SETUP_VARS", "/etc/pivpn/wireguard/setupVars.conf")
+    # Reload the interface after bulk provisioning; {iface} is replaced by WG_INTERFACE
+    wg_apply_cmd: Tuple[str, ...] = _env("WG_APPLY_CMD", ("bash", "-c", "wg syncconf {iface} <(wg-quick strip {iface})"))
+    # flock() held by every writer of the server config/clients.txt; not per instance, so
+    # several dashboards managing the same pivpn install still take turns
+    pivpn_lock: str = _env("PIVPN_LOCK", str(_RUNTIME_DIR / "wg-dashboard-pivpn.lock"))
+    config_cache_size: int = _env("CONFIG_CACHE_SIZE", 1024)  # client configs (and their QR codes) kept in memory
+
+    # Collector
+    poll_interval: float = _env("POLL_INTERVAL", 5.0)  # seconds
+    connected_window: int = _env("CONNECTED_WINDOW", 300)  # handshake age that still counts as connected
+
+    # Multi-worker coordination: one process holds the lock and collects, the rest follow the snapshot
+    collector_lock: str = _env("COLLECTOR_LOCK", str(_RUNTIME_DIR / f"wg-dashboard-{_INSTANCE_TAG}.lock"))
+    snapshot_path: str = _env("SNAPSHOT_PATH", str(_RUNTIME_DIR / f"wg-dashboard-{_INSTANCE_TAG}.snapshot"))
+    follow_interval: float = _env("FOLLOW_INTERVAL", 0.5)  # how often followers check for a new snapshot
+
+    # Fleet mode: "standalone" collects locally, "hub" aggregates snapshots pushed by agents
+    mode: str = _env("DASHBOARD_MODE", "standalone")
+    hub_token: str = _env("HUB_TOKEN", "")  # shared secret agents must present; empty disables ingest
+    node_stale_after: float = _env("NODE_STALE_AFTER", 30.0)  # seconds without a batch before a node is stale
+    node_ttl: float = _env("NODE_TTL", 86400.0)  # nodes silent this long are dropped from the fleet
+    hub_max_nodes: int = _env("HUB_MAX_NODES", 64)
+    hub_max_peers: int = _env("HUB_MAX_PEERS", 20000)  # per node
+
+    # Agent (python -m app.agent) side of fleet mode
+    hub_url: str = _env("HUB_URL", "")
+    node_name: str = _env("NODE_NAME", socket.gethostname())
+
+    # Background jobs (run by the collector process)
+    job_workers: int = _env("JOB_WORKERS", 2)
+    job_max_attempts: int = _env("JOB_MAX_ATTEMPTS", 3)
+    job_retention: float = _env("JOB_RETENTION", 7 * 86400.0)  # seconds finished jobs are kept
+
+    # Quotas (app/quotas.py)
+    quota_checkpoint: float = _env("QUOTA_CHECKPOINT", 30.0)  # seconds between usage saves and rule reloads
+
+    # Storage & UI
+    db_path: str = _env("WG_DASHBOARD_DB", str(BASE_DIR / "data" / "dashboard.db"))
+    templates_dir: str = _env("TEMPLATES_DIR", str(BASE_DIR / "templates"))
+    static_dir: str = _env("STATIC_DIR", str(BASE_DIR / "static"))
+
+    # Outgoing mail
+    smtp_server: str = _env("SMTP_SERVER", "localhost")  # or your relay (e.g. smtp.gmail.com)
+    smtp_port: int = _env("SMTP_PORT", 25)
+    smtp_from: str = _env("SMTP_FROM", "pivpn@local")
+
+    # Alerts (app/alerts.py)
+    alert_rules: str = _env("ALERT_RULES", str(BASE_DIR / "alerts.json"))  # JSON list of rules; missing = off
+    alert_email: Tuple[str, ...] = _env("ALERT_EMAIL", ())  # recipients, space separated
+    alert_webhook: str = _env("ALERT_WEBHOOK", "")  # URL that gets each batch POSTed as JSON
+    alert_batch_interval: float = _env("ALERT_BATCH_INTERVAL", 60.0)  # seconds alerts are collected per message
+    alert_max_per_hour: int = _env("ALERT_MAX_PER_HOUR", 12)  # batches sent per hour; the rest wait
+
+
+def read_env_file(path) -> Dict[str, str]:
+    """Parse a KEY=VALUE file (comments, blank lines, `export` and quotes allowed)."""
+    values = {}
+    try:
+        text = Path(path).read_text()
+    except OSError:
+        return values
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        if key.startswith("export "):
+            key = key[len("export "):].strip()
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+            value = value[1:-1]
+        values[key] = value
+    return values
+
+
+def _coerce(raw: str, default):
+    if isinstance(default, bool):
+        return raw.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(raw)
+    if isinstance(default, float):
+        return float(raw)
+    if isinstance(default, tuple):
+        return tuple(shlex.split(raw))
+    return raw
+
+
+def load_settings(environ: Optional[Mapping[str, str]] = None) -> Settings:
+    environ = os.environ if environ is None else environ
+    env_file = environ.get("WG_DASHBOARD_ENV", str(BASE_DIR / "dashboard.env"))
+    source = {**read_env_file(env_file), **environ}
+
+    values = {}
+    for f in fields(Settings):
+        name = f.metadata["env"]
+        if name in source:
+            try:
+                values[f.name] = _coerce(source[name], f.default)
+            except ValueError:
+                print(f"Ignoring invalid {name}={source[name]!r}")
+    return Settings(**values)
+
+
+settings = load_settings()
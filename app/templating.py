@@ -0,0 +1,8 @@
+# app/templating.py
+# Single Jinja environment shared by every router (one template cache per process)
+from fastapi.templating import Jinja2Templates
+from app.assets import assets
+from app.settings import settings
+
+templates = Jinja2Templates(directory=settings.templates_dir)
+templates.env.globals["asset_url"] = assets.url  # {{ asset_url('app.js') }} -> fingerprinted URL
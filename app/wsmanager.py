@@ -1,18 +1,60 @@
 # app/wsmanager.py
 import asyncio
+import gzip
+import json
 from fastapi import WebSocket
-from typing import Set
-from app.pivpn import get_connected_clients, get_total_clients
-from app.database import insert_traffic_sample
+from typing import Optional, Set
+from app.pivpn import get_connected_clients, get_total_clients, interface_epoch
+from app.database import record_traffic_tick, load_collector_state
+from app.collector import CollectorLock, SnapshotStore
+from app.hub import fleet
+from app.sessions import sessions
+from app.alerts import alerts
+from app.quotas import quotas
+from app.jobs import jobs
+from app.settings import settings
 import time
 
-POLL_INTERVAL = 5  # seconds
+POLL_INTERVAL = settings.poll_interval  # seconds
+FOLLOW_INTERVAL = settings.follow_interval  # seconds
+HUB_MODE = settings.mode == "hub"
+
+# Counter checkpoint (see _collect): unchanged peers are rewritten this often so their
+# rows are not pruned as stale, and rows of peers gone for STATE_TTL are dropped
+STATE_REFRESH = 86400.0
+STATE_TTL = 30 * 86400.0
+
+
+def _epoch_changed(old: Optional[str], new: Optional[str]) -> bool:
+    """Whether the interface was re-created (or the host rebooted) between two interface_epoch values."""
+    if None in (old, new):
+        return False
+    if ":" not in old and ":" in new:
+        # checkpoint written before boot ids were recorded: only the ifindex can be compared
+        new = new.rpartition(":")[2]
+    return old != new
+
 
 class WSManager:
     def __init__(self):
         self.active: Set[WebSocket] = set()
         self._task = None
-        self._last_totals = {}  # map client -> (bytes_in, bytes_out)
+        self._counters = None  # public key -> (interface epoch, rx, tx) of the last tick; None until loaded
+        self._fresh_install = False
+        self._next_refresh = 0.0
+        # latest snapshot, kept both decoded (for REST) and encoded (for fan-out)
+        self.snapshot: Optional[dict] = None
+        self.encoded: Optional[str] = None
+        self.version = 0
+        # wakes every long-poll/SSE waiter once per new snapshot (replaced on each publish)
+        self._published = asyncio.Event()
+        self._bodies = {}  # per-version encodings for HTTP readers: "json", "gzip", "sse"
+        self._lock = CollectorLock(settings.collector_lock)
+        self._store = SnapshotStore(settings.snapshot_path)
+
+    @property
+    def is_collector(self) -> bool:
+        return self._lock.held
 
     async def start(self):
         if not self._task:
@@ -22,51 +64,160 @@ class WSManager:
         if self._task:
             self._task.cancel()
             self._task = None
+        self._lock.release()
 
     async def _poll_loop(self):
         while True:
-            clients = get_connected_clients()
+            try:
+                if self._lock.held or self._become_collector():
+                    await self.poll_once()
+                else:
+                    await self.follow_once()
+            except Exception as e:
+                print("Collector tick failed:", e)
+            await asyncio.sleep(POLL_INTERVAL if self._lock.held else FOLLOW_INTERVAL)
+
+    def _become_collector(self) -> bool:
+        if not self._lock.acquire():
+            return False
+        # the previous collector may have opened/closed sessions since we last looked
+        sessions.reset()
+        self._counters = None  # reload the previous collector's checkpoint
+        quotas.reset()
+        # continue the version sequence of the previous collector, if any
+        data = self._store.read()
+        if data:
+            try:
+                self.version = max(self.version, json.loads(data).get("version", 0))
+            except ValueError:
+                pass
+        return True
+
+    def _collect(self):
+        """Blocking part of a tick (wg fork, config scan, DB writes); runs in a thread."""
+        clients = get_connected_clients()
+        total = get_total_clients()
+        now = time.time()
+
+        if self._counters is None:
+            self._counters = load_collector_state(STATE_TTL)
+            # no checkpoint at all: today's counters are history we never saw, not new traffic
+            self._fresh_install = not self._counters
+            self._next_refresh = 0.0
+        refresh = now >= self._next_refresh
+        if refresh:
+            self._next_refresh = now + STATE_REFRESH
+
+        epochs = {}
+        samples, state = [], []
+        for c in clients:
+            name = c["name"]
+            key = c.get("public_key") or name
+            iface = c.get("interface", "")
+            if iface not in epochs:
+                epochs[iface] = interface_epoch(iface)
+            epoch = epochs[iface]
+            rx, tx = c.get("rx_raw", 0), c.get("tx_raw", 0)
+            prev = self._counters.get(key)
+            if prev is None:
+                # a peer added since the last checkpoint started from zero
+                drx, dtx = (0, 0) if self._fresh_install else (rx, tx)
+            elif _epoch_changed(prev[0], epoch) or rx < prev[1] or tx < prev[2]:
+                # interface re-created or host rebooted: counters restarted, everything on them is new
+                drx, dtx = rx, tx
+            else:
+                # also covers the gap across a restart, since prev comes from the checkpoint
+                drx, dtx = rx - prev[1], tx - prev[2]
+            samples.append((name, drx, dtx))
+            current = (epoch, rx, tx)
+            if refresh or prev != current:
+                state.append((key, iface, epoch, rx, tx, now))
+            quotas.add(name, drx + dtx, now, c.get("public_key"))
+        # traffic rows and the checkpoint that produced them commit together;
+        # memory follows only once they are durable
+        record_traffic_tick(samples, state)
+        for key, iface, epoch, rx, tx, _ in state:
+            self._counters[key] = (epoch, rx, tx)
+        if samples:
+            self._fresh_install = False
+        quotas.tick(now)
+        sessions.update(clients, now)
+        return clients, total
+
+    async def poll_once(self):
+        """Run a single collection tick: read peers, log traffic deltas, publish and broadcast."""
+        if HUB_MODE:
+            # the hub does not collect locally; agents push into the fleet state
+            payload = fleet.view()
+        else:
+            clients, total = await asyncio.to_thread(self._collect)
+            for name, enable in quotas.drain_actions():
+                jobs.submit("set_client_enabled", name, {"name": name, "enable": enable}, "quota")
             active = [c for c in clients if c.get("connected")]
-            total = get_total_clients()
             payload = {"total": total, "connected": len(active), "list": clients, "ts": int(time.time())}
-           
-            # compute deltas and insert into DB
-            for c in clients:
-                name = c["name"]
-                # parse bytes strings like "12.3 MB" or "0"
-                def to_bytes(s):
-                    try:
-                        # normalize: e.g., "12.3 KB" or "123"
-                        s = s.strip()
-                        if s == "-" or s == "":
-                            return 0
-                        parts = s.split()
-                        if len(parts) == 1:
-                            return int(parts[0])
-                        val = float(parts[0])
-                        unit = parts[1].upper()
-                        if unit.startswith("KB"):
-                            return int(val * 1024)
-                        if unit.startswith("MB"):
-                            return int(val * 1024 * 1024)
-                        if unit.startswith("GB"):
-                            return int(val * 1024 * 1024 * 1024)
-                        return int(val)
-                    except Exception:
-                        return 0
-                rx = to_bytes(c.get("bytes_received","0"))
-                tx = to_bytes(c.get("bytes_sent","0"))
-                prev = self._last_totals.get(name, (rx, tx))
-                # delta = current - prev (if negative, reset)
-                drx = max(0, rx - prev[0])
-                dtx = max(0, tx - prev[1])
-                # log sample
-                insert_traffic_sample(name, drx, dtx)
-                self._last_totals[name] = (rx, tx)
-
-            # broadcast
-            await self.broadcast(payload)
-            await asyncio.sleep(POLL_INTERVAL)
+        payload["version"] = self.version + 1
+        encoded = json.dumps(payload, separators=(",", ":"))
+        self._set_snapshot(payload, encoded)
+        self._store.publish(encoded.encode())
+        await self.broadcast(encoded)
+        try:
+            alerts.evaluate(payload)
+        except Exception as e:
+            print("Alert evaluation failed:", e)
+
+    async def follow_once(self):
+        """Pick up a snapshot published by the collector process, if there is a new one."""
+        data = self._store.read_if_changed()
+        if data is None:
+            return
+        encoded = data.decode()
+        payload = json.loads(encoded)
+        if payload.get("version", 0) <= self.version:
+            return
+        self._set_snapshot(payload, encoded)
+        await self.broadcast(encoded)
+
+    def _set_snapshot(self, payload: dict, encoded: str):
+        self.snapshot = payload
+        self.encoded = encoded
+        self.version = payload["version"]
+        self._bodies = {}
+        published, self._published = self._published, asyncio.Event()
+        published.set()
+
+    def body(self, kind: str = "json") -> bytes:
+        """
+        The current snapshot encoded for HTTP readers, built at most once per version
+        however many long-polls and event streams ask for it.
+        """
+        cached = self._bodies.get(kind)
+        if cached is None:
+            raw = self.encoded.encode()
+            if kind == "gzip":
+                cached = gzip.compress(raw, 6)
+            elif kind == "sse":
+                cached = b"id: %d\nevent: snapshot\ndata: %s\n\n" % (self.version, raw)
+            else:
+                cached = raw
+            self._bodies[kind] = cached
+        return cached
+
+    async def wait_newer(self, since: int, timeout: float) -> bool:
+        """
+        Wait until a snapshot newer than `since` exists; False on timeout. A `since`
+        ahead of us (the version restarted, e.g. after a reboot) counts as newer.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.encoded is None or self.version == since:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._published.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
@@ -76,11 +227,13 @@ class WSManager:
         if websocket in self.active:
             self.active.remove(websocket)
 
-    async def broadcast(self, msg: dict):
+    async def broadcast(self, msg):
+        # encode once, not once per socket
+        text = msg if isinstance(msg, str) else json.dumps(msg, separators=(",", ":"))
         to_remove = []
         for ws in list(self.active):
             try:
-                await ws.send_json(msg)
+                await ws.send_text(text)
             except Exception:
                 to_remove.append(ws)
         for ws in to_remove:
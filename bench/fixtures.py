@@ -0,0 +1,100 @@
+# bench/fixtures.py
+"""
+Synthetic WireGuard fixtures for the benchmark suite.
+
+SyntheticFleet keeps N fake peers in memory and can write:
+- one pivpn-style client .conf per peer into a config directory
+- a `wg show all dump` file that bench/fake-wg prints back
+
+churn() mutates a fraction of the peers between ticks (traffic, handshakes,
+peers dropping offline) so deltas and connected counts move like a live box.
+"""
+
+import base64
+import os
+import random
+import time
+from pathlib import Path
+
+FAKE_WG = Path(__file__).resolve().parent / "fake-wg"
+
+
+def _key(rng: random.Random) -> str:
+    return base64.b64encode(rng.getrandbits(256).to_bytes(32, "little")).decode()
+
+
+def _vip(i: int) -> str:
+    # 10.6.0.0/16 gives room for 65k peers, skipping .0 and the server's .1
+    n = i + 2
+    return f"10.6.{n // 256}.{n % 256}"
+
+
+class SyntheticFleet:
+    def __init__(self, peers: int, iface: str = "wg0", seed: int = 1):
+        self.iface = iface
+        self.rng = random.Random(seed)
+        now = int(time.time())
+        self.peers = []
+        for i in range(peers):
+            online = self.rng.random() < 0.6
+            self.peers.append({
+                "name": f"peer{i:05d}",
+                "pubkey": _key(self.rng),
+                "psk": _key(self.rng),
+                "endpoint": f"198.51.{self.rng.randrange(256)}.{self.rng.randrange(256)}:{self.rng.randrange(1024, 65535)}",
+                "vip": _vip(i),
+                "handshake": now - (self.rng.randrange(120) if online else self.rng.randrange(3600, 86400)),
+                "rx": self.rng.randrange(1 << 30),
+                "tx": self.rng.randrange(1 << 30),
+            })
+
+    def write_configs(self, config_dir) -> Path:
+        config_dir = Path(config_dir)
+        config_dir.mkdir(parents=True, exist_ok=True)
+        server_pub = _key(self.rng)
+        for p in self.peers:
+            (config_dir / f"{p['name']}.conf").write_text(
+                "[Interface]\n"
+                f"PrivateKey = {_key(self.rng)}\n"
+                f"Address = {p['vip']}/24\n"
+                "DNS = 9.9.9.9, 149.112.112.112\n\n"
+                "[Peer]\n"
+                f"PublicKey = {server_pub}\n"
+                f"PresharedKey = {p['psk']}\n"
+                "Endpoint = vpn.example.net:51820\n"
+                "AllowedIPs = 0.0.0.0/0, ::0/0\n"
+            )
+        return config_dir
+
+    def dump(self) -> str:
+        lines = [f"{self.iface}\t{_key(self.rng)}\t{_key(self.rng)}\t51820\toff"]
+        for p in self.peers:
+            lines.append("\t".join([
+                self.iface, p["pubkey"], p["psk"], p["endpoint"], f"{p['vip']}/32",
+                str(p["handshake"]), str(p["rx"]), str(p["tx"]), "off",
+            ]))
+        return "\n".join(lines) + "\n"
+
+    def write_dump(self, path) -> Path:
+        # write-then-rename so a concurrent fake-wg never prints a torn file
+        path = Path(path)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(self.dump())
+        os.replace(tmp, path)
+        return path
+
+    def churn(self, fraction: float):
+        """Advance a random `fraction` of peers: move bytes, refresh or drop handshakes."""
+        now = int(time.time())
+        count = int(len(self.peers) * fraction)
+        for p in self.rng.sample(self.peers, count):
+            roll = self.rng.random()
+            if roll < 0.8:
+                p["handshake"] = now - self.rng.randrange(30)
+                p["rx"] += self.rng.randrange(1 << 20)
+                p["tx"] += self.rng.randrange(1 << 20)
+            elif roll < 0.95:
+                p["handshake"] = now - 3600
+            else:
+                # interface-style counter reset
+                p["rx"], p["tx"] = 0, 0
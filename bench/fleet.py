@@ -0,0 +1,82 @@
+# bench/fleet.py
+"""
+Run several agents against fake `wg` fixtures to exercise a local hub.
+
+Start a hub first, e.g.:
+    DASHBOARD_MODE=hub HUB_TOKEN=dev POLL_INTERVAL=2 bash run.sh
+
+then:
+    python -m bench.fleet --hub http://127.0.0.1:8000 --token dev --agents 12 --peers 200
+
+Each agent gets its own temp directory with synthetic configs and a dump
+file that this driver churns every --interval seconds, so the hub sees
+per-node deltas, new peers going idle, and (with Ctrl-C on this driver or
+--kill-after) nodes going stale.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.fixtures import FAKE_WG, SyntheticFleet
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Local multi-agent fleet against a hub")
+    ap.add_argument("--hub", required=True)
+    ap.add_argument("--token", required=True)
+    ap.add_argument("--agents", type=int, default=3)
+    ap.add_argument("--peers", type=int, default=100, help="peers per agent")
+    ap.add_argument("--churn", type=float, default=0.1)
+    ap.add_argument("--interval", type=float, default=2.0)
+    ap.add_argument("--kill-after", type=float, default=0, help="stop one agent after N seconds to test staleness")
+    ap.add_argument("--duration", type=float, default=0, help="stop after N seconds (0 = until Ctrl-C)")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="wgd-fleet-") as tmp:
+        agents = []
+        for i in range(args.agents):
+            workdir = Path(tmp) / f"node{i:02d}"
+            fleet = SyntheticFleet(args.peers, seed=i + 1)
+            fleet.write_configs(workdir / "configs")
+            dump = fleet.write_dump(workdir / "wg.dump")
+            env = {
+                **os.environ,
+                "FAKE_WG_DUMP": str(dump),
+                "WG_CMD": str(FAKE_WG),
+                "WG_CONFIG_DIR": str(workdir / "configs"),
+            }
+            proc = subprocess.Popen(
+                [sys.executable, "-m", "app.agent", "--hub", args.hub, "--token", args.token,
+                 "--node", f"site-{i:02d}", "--interval", str(args.interval)],
+                cwd=ROOT, env=env,
+            )
+            agents.append((fleet, dump, proc))
+
+        started = time.time()
+        try:
+            while not args.duration or time.time() - started < args.duration:
+                time.sleep(args.interval)
+                for fleet, dump, proc in agents:
+                    fleet.churn(args.churn)
+                    fleet.write_dump(dump)
+                if args.kill_after and time.time() - started > args.kill_after and agents[0][2].poll() is None:
+                    print("stopping site-00 to let it go stale", file=sys.stderr)
+                    agents[0][2].terminate()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for _, _, proc in agents:
+                proc.terminate()
+            for _, _, proc in agents:
+                proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# bench/run.py
+"""
+Reproducible benchmark suite for the collector and the read APIs.
+
+Each scenario (peer count) runs in its own child process against a fresh temp
+directory holding N synthetic client configs, a fake `wg` (bench/fake-wg) and
+an empty SQLite database, so peak RSS is per scenario and nothing touches
+/etc/wireguard or data/dashboard.db.
+
+Measured per scenario:
+- get_connected_clients   parse of `wg show all dump` + config index
+- poll_tick               one WSManager collection tick (parse, traffic deltas, broadcast)
+- api_clients             GET /api/clients through the ASGI app
+- api_traffic             GET /api/traffic/{name} through the ASGI app
+- ws_fanout               one broadcast to --sockets simulated WebSockets
+
+Usage:
+    python -m bench.run --peers 100 1000 10000 --churn 0.1 --output bench.json
+    python -m bench.run --baseline bench.json      # exit 1 on regression
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.fixtures import FAKE_WG, SyntheticFleet
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+# ---------------------- Measurement helpers ----------------------
+
+def _summary(samples, items=1):
+    """Summarise a list of per-call durations (seconds)."""
+    ordered = sorted(samples)
+    total = sum(ordered) or 1e-9
+    return {
+        "n": len(ordered),
+        "ops_per_s": round(len(ordered) / total, 2),
+        "items_per_s": round(len(ordered) * items / total, 2),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+    }
+
+
+async def _timed(fn, n, between=None):
+    samples = []
+    for _ in range(n):
+        if between:
+            between()
+        t0 = time.perf_counter()
+        await fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+async def asgi_get(app, path, query=""):
+    """Issue a GET straight into the ASGI app; returns (status, body)."""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": query.encode(), "root_path": "", "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    sent = False
+    status, body = None, []
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # never disconnects
+
+    async def send(msg):
+        nonlocal status
+        if msg["type"] == "http.response.start":
+            status = msg["status"]
+        elif msg["type"] == "http.response.body":
+            body.append(msg.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(body)
+
+
+class FakeWebSocket:
+    """Minimal stand-in for starlette's WebSocket: encodes like the real one, sends nowhere."""
+
+    def __init__(self):
+        self.sent_bytes = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        self.sent_bytes += len(data)
+
+    async def send_json(self, data, mode="text"):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+
+# ---------------------- Scenario (child process) ----------------------
+
+async def _scenario(peers, churn, ticks, sockets, workdir):
+    fleet = SyntheticFleet(peers)
+    fleet.write_configs(workdir / "configs")
+    dump = fleet.write_dump(workdir / "wg.dump")
+
+    os.environ["FAKE_WG_DUMP"] = str(dump)
+    os.environ["WG_CMD"] = str(FAKE_WG)
+    os.environ["WG_CONFIG_DIR"] = str(workdir / "configs")
+    os.environ["WG_DASHBOARD_DB"] = str(workdir / "dashboard.db")
+    os.environ["COLLECTOR_LOCK"] = str(workdir / "collector.lock")
+    os.environ["SNAPSHOT_PATH"] = str(workdir / "snapshot.json")
+
+    # imported only now so the modules pick up the environment above
+    from app.database import init_db
+    from app.pivpn import get_connected_clients
+    from app.wsmanager import wsmanager
+    from app import main
+
+    init_db()  # normally done by the app's lifespan handler
+
+    def step():
+        fleet.churn(churn)
+        fleet.write_dump(dump)
+
+    async def collect():
+        get_connected_clients()
+
+    result = {"peers": peers}
+    result["get_connected_clients"] = _summary(await _timed(collect, ticks, step), peers)
+    result["poll_tick"] = _summary(await _timed(wsmanager.poll_once, ticks, step), peers)
+
+    async def clients():
+        status, _ = await asgi_get(main.app, "/api/clients")
+        assert status == 200, status
+
+    result["api_clients"] = _summary(await _timed(clients, ticks), peers)
+
+    target = fleet.peers[0]["name"]
+
+    async def traffic():
+        status, _ = await asgi_get(main.app, f"/api/traffic/{target}", "hours=24")
+        assert status == 200, status
+
+    result["api_traffic"] = _summary(await _timed(traffic, ticks))
+
+    fakes = [FakeWebSocket() for _ in range(sockets)]
+    for ws in fakes:
+        await wsmanager.connect(ws)
+    payload = {"total": peers, "connected": 0, "list": get_connected_clients(), "ts": int(time.time())}
+
+    async def fanout():
+        await wsmanager.broadcast(payload)
+
+    result["ws_fanout"] = _summary(await _timed(fanout, ticks), sockets)
+    result["ws_fanout"]["sockets"] = sockets
+    result["ws_fanout"]["bytes_per_socket"] = fakes[0].sent_bytes // ticks if fakes else 0
+
+    result["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def _run_child(args):
+    with tempfile.TemporaryDirectory(prefix="wgd-bench-") as tmp:
+        result = asyncio.run(_scenario(args.child, args.churn, args.ticks, args.sockets, Path(tmp)))
+    json.dump(result, sys.stdout)
+
+
+# ---------------------- Driver ----------------------
+
+def _compare(current, baseline, tolerance):
+    """Return a list of human-readable regressions (latency or RSS above tolerance)."""
+    regressions = []
+    for peers, scen in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(peers)
+        if not base:
+            continue
+        for metric, stats in scen.items():
+            if not isinstance(stats, dict) or metric not in base:
+                continue
+            for key in ("p50_ms", "p99_ms"):
+                old, new = base[metric].get(key), stats.get(key)
+                if old and new and new > old * (1 + tolerance):
+                    regressions.append(f"{peers} peers {metric}.{key}: {old} -> {new}")
+        old_rss, new_rss = base.get("peak_rss_kb"), scen.get("peak_rss_kb")
+        if old_rss and new_rss and new_rss > old_rss * (1 + tolerance):
+            regressions.append(f"{peers} peers peak_rss_kb: {old_rss} -> {new_rss}")
+    return regressions
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="WG Dashboard benchmark suite")
+    ap.add_argument("--peers", type=int, nargs="+", default=[100, 1000, 10000])
+    ap.add_argument("--churn", type=float, default=0.1, help="fraction of peers changed per tick")
+    ap.add_argument("--ticks", type=int, default=5, help="iterations per measurement")
+    ap.add_argument("--sockets", type=int, default=500, help="simulated WebSocket clients")
+    ap.add_argument("--output", help="write results JSON here (default: stdout)")
+    ap.add_argument("--baseline", help="compare against a previous results JSON")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline")
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args(argv)
+
+    if args.child is not None:
+        return _run_child(args)
+
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "churn": args.churn,
+            "ticks": args.ticks,
+            "sockets": args.sockets,
+            "ts": int(time.time()),
+        },
+        "scenarios": {},
+    }
+    for peers in args.peers:
+        cmd = [sys.executable, "-m", "bench.run", "--child", str(peers),
+               "--churn", str(args.churn), "--ticks", str(args.ticks), "--sockets", str(args.sockets)]
+        proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr, file=sys.stderr)
+            return 1
+        results["scenarios"][str(peers)] = json.loads(proc.stdout.strip().splitlines()[-1])
+        print(f"{peers} peers done", file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = _compare(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for r in regressions:
+            print("REGRESSION:", r, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# bench/startup.py
+"""
+Cold-start budget check.
+
+Imports `app.main` in fresh interpreters (as a systemd restart would) and
+reports the median wall time of the import and of the lifespan schema setup,
+plus the slowest modules from `python -X importtime`. Exits 1 when the
+median import exceeds --budget-ms, so it can gate CI or a deploy script.
+
+Usage:
+    python -m bench.startup --runs 7 --budget-ms 800
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+_PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from app.database import init_db
+init_db()
+t2 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "init_db_ms": (t2 - t1) * 1000}))
+"""
+
+
+def _probe(env):
+    out = subprocess.check_output([sys.executable, "-c", _PROBE], cwd=ROOT, env=env, text=True)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _slowest_imports(env, top):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                          cwd=ROOT, env=env, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            self_us, cumulative, name = [p.strip() for p in line.split(":", 1)[1].split("|")]
+            rows.append((int(cumulative), int(self_us), name))
+        except ValueError:
+            continue  # header line
+    rows.sort(reverse=True)
+    return [{"module": n, "cumulative_ms": c / 1000, "self_ms": s / 1000} for c, s, n in rows[:top]]
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="WG Dashboard cold-start budget")
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--budget-ms", type=float, default=800.0, help="max median import time")
+    ap.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="wgd-startup-") as tmp:
+        env = {**os.environ, "WG_DASHBOARD_DB": str(Path(tmp) / "dashboard.db")}
+        runs = [_probe(env) for _ in range(args.runs)]
+        report = {
+            "runs": args.runs,
+            "import_ms_p50": round(statistics.median(r["import_ms"] for r in runs), 1),
+            "init_db_ms_p50": round(statistics.median(r["init_db_ms"] for r in runs), 1),
+            "budget_ms": args.budget_ms,
+            "slowest_imports": _slowest_imports(env, args.top),
+        }
+    print(json.dumps(report, indent=2))
+    if report["import_ms_p50"] > args.budget_ms:
+        print(f"OVER BUDGET: import {report['import_ms_p50']} ms > {args.budget_ms} ms", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
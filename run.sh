@@ -13,4 +13,4 @@ else
 fi
 
 echo "✅ Starting WG Dashboard..."
-exec uvicorn app.main:app --host 0.0.0.0 --port 8000
+exec uvicorn app.main:app --host "${HOST:-0.0.0.0}" --port "${PORT:-8000}"
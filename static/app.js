@@ -1,66 +1,183 @@
 let socket;
 let clientsList = [];
+const pendingJobs = new Map(); // job id -> callback(job) for jobs started from this page
+
+const rates = new RateStore();
+const rows = new Map(); // peer key -> { tr, cells, values } reused across snapshots
+let sparklines = null;
+let pendingSnapshot = null;
+let renderFrame = 0;
+let streaming = false; // set once the WebSocket has delivered a snapshot
+let wsFailures = 0; // consecutive WebSocket attempts that never opened
+let events = null; // EventSource used when WebSockets are blocked (e.g. by a proxy)
+
+function peerKey(c) {
+  return c.node ? `${c.node}/${c.name}` : c.name;
+}
+
+function actionButton(label, extraClass, onClick) {
+  const b = document.createElement('button');
+  b.className = `px-2 py-1 bg-gray-600 rounded hover:bg-gray-500 ${extraClass}`;
+  b.textContent = label;
+  b.addEventListener('click', onClick);
+  return b;
+}
+
+function createRow(c) {
+  const tr = document.createElement('tr');
+  tr.innerHTML = `
+    <td class="p-2">
+      <div class="peer-status">
+        <div class="font-semibold peer-name"></div>
+        <div class="text-xs text-gray-400 peer-route"></div>
+      </div>
+    </td>
+    <td class="p-2 peer-remote"></td>
+    <td class="p-2 peer-virtual"></td>
+    <td class="p-2 text-sm">
+      <span class="text-blue-400 peer-rx"></span><br>
+      <span class="text-red-400 peer-tx"></span>
+    </td>
+    <td class="p-2 text-sm whitespace-nowrap">
+      <div class="peer-rate text-gray-300"></div>
+      <div class="peer-spark" style="width:120px;height:24px"></div>
+    </td>
+    <td class="p-2 peer-seen"></td>
+    <td class="p-2 text-right space-x-1 peer-actions"></td>
+  `;
+  const name = c.name;
+  const actions = tr.querySelector('.peer-actions');
+  actions.append(
+    actionButton('QR', '', () => showQR(name)),
+    actionButton('View', '', () => showConfig(name)),
+    actionButton('⬇', '', () => downloadConfig(name)),
+    actionButton('🗑', 'text-red-400 hover:bg-gray-700', () => deleteConfig(name)),
+  );
+  const cells = {};
+  for (const key of ['status', 'name', 'route', 'remote', 'virtual', 'rx', 'tx', 'rate', 'spark', 'seen']) {
+    cells[key] = tr.querySelector(`.peer-${key}`);
+  }
+  return { tr, cells, values: {} };
+}
+
+// Write only what changed since this row was last drawn
+function setText(row, key, text) {
+  if (row.values[key] !== text) {
+    row.values[key] = text;
+    row.cells[key].textContent = text;
+  }
+}
+
+function updateRow(row, c, key) {
+  setText(row, 'name', c.node ? `${c.name} @ ${c.node}` : c.name);
+  setText(row, 'route', `${c.remote_ip} → ${c.virtual_ip}`);
+  setText(row, 'remote', c.remote_ip);
+  setText(row, 'virtual', c.virtual_ip);
+  setText(row, 'rx', `↓ ${c.bytes_received || '0'}`);
+  setText(row, 'tx', `↑ ${c.bytes_sent || '0'}`);
+  setText(row, 'seen', c.last_seen);
+  const rate = rates.get(key)?.latest();
+  setText(row, 'rate', rate ? `↓ ${formatRate(rate.rx)} ↑ ${formatRate(rate.tx)}` : '–');
+  const state = c.connected ? (c.stale ? 'stale' : 'up') : 'down';
+  if (row.values.state !== state) {
+    row.values.state = state;
+    row.tr.classList.toggle('opacity-50', state !== 'up');
+    row.cells.status.classList.toggle('text-red-400', !c.connected);
+    row.cells.seen.classList.toggle('text-green-400', !!c.connected);
+    row.cells.seen.classList.toggle('text-red-400', !c.connected);
+  }
+}
 
 function populateClients(clients) {
-  // Get the table body
   const tbody = document.getElementById('clientTable');
   if (!tbody) {
     console.warn("populateClients: clientTable not found");
     return;
   }
-  tbody.innerHTML = "";
-  clients.forEach(c => {
-    const tr = document.createElement('tr');
-    if (!c.connected) {
-      tr.classList.add("opacity-50");
+  if (!sparklines) sparklines = new Sparklines(rates, tbody.closest('.overflow-x-auto') || tbody);
+  const seen = new Set();
+  let cursor = tbody.firstElementChild;
+  for (const c of clients) {
+    const key = peerKey(c);
+    seen.add(key);
+    let row = rows.get(key);
+    if (!row) {
+      row = createRow(c);
+      rows.set(key, row);
+      sparklines.attach(row.cells.spark, key);
+    }
+    updateRow(row, c, key);
+    // keep server order while moving as few nodes as possible
+    if (row.tr === cursor) {
+      cursor = cursor.nextElementSibling;
+    } else {
+      tbody.insertBefore(row.tr, cursor);
+    }
+  }
+  for (const [key, row] of rows) {
+    if (!seen.has(key)) {
+      sparklines.detach(row.cells.spark);
+      row.tr.remove();
+      rows.delete(key);
     }
-    tr.innerHTML = `
-      <td class="p-2">
-        <div class="${!c.connected ? 'text-red-400' : ''}">
-          <div class="font-semibold">${c.name}</div>
-          <div class="text-xs text-gray-400">${c.remote_ip} → ${c.virtual_ip}</div>
-        </div>
-      </td>
-      <td class="p-2">${c.remote_ip}</td>
-      <td class="p-2">${c.virtual_ip}</td>
-      <td class="p-2 text-sm">
-        <span class="text-blue-400">↓ ${c.bytes_received || '0'}</span><br>
-        <span class="text-red-400">↑ ${c.bytes_sent || '0'}</span>
-      </td>
-      <td class="p-2 ${c.connected ? 'text-green-400' : 'text-red-400'}">${c.last_seen}</td>
-      <td class="p-2 text-right space-x-1">
-        <button class="px-2 py-1 bg-gray-600 rounded hover:bg-gray-500" onclick="showQR('${c.name}')">QR</button>
-        <button class="px-2 py-1 bg-gray-600 rounded hover:bg-gray-500" onclick="showConfig('${c.name}')">View</button>
-        <button class="px-2 py-1 bg-gray-600 rounded hover:bg-gray-500" onclick="downloadConfig('${c.name}')">⬇</button>
-        <button class="px-2 py-1 bg-gray-600 rounded text-red-400 hover:bg-gray-700" onclick="deleteConfig('${c.name}')">🗑</button>
-      </td>
-    `;
-    tbody.appendChild(tr);
+  }
+  sparklines.schedule();
+}
+
+// Snapshots can arrive faster than the page paints; only the newest one is drawn
+function scheduleRender(data) {
+  pendingSnapshot = data;
+  if (renderFrame) return;
+  renderFrame = requestAnimationFrame(() => {
+    renderFrame = 0;
+    const snap = pendingSnapshot;
+    pendingSnapshot = null;
+    document.getElementById('totalClients').textContent = snap.total;
+    document.getElementById('connectedClients').textContent = snap.connected;
+    populateClients(snap.list);
   });
 }
 
+function handleSnapshot(data) {
+  // every snapshot feeds the rate history, even ones that are never painted
+  streaming = true;
+  rates.update(data.list, data.ts || Date.now() / 1000, peerKey);
+  scheduleRender(data);
+}
+
 function connectWS() {
   socket = new WebSocket(((location.protocol === 'https:') ? 'wss://' : 'ws://') + window.location.host + '/ws/clients');
-  socket.onopen = () => console.log('WS open');
-  socket.onclose = () => setTimeout(connectWS, 3000);
+  socket.onopen = () => { wsFailures = 0; console.log('WS open'); };
+  socket.onclose = () => {
+    // after a few attempts that never opened, fall back to the event stream
+    if (++wsFailures >= 3 && !events) connectEvents();
+    else setTimeout(connectWS, 3000);
+  };
   socket.onmessage = (ev) => {
     const data = JSON.parse(ev.data);
-    document.getElementById('totalClients').textContent = data.total;
-    console.log("Active:",data);
-    document.getElementById('connectedClients').textContent = (data.connected );
-    populateClients(data.list);
+    if (data.type === 'job') {
+      handleJobEvent(data);
+      return;
+    }
+    handleSnapshot(data);
   };
 }
 
+function connectEvents() {
+  // EventSource reconnects by itself and resumes from the last snapshot id
+  events = new EventSource('/api/clients/events');
+  events.addEventListener('snapshot', (ev) => handleSnapshot(JSON.parse(ev.data)));
+}
+
 async function refreshClients() {
+  // one-off initial paint before the first WebSocket snapshot arrives
   try {
     const res = await fetch('/api/clients');
     const data = await res.json();
-    document.getElementById("totalClients").textContent = data.total;
+    if (streaming) return;
     const arr = data.clients || [];
-    const active = (data.connected || arr.filter(c => c.connected));
-    document.getElementById("connectedClients").textContent = active.length;
-    populateClients(arr);
+    const active = Array.isArray(data.connected) ? data.connected.length : (data.connected || 0);
+    scheduleRender({ total: data.total, connected: active, list: arr });
   } catch (err) {
     console.error("Failed to update clients:", err);
   }
@@ -132,16 +249,38 @@ function downloadConfig(name) {
   window.open(`/api/config/${name}/download`, "_blank");
 }
 
+async function handleJobEvent(event) {
+  // the WebSocket only says that a job changed; its result and error come from /api/jobs
+  const cb = pendingJobs.get(event.id);
+  if (cb && (event.status === 'done' || event.status === 'failed' || event.status === 'cancelled')) {
+    pendingJobs.delete(event.id);
+    let job = event;
+    try {
+      const res = await fetch(`/api/jobs/${event.id}`);
+      if (res.ok) job = await res.json();
+    } catch (err) {
+      console.error("Failed to fetch job:", err);
+    }
+    cb(job);
+  }
+}
+
 async function deleteConfig(name) {
   if (!confirm(`Delete config ${name}?`)) return;
   const res = await fetch(`/api/config/${name}`, { method: "DELETE" });
   const json = await res.json();
-  if (json.deleted) {
-    alert("Deleted successfully!");
-    refreshClients();
-  } else {
+  if (!json.job_id) {
     alert("Failed to delete config.");
+    return;
   }
+  // the deletion runs in the background; the result arrives over the WebSocket
+  pendingJobs.set(json.job_id, (job) => {
+    if (job.status === 'done') {
+      alert(`Deleted ${name}.`);
+    } else {
+      alert(`Failed to delete ${name}: ${job.error || job.status}`);
+    }
+  });
 }
 
 // Startup logic
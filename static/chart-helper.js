@@ -1 +1,184 @@
-// Placeholder chart helper JS
\ No newline at end of file
+// Per-peer transfer rates and sparklines, computed from the snapshots the WebSocket already sends.
+//
+// RateStore keeps a fixed-size ring of samples per peer in typed arrays, so memory
+// does not grow with uptime and no extra requests are needed. Sparklines draws
+// all peers onto one viewport-sized canvas, painting only rows on screen.
+
+const RING_SIZE = 60; // samples kept per peer (5 minutes at the default 5s tick)
+
+class RateRing {
+  constructor(size = RING_SIZE) {
+    this.size = size;
+    this.rx = new Float32Array(size); // bytes/sec
+    this.tx = new Float32Array(size);
+    this.count = 0;
+    this.head = 0; // next write position
+    this.lastTs = 0;
+    this.lastRx = 0;
+    this.lastTx = 0;
+  }
+
+  // Feed cumulative counters; the first sample only sets the baseline.
+  push(ts, rxRaw, txRaw) {
+    const dt = ts - this.lastTs;
+    if (this.lastTs && dt > 0) {
+      // counters restart from zero when the interface is re-created
+      const drx = rxRaw >= this.lastRx ? rxRaw - this.lastRx : rxRaw;
+      const dtx = txRaw >= this.lastTx ? txRaw - this.lastTx : txRaw;
+      this.rx[this.head] = drx / dt;
+      this.tx[this.head] = dtx / dt;
+      this.head = (this.head + 1) % this.size;
+      if (this.count < this.size) this.count++;
+    }
+    if (dt > 0 || !this.lastTs) {
+      this.lastTs = ts;
+      this.lastRx = rxRaw;
+      this.lastTx = txRaw;
+    }
+  }
+
+  // i = 0 is the oldest sample kept
+  at(arr, i) {
+    return arr[(this.head - this.count + i + this.size) % this.size];
+  }
+
+  latest() {
+    if (!this.count) return null;
+    const i = (this.head - 1 + this.size) % this.size;
+    return { rx: this.rx[i], tx: this.tx[i] };
+  }
+
+  max() {
+    let m = 0;
+    for (let i = 0; i < this.count; i++) {
+      const j = (this.head - this.count + i + this.size) % this.size;
+      if (this.rx[j] > m) m = this.rx[j];
+      if (this.tx[j] > m) m = this.tx[j];
+    }
+    return m;
+  }
+}
+
+class RateStore {
+  constructor(size = RING_SIZE) {
+    this.size = size;
+    this.rings = new Map(); // peer key -> RateRing
+  }
+
+  // Feed one snapshot; peers missing from it are dropped.
+  update(list, ts, keyOf) {
+    const seen = new Set();
+    for (const c of list) {
+      const key = keyOf(c);
+      seen.add(key);
+      let ring = this.rings.get(key);
+      if (!ring) {
+        ring = new RateRing(this.size);
+        this.rings.set(key, ring);
+      }
+      ring.push(ts, c.rx_raw || 0, c.tx_raw || 0);
+    }
+    if (seen.size !== this.rings.size) {
+      for (const key of this.rings.keys()) {
+        if (!seen.has(key)) this.rings.delete(key);
+      }
+    }
+  }
+
+  get(key) {
+    return this.rings.get(key);
+  }
+}
+
+function formatRate(bytesPerSec) {
+  if (bytesPerSec < 1024) return `${bytesPerSec.toFixed(0)} B/s`;
+  const units = ['KB/s', 'MB/s', 'GB/s'];
+  let v = bytesPerSec;
+  for (const unit of units) {
+    v /= 1024;
+    if (v < 1024) return `${v.toFixed(1)} ${unit}`;
+  }
+  return `${v.toFixed(1)} TB/s`;
+}
+
+class Sparklines {
+  // clip: element whose box bounds the drawing (e.g. the scrolling table container)
+  constructor(store, clip) {
+    this.store = store;
+    this.clip = clip;
+    this.slots = new Map(); // placeholder element -> peer key
+    this.visible = new Set();
+    this.canvas = document.createElement('canvas');
+    this.canvas.style.cssText = 'position:fixed;left:0;top:0;pointer-events:none;z-index:40';
+    document.body.appendChild(this.canvas);
+    this.ctx = this.canvas.getContext('2d');
+    this.frame = 0;
+    this.observer = new IntersectionObserver((entries) => {
+      for (const e of entries) {
+        if (e.isIntersecting) this.visible.add(e.target); else this.visible.delete(e.target);
+      }
+      this.schedule();
+    });
+    const redraw = () => this.schedule();
+    window.addEventListener('scroll', redraw, { passive: true, capture: true });
+    window.addEventListener('resize', redraw);
+  }
+
+  attach(el, key) {
+    this.slots.set(el, key);
+    this.observer.observe(el);
+  }
+
+  detach(el) {
+    this.slots.delete(el);
+    this.visible.delete(el);
+    this.observer.unobserve(el);
+  }
+
+  schedule() {
+    if (!this.frame) this.frame = requestAnimationFrame(() => { this.frame = 0; this.draw(); });
+  }
+
+  draw() {
+    const dpr = window.devicePixelRatio || 1;
+    const w = window.innerWidth, h = window.innerHeight;
+    if (this.canvas.width !== Math.round(w * dpr) || this.canvas.height !== Math.round(h * dpr)) {
+      this.canvas.width = Math.round(w * dpr);
+      this.canvas.height = Math.round(h * dpr);
+      this.canvas.style.width = `${w}px`;
+      this.canvas.style.height = `${h}px`;
+    }
+    const ctx = this.ctx;
+    ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+    ctx.clearRect(0, 0, w, h);
+    const clip = this.clip.getBoundingClientRect();
+    ctx.save();
+    ctx.beginPath();
+    ctx.rect(clip.left, clip.top, clip.width, clip.height);
+    ctx.clip();
+    for (const el of this.visible) {
+      const ring = this.store.get(this.slots.get(el));
+      if (!ring || ring.count < 2) continue;
+      const r = el.getBoundingClientRect();
+      const peak = ring.max() || 1;
+      this.line(ring, ring.rx, r, peak, '#60a5fa');
+      this.line(ring, ring.tx, r, peak, '#f87171');
+    }
+    ctx.restore();
+  }
+
+  line(ring, arr, r, peak, color) {
+    const ctx = this.ctx;
+    const step = r.width / (ring.size - 1);
+    const x0 = r.right - (ring.count - 1) * step; // newest sample at the right edge
+    ctx.beginPath();
+    for (let i = 0; i < ring.count; i++) {
+      const x = x0 + i * step;
+      const y = r.bottom - 1 - (ring.at(arr, i) / peak) * (r.height - 2);
+      if (i) ctx.lineTo(x, y); else ctx.moveTo(x, y);
+    }
+    ctx.strokeStyle = color;
+    ctx.lineWidth = 1;
+    ctx.stroke();
+  }
+}
@@ -0,0 +1,77 @@
+# tests/conftest.py
+"""
+Shared fixtures. app.settings is read once at import, so every path the app
+touches is pointed at a throwaway directory here, before any test module
+imports an app module; `wg` is bench/fake-wg printing a dump file.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+_TMP = Path(tempfile.mkdtemp(prefix="wg-dashboard-tests-"))
+atexit.register(shutil.rmtree, _TMP, ignore_errors=True)
+
+os.environ.update({
+    "WG_DASHBOARD_ENV": str(_TMP / "dashboard.env"),  # never read a developer's env file
+    "WG_DASHBOARD_DB": str(_TMP / "dashboard.db"),
+    "WG_CONFIG_DIR": str(_TMP / "configs"),
+    "WG_DIR": str(_TMP / "wireguard"),
+    "PIVPN_SETUP_VARS": str(_TMP / "setupVars.conf"),
+    "WG_CMD": str(ROOT / "bench" / "fake-wg"),
+    "FAKE_WG_DUMP": str(_TMP / "dump"),
+    "COLLECTOR_LOCK": str(_TMP / "collector.lock"),
+    "PIVPN_LOCK": str(_TMP / "pivpn.lock"),
+    "SNAPSHOT_PATH": str(_TMP / "snapshot"),
+    "ALERT_RULES": str(_TMP / "alerts.json"),
+})
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh, initialised SQLite database for one test."""
+    from app import database
+    monkeypatch.setattr(database, "DB_PATH", tmp_path / "dashboard.db")
+    database.init_db()
+    return database
+
+
+@pytest.fixture
+def client(db):
+    """TestClient without the lifespan, so no collector or job workers start."""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    return TestClient(app)
+
+
+@pytest.fixture
+def admin_client(client, db):
+    """TestClient logged in as an admin."""
+    from app.auth import create_session_for_user
+    db.upsert_user("root", "admin")
+    client.cookies.set("session", create_session_for_user("root"))
+    return client
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    """An empty pivpn client config directory."""
+    from app import pivpn
+    path = tmp_path / "configs"
+    path.mkdir()
+    monkeypatch.setattr(pivpn, "CONFIG_DIR", str(path))
+    return path
+
+
+@pytest.fixture
+def wg_dump(tmp_path, monkeypatch):
+    """Path of the dump file bench/fake-wg prints as `wg show all dump`."""
+    path = tmp_path / "dump"
+    path.write_text("")
+    monkeypatch.setenv("FAKE_WG_DUMP", str(path))
+    return path
@@ -0,0 +1,62 @@
+def _walk(client, url, cursor_param, **params):
+    """Follow `next` cursors and return every item, page by page."""
+    pages, cursor = [], None
+    while True:
+        query = dict(params)
+        if cursor is not None:
+            query[cursor_param] = cursor
+        r = client.get(url, params=query)
+        assert r.status_code == 200
+        body = r.json()
+        pages.append(body["items"])
+        cursor = body["next"]
+        if cursor is None:
+            return pages
+
+
+def test_list_users_keyset_prefix_and_role(db):
+    for name, role in (("alice", "viewer"), ("alan", "admin"), ("bob", "viewer"), ("al", "viewer")):
+        db.upsert_user(name, role)
+    assert [u["username"] for u in db.list_users(limit=2)] == ["al", "alan"]
+    assert [u["username"] for u in db.list_users(limit=2, after="alan")] == ["alice", "bob"]
+    assert [u["username"] for u in db.list_users(q="ali")] == ["alice"]
+    assert [u["username"] for u in db.list_users(q="al", role="viewer")] == ["al", "alice"]
+
+
+def test_admin_log_keyset_and_filters(db):
+    for i in range(10):
+        db.log_admin_action("root" if i % 2 else "ops", "add_user" if i < 5 else "delete_user", f"user{i}")
+    rows = db.get_admin_log(limit=3)
+    assert [r["target"] for r in rows] == ["user9", "user8", "user7"]
+    assert [r["target"] for r in db.get_admin_log(limit=3, before=rows[-1]["id"])] == ["user6", "user5", "user4"]
+    assert [r["target"] for r in db.get_admin_log(admin="ops", action="delete_user")] == ["user8", "user6"]
+    assert db.get_admin_log(since="2999-01-01 00:00:00") == []
+
+
+def test_users_api_pages_through_everyone(admin_client, db):
+    for i in range(7):
+        db.upsert_user(f"user{i}")
+    pages = _walk(admin_client, "/admin/api/users", "after", limit=3)
+    assert [len(p) for p in pages] == [3, 3, 2]  # 7 users plus the admin
+    names = [u["username"] for p in pages for u in p]
+    assert names == sorted(names) and len(set(names)) == 8
+
+
+def test_log_api_pages_newest_first(admin_client, db):
+    for i in range(5):
+        db.log_admin_action("root", "add_user", f"user{i}")
+    pages = _walk(admin_client, "/admin/api/log", "before", limit=2, action="add_user")
+    assert [e["target"] for p in pages for e in p] == [f"user{i}" for i in range(4, -1, -1)]
+    assert admin_client.get("/admin/api/log", params={"since": "last week"}).status_code == 400
+
+
+def test_admin_page_renders_first_pages(admin_client, db):
+    db.log_admin_action("root", "add_user", "someone")
+    r = admin_client.get("/admin")
+    assert r.status_code == 200
+    assert "someone" in r.text
+
+
+def test_admin_api_needs_admin(client, db):
+    assert client.get("/admin/api/users").status_code == 403
+    assert client.get("/admin/api/log").status_code == 403
@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+from app import alerts as alerts_module
+from app.alerts import AlertEngine, ConnectedDropRule, HandshakeRule, Notifier, TransferRule, load_rules
+
+T0 = 1_700_000_000
+
+
+def _client(name, rx=0, tx=0, hs=0, node=None):
+    c = {"name": name, "rx_raw": rx, "tx_raw": tx, "latest_handshake": hs}
+    if node:
+        c["node"] = node
+    return c
+
+
+def test_transfer_window_and_cooldown():
+    fired = []
+    rule = TransferRule({"type": "transfer", "bytes": 1000, "window": 120, "cooldown": 300})
+    rule.on_change("a", (0, 0, 0), None, T0, fired.append)
+    rule.on_change("a", (600, 0, 0), (0, 0, 0), T0 + 10, fired.append)
+    assert fired == []
+    rule.on_change("a", (600, 500, 0), (600, 0, 0), T0 + 20, fired.append)
+    assert [a["state"] for a in fired] == ["firing"]
+    rule.on_change("a", (700, 500, 0), (600, 500, 0), T0 + 30, fired.append)
+    assert len(fired) == 1  # cooling down
+
+    # the first minute's bytes fall out of the window; a counter reset counts from zero
+    rule.on_change("a", (50, 500, 0), (700, 500, 0), T0 + 400, fired.append)
+    assert rule._sums["a"] == 50 and len(fired) == 1
+
+
+def test_handshake_fires_once_and_resolves():
+    fired = []
+    rule = HandshakeRule({"type": "handshake", "max_age": 180})
+    rule.on_change("a", (0, 0, T0), None, T0, fired.append)
+    rule.on_tick(T0 + 100, 1, fired.append)
+    assert fired == []
+    rule.on_tick(T0 + 200, 1, fired.append)
+    rule.on_tick(T0 + 300, 1, fired.append)
+    assert [a["state"] for a in fired] == ["firing"]
+
+    rule.on_change("a", (0, 0, T0 + 310), (0, 0, T0), T0 + 310, fired.append)
+    assert [a["state"] for a in fired] == ["firing", "resolved"]
+    # the superseded deadline is skipped; only the new one fires
+    rule.on_tick(T0 + 400, 1, fired.append)
+    assert len(fired) == 2
+
+
+def test_handshake_never_seen_counts_from_first_sight():
+    fired = []
+    rule = HandshakeRule({"type": "handshake", "max_age": 60})
+    rule.on_change("a", (0, 0, 0), None, T0, fired.append)
+    rule.on_tick(T0 + 61, 0, fired.append)
+    assert "last: never" in fired[0]["message"]
+
+
+def test_connected_drop():
+    fired = []
+    rule = ConnectedDropRule({"type": "connected_drop", "ratio": 0.5, "window": 600, "min_peak": 4})
+    for t, n in ((0, 2), (10, 1)):
+        rule.on_tick(T0 + t, n, fired.append)
+    assert fired == []  # peak below min_peak
+    for t, n in ((20, 10), (30, 6), (40, 5)):
+        rule.on_tick(T0 + t, n, fired.append)
+    assert [a["state"] for a in fired] == ["firing"]
+    rule.on_tick(T0 + 50, 4, fired.append)
+    rule.on_tick(T0 + 60, 8, fired.append)
+    assert [a["state"] for a in fired] == ["firing", "resolved"]
+
+
+def test_engine_feeds_only_changed_peers():
+    seen = []
+
+    class Spy(TransferRule):
+        def on_change(self, key, row, prev, now, emit):
+            seen.append((key, row, prev))
+
+        def forget(self, key):
+            seen.append(("forget", key))
+
+    engine = AlertEngine([Spy({"type": "transfer", "bytes": 1, "peers": ["a", "n1/b"]})], lambda a: None)
+    engine.evaluate([_client("a", 1), _client("b", 1, node="n1"), _client("c", 1)], 3, T0)
+    engine.evaluate([_client("a", 1), _client("b", 2, node="n1")], 2, T0 + 10)
+    assert seen == [
+        ("a", (1, 0, 0), None),
+        ("n1/b", (1, 0, 0), None),
+        ("n1/b", (2, 0, 0), (1, 0, 0)),
+        ("forget", "c"),
+    ]
+
+
+def test_notifier_batches_and_rate_limits(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(alerts_module.jobs, "submit", lambda kind, target, params: submitted.append((kind, target, params)))
+    notifier = Notifier(["ops@example.net"], "https://hooks.example.net/x", interval=60, max_per_hour=1)
+
+    asyncio.run(notifier.flush(T0))
+    assert submitted == []  # nothing queued
+
+    notifier.push({"rule": "r", "peer": "a", "state": "firing", "message": "m", "ts": T0})
+    notifier.push({"rule": "r", "peer": "a", "state": "resolved", "message": "m", "ts": T0})
+    asyncio.run(notifier.flush(T0))
+    assert [s[0] for s in submitted] == ["send_email", "send_webhook"]
+    assert submitted[0][2]["subject"] == "[WG Dashboard] 1 alert(s), 1 resolved"
+    assert len(submitted[1][2]["payload"]["alerts"]) == 2
+
+    notifier.push({"rule": "r", "peer": "b", "state": "firing", "message": "m", "ts": T0})
+    asyncio.run(notifier.flush(T0 + 60))
+    assert len(submitted) == 2  # over the hourly limit, kept for later
+    asyncio.run(notifier.flush(T0 + 3601))
+    assert len(submitted) == 4
+
+
+def test_load_rules(tmp_path):
+    assert load_rules(tmp_path / "missing.json") == []
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps([
+        {"type": "transfer", "bytes": 10e9},
+        {"name": "site-b", "type": "handshake", "peers": ["site-b"]},
+    ]))
+    transfer, handshake = load_rules(path)
+    assert isinstance(transfer, TransferRule) and transfer.name == "transfer" and transfer.cooldown == 3600
+    assert handshake.watches("site-b", "site-b") and not handshake.watches("other", "other")
+
+    path.write_text(json.dumps([{"type": "transfer"}]))
+    with pytest.raises(ValueError):
+        load_rules(path)
+    path.write_text(json.dumps([{"type": "nope"}]))
+    with pytest.raises(ValueError):
+        load_rules(path)
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from fastapi.testclient import TestClient
+
+from app.assets import IMMUTABLE, Asset, AssetFiles, AssetManifest, CompressAPIMiddleware, accepts
+
+TEXT = b"function hello() { return 'hello'; }\n" * 100
+
+
+@pytest.mark.parametrize("header,expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("br;q=0, gzip;q=0.5", "gzip"),
+    ("GZIP; Q=0.000", "identity"),
+    ("gzip;q=0, *", "br"),
+    ("*;q=0", "identity"),
+    ("gzip;q=nonsense", "identity"),
+    ("", "identity"),
+])
+def test_pick_honours_q_values(header, expected):
+    asset = Asset("app.js", TEXT)
+    asset.variants.setdefault("br", b"fake brotli")
+    assert asset.pick(header) == expected
+
+
+def test_accepts():
+    assert accepts("deflate, gzip;q=0.1", "gzip")
+    assert not accepts("gzip;q=0, *", "gzip")
+    assert accepts("*", "gzip") and not accepts("br", "gzip")
+
+
+def test_incompressible_files_are_kept_as_is():
+    noise = os.urandom(4096)
+    asset = Asset("img/logo.png", noise)
+    assert set(asset.variants) == {"identity"}
+    assert asset.media_type == "image/png"
+    assert asset.url.startswith("/static/img/logo.") and asset.url.endswith(".png")
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    (tmp_path / "app.js").write_bytes(TEXT)
+    (tmp_path / ".hidden").write_text("secret")
+    return AssetManifest(tmp_path)
+
+
+def test_manifest_urls(manifest):
+    url = manifest.url("app.js")
+    assert url != "/static/app.js" and url.startswith("/static/app.")
+    assert manifest.lookup(url[len("/static/"):]).name == "app.js"
+    assert manifest.url("missing.js") == "/static/missing.js"
+    assert manifest.url(".hidden") == "/static/.hidden"
+
+
+@pytest.fixture
+def static_client(manifest):
+    app = FastAPI()
+    app.mount("/static", AssetFiles(manifest), name="static")
+    return TestClient(app)
+
+
+def test_fingerprinted_files_are_immutable_and_precompressed(static_client, manifest):
+    url = manifest.url("app.js")
+    r = static_client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200 and r.content == TEXT  # httpx decodes the gzip body
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["cache-control"] == IMMUTABLE and r.headers["vary"] == "Accept-Encoding"
+
+    r = static_client.get(url, headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in r.headers and r.content == TEXT
+
+    r = static_client.get(url, headers={"If-None-Match": r.headers["etag"]})
+    assert r.status_code == 304 and r.headers["cache-control"] == IMMUTABLE
+
+    # unfingerprinted paths still come from disk
+    r = static_client.get("/static/app.js")
+    assert r.status_code == 200 and r.content == TEXT and r.headers.get("cache-control") != IMMUTABLE
+
+
+def _api(payload):
+    app = FastAPI()
+    for path in ("/api/clients", "/api/traffic/daily", "/api/export"):
+        app.add_api_route(path, lambda: JSONResponse(payload))
+    app.add_middleware(CompressAPIMiddleware, exact=("/api/clients",), prefixes=("/api/traffic/",))
+    return TestClient(app)
+
+
+def test_compress_only_listed_routes():
+    client = _api({"rows": ["x" * 50] * 100})
+    for path in ("/api/clients", "/api/traffic/daily"):
+        r = client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert r.headers["content-encoding"] == "gzip" and len(r.json()["rows"]) == 100
+    r = client.get("/api/export", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+
+def test_small_responses_are_not_compressed():
+    r = _api({"ok": True}).get("/api/clients", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers and r.json() == {"ok": True}
@@ -0,0 +1,34 @@
+from app.pivpn import get_connected_clients, get_total_clients
+from bench.fixtures import SyntheticFleet
+
+
+def test_dump_parses_into_named_peers(config_dir, wg_dump):
+    fleet = SyntheticFleet(25, seed=7)
+    fleet.write_configs(config_dir)
+    fleet.write_dump(wg_dump)
+
+    clients = {c["name"]: c for c in get_connected_clients()}
+
+    assert get_total_clients() == 25
+    assert set(clients) == {p["name"] for p in fleet.peers}
+    for p in fleet.peers:
+        c = clients[p["name"]]
+        assert c["virtual_ip"] == p["vip"]
+        assert (c["rx_raw"], c["tx_raw"], c["latest_handshake"]) == (p["rx"], p["tx"], p["handshake"])
+        assert c["public_key"] == p["pubkey"]
+        assert c["interface"] == "wg0"
+
+
+def test_same_seed_same_fleet():
+    a, b = SyntheticFleet(10, seed=3), SyntheticFleet(10, seed=3)
+    keys = ("name", "pubkey", "vip", "rx", "tx")
+    assert [[p[k] for k in keys] for p in a.peers] == [[p[k] for k in keys] for p in b.peers]
+
+
+def test_churn_moves_counters():
+    fleet = SyntheticFleet(200, seed=1)
+    before = [(p["rx"], p["tx"], p["handshake"]) for p in fleet.peers]
+    fleet.churn(0.5)
+    after = [(p["rx"], p["tx"], p["handshake"]) for p in fleet.peers]
+    changed = sum(1 for x, y in zip(before, after) if x != y)
+    assert 0 < changed <= 100
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import sqlite3
+
+import pytest
+
+from app import pivpn, wsmanager
+from app.collector import CollectorLock, SnapshotStore
+from app.quotas import QuotaTracker
+from app.sessions import SessionTracker
+from app.wsmanager import WSManager
+
+
+def test_only_one_lock_holder(tmp_path):
+    path = str(tmp_path / "collector.lock")
+    first, second = CollectorLock(path), CollectorLock(path)
+
+    assert first.acquire()
+    assert first.acquire()  # re-entrant for the holder
+    assert not second.acquire()
+    assert not second.held
+
+    first.release()
+    assert second.acquire()
+    second.release()
+
+
+def test_snapshot_store_reports_changes_once(tmp_path):
+    writer = SnapshotStore(str(tmp_path / "snapshot"))
+    reader = SnapshotStore(str(tmp_path / "snapshot"))
+    assert reader.read() is None
+    assert reader.read_if_changed() is None
+
+    writer.publish(b'{"version": 1}')
+    assert reader.read_if_changed() == b'{"version": 1}'
+    assert reader.read_if_changed() is None
+
+    writer.publish(b'{"version": 2, "list": []}')
+    assert reader.read_if_changed() == b'{"version": 2, "list": []}'
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_follower_takes_only_newer_snapshots(tmp_path):
+    store = SnapshotStore(str(tmp_path / "snapshot"))
+    follower = WSManager()
+    follower._store = SnapshotStore(str(tmp_path / "snapshot"))
+
+    async def run():
+        store.publish(json.dumps({"version": 5, "total": 1, "list": []}).encode())
+        await follower.follow_once()
+        assert follower.version == 5
+        assert follower.snapshot["total"] == 1
+
+        # a stale collector publishing an older version is ignored
+        store.publish(json.dumps({"version": 4, "total": 9, "list": []}).encode())
+        await follower.follow_once()
+        assert follower.version == 5
+        assert follower.snapshot["total"] == 1
+
+    asyncio.run(run())
+
+
+# ---- counter checkpoint (WSManager._collect) ----
+
+@pytest.fixture
+def collector(db, config_dir, wg_dump, monkeypatch):
+    for i, name in enumerate(("phone", "laptop"), start=2):
+        (config_dir / f"{name}.conf").write_text(f"[Interface]\nAddress = 10.6.0.{i}/24\n")
+    epoch = {"wg0": "7"}
+    monkeypatch.setattr(wsmanager, "interface_epoch", lambda iface: epoch[iface])
+    monkeypatch.setattr(wsmanager, "sessions", SessionTracker())
+    monkeypatch.setattr(wsmanager, "quotas", QuotaTracker(checkpoint_interval=30))
+
+    def tick(manager, counters, new_epoch=None):
+        if new_epoch:
+            epoch["wg0"] = new_epoch
+        wg_dump.write_text("".join(
+            f"wg0\tS0VZ{name}=\t(none)\t203.0.113.5:51820\t10.6.0.{i}/32\t0\t{rx}\t{tx}\toff\n"
+            for i, (name, (rx, tx)) in enumerate(counters.items(), start=2)
+        ))
+        manager._collect()
+
+    return tick
+
+
+def _traffic(db):
+    conn = db.get_conn()
+    rows = conn.execute("SELECT client_name, bytes_in, bytes_out FROM traffic_log ORDER BY id").fetchall()
+    conn.close()
+    return [tuple(r) for r in rows]
+
+
+def test_fresh_install_takes_a_baseline(collector, db):
+    manager = WSManager()
+    collector(manager, {"phone": (5000, 700)})
+    assert _traffic(db) == [("phone", 0, 0)]  # history from before we ran is not new traffic
+    collector(manager, {"phone": (5100, 750)})
+    assert _traffic(db)[-1] == ("phone", 100, 50)
+
+
+def test_restart_counts_the_gap(collector, db):
+    collector(WSManager(), {"phone": (1000, 100)})
+    # a new process (deploy) picks up the checkpoint; bytes moved while it was down count
+    successor = WSManager()
+    collector(successor, {"phone": (4000, 400), "laptop": (300, 30)})
+    assert _traffic(db)[-2:] == [("phone", 3000, 300), ("laptop", 300, 30)]  # a new peer counts in full
+
+
+def test_counter_reset_and_new_interface(collector, db):
+    manager = WSManager()
+    collector(manager, {"phone": (1000, 100)})
+    collector(manager, {"phone": (200, 20)})
+    assert _traffic(db)[-1] == ("phone", 200, 20)
+    # a re-created interface restarts counters even if they already passed the old values
+    collector(manager, {"phone": (5000, 500)}, new_epoch="8")
+    assert _traffic(db)[-1] == ("phone", 5000, 500)
+    assert db.load_collector_state(3600) == {"S0VZphone=": ("8", 5000, 500)}
+
+
+def test_memory_follows_only_a_committed_tick(collector, db, monkeypatch):
+    manager = WSManager()
+    collector(manager, {"phone": (1000, 100)})
+
+    def fail(samples, state):
+        raise sqlite3.OperationalError("database is locked")
+
+    with monkeypatch.context() as m:
+        m.setattr(wsmanager, "record_traffic_tick", fail)
+        with pytest.raises(sqlite3.OperationalError):
+            collector(manager, {"phone": (1500, 150)})
+    assert manager._counters["S0VZphone="] == ("7", 1000, 100)
+
+    collector(manager, {"phone": (1600, 160)})
+    assert _traffic(db)[-1] == ("phone", 600, 60)  # the failed tick's bytes are not lost
+
+
+def test_reboot_with_the_same_ifindex(collector, db):
+    collector(WSManager(), {"phone": (1000, 100)}, new_epoch="boot-a:7")
+    # after a reboot wg0 is back as ifindex 7, and the peer already moved more than before
+    collector(WSManager(), {"phone": (3000, 300)}, new_epoch="boot-b:7")
+    assert _traffic(db)[-1] == ("phone", 3000, 300)
+
+
+def test_checkpoints_without_a_boot_id_still_match(collector, db):
+    collector(WSManager(), {"phone": (1000, 100)})  # epoch "7", as written by older versions
+    collector(WSManager(), {"phone": (1200, 120)}, new_epoch="boot-a:7")
+    assert _traffic(db)[-1] == ("phone", 200, 20)
+
+
+def test_interface_epoch(tmp_path, monkeypatch):
+    (tmp_path / "net" / "wg0").mkdir(parents=True)
+    (tmp_path / "net" / "wg0" / "ifindex").write_text("7\n")
+    (tmp_path / "boot_id").write_text("0f1e2d3c-aaaa-bbbb-cccc-000000000001\n")
+    monkeypatch.setattr(pivpn, "SYS_NET", str(tmp_path / "net"))
+    monkeypatch.setattr(pivpn, "BOOT_ID", str(tmp_path / "boot_id"))
+    assert pivpn.interface_epoch("wg0") == "0f1e2d3c-aaaa-bbbb-cccc-000000000001:7"
+    assert pivpn.interface_epoch("wg1") is None
+    (tmp_path / "boot_id").unlink()
+    assert pivpn.interface_epoch("wg0") == "7"
@@ -0,0 +1,89 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from app.pivpn import ConfigCache, ConfigFile, config_cache, iter_configs_zip
+
+
+@pytest.fixture
+def configs(config_dir, monkeypatch):
+    for name in ("alice", "bob"):
+        (config_dir / f"{name}.conf").write_text(f"[Interface]\n# {name}\nAddress = 10.6.0.2/24\n")
+    monkeypatch.setattr(config_cache, "_entries", type(config_cache._entries)())
+    monkeypatch.setattr(ConfigFile, "qr", lambda self: b"\x89PNG " + self.name.encode())
+    return config_dir
+
+
+def test_cache_revalidates_on_change(configs):
+    cache = ConfigCache(max_entries=1)
+    first = cache.get("alice")
+    assert cache.get("alice") is first
+
+    path = configs / "alice.conf"
+    path.write_text(path.read_text() + "DNS = 9.9.9.9\n")
+    os.utime(path, ns=(first._key[0] + 10**9, first._key[0] + 10**9))
+    second = cache.get("alice")
+    assert second is not first and "DNS" in second.text and second.etag != first.etag
+
+    cache.get("bob")  # evicts alice
+    assert list(cache._entries) == ["bob"]
+    path.unlink()
+    assert cache.get("alice") is None
+
+
+def test_zip_is_a_valid_archive(configs):
+    data = b"".join(iter_configs_zip(["alice", "missing", "bob"], with_qr=True))
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["alice.conf", "alice.png", "bob.conf", "bob.png"]
+        assert zf.read("bob.conf") == (configs / "bob.conf").read_bytes()
+        assert zf.read("alice.png") == b"\x89PNG alice"
+
+
+def test_config_etag_and_304(client, configs):
+    r = client.get("/api/config/alice")
+    assert r.status_code == 200
+    etag, modified = r.headers["etag"], r.headers["last-modified"]
+    assert r.headers["cache-control"] == "private, no-cache"
+
+    r = client.get("/api/config/alice", headers={"If-None-Match": etag})
+    assert r.status_code == 304 and r.content == b""
+    assert (r.headers["etag"], r.headers["last-modified"], r.headers["cache-control"]) == (
+        etag, modified, "private, no-cache")
+    assert client.get("/api/config/alice", headers={"If-None-Match": f'"x", W/{etag}'}).status_code == 304
+    assert client.get("/api/config/alice", headers={"If-None-Match": '"other"'}).status_code == 200
+    r = client.get("/api/config/alice", headers={"If-Modified-Since": modified})
+    assert r.status_code == 304 and r.headers["cache-control"] == "private, no-cache" and r.headers["etag"] == etag
+    # If-None-Match wins over If-Modified-Since
+    r = client.get("/api/config/alice", headers={"If-None-Match": '"other"', "If-Modified-Since": modified})
+    assert r.status_code == 200
+
+    r = client.get("/api/config/alice/download", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert client.get("/api/config/nobody").status_code == 404
+
+
+def test_qr_etag(client, configs):
+    r = client.get("/api/client/bob/qr")
+    assert r.status_code == 200 and r.headers["content-type"] == "image/png"
+    r304 = client.get("/api/client/bob/qr", headers={"If-None-Match": r.headers["etag"]})
+    assert r304.status_code == 304 and r304.headers["cache-control"] == r.headers["cache-control"]
+
+
+def test_zip_endpoint(admin_client, configs):
+    r = admin_client.get("/api/configs/zip", params={"names": "bob, alice,bob"})
+    assert r.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        assert zf.namelist() == ["bob.conf", "alice.conf"]
+
+    r = admin_client.get("/api/configs/zip")
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zf:
+        assert zf.namelist() == ["alice.conf", "bob.conf"]
+
+    assert admin_client.get("/api/configs/zip", params={"names": "../etc/passwd"}).status_code == 400
+
+
+def test_zip_endpoint_needs_admin(client, configs):
+    assert client.get("/api/configs/zip").status_code == 403
@@ -0,0 +1,64 @@
+import csv
+import io
+import json
+
+from app.admin import _to_db_ts
+
+
+def _traffic(db, rows):
+    conn = db.get_conn()
+    conn.executemany("INSERT INTO traffic_log (client_name, ts, bytes_in, bytes_out) VALUES (?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def test_to_db_ts():
+    assert _to_db_ts("") is None
+    assert _to_db_ts("0") == "1970-01-01 00:00:00"
+    assert _to_db_ts("2025-01-01") == "2025-01-01 00:00:00"
+    assert _to_db_ts("2025-01-01T02:00:00+02:00") == "2025-01-01 00:00:00"
+
+
+def test_iter_traffic_chunks_and_filters(db):
+    _traffic(db, [(f"peer{i % 3}", f"2025-01-01 00:{i:02d}:00", i, 2 * i) for i in range(30)])
+
+    chunks = list(db.iter_traffic(chunk_size=7))
+    assert [len(c) for c in chunks] == [7, 7, 7, 7, 2]
+    ids = [r["id"] for c in chunks for r in c]
+    assert ids == sorted(ids)
+
+    rows = [r for c in db.iter_traffic(client_name="peer1", since="2025-01-01 00:10:00",
+                                       until="2025-01-01 00:20:00") for r in c]
+    assert [r["bytes_in"] for r in rows] == [10, 13, 16, 19]
+
+    assert list(db.iter_traffic(since="2030-01-01 00:00:00")) == []
+
+
+def test_iter_traffic_by_linked_user(db):
+    db.upsert_user("alice")
+    db.link_clients([("laptop", "alice"), ("phone", "alice"), ("other", None)])
+    _traffic(db, [(n, "2025-01-01 00:00:00", 1, 1) for n in ("laptop", "phone", "other", "laptop")])
+
+    rows = [r for c in db.iter_traffic(username="alice") for r in c]
+    assert sorted(r["client_name"] for r in rows) == ["laptop", "laptop", "phone"]
+    assert list(db.iter_traffic(username="nobody")) == []
+
+
+def test_export_endpoint(admin_client, db):
+    _traffic(db, [("laptop", "2025-01-01 00:00:00", 5, 6), ("phone", "2025-01-02 00:00:00", 7, 8)])
+
+    r = admin_client.get("/admin/export/traffic", params={"format": "csv", "since": "2025-01-02"})
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert [(row["client_name"], row["bytes_in"]) for row in rows] == [("phone", "7")]
+
+    r = admin_client.get("/admin/export/traffic", params={"format": "ndjson", "client": "laptop"})
+    assert [json.loads(line)["bytes_out"] for line in r.text.splitlines()] == [6]
+
+    assert admin_client.get("/admin/export/traffic", params={"format": "xml"}).status_code == 400
+    assert admin_client.get("/admin/export/traffic", params={"since": "yesterday"}).status_code == 400
+
+
+def test_export_needs_admin(client):
+    assert client.get("/admin/export/traffic").status_code == 403
@@ -0,0 +1,91 @@
+import pytest
+
+from app.agent import Agent
+from app.hub import FleetFull, FleetState
+
+NOW = 1_700_000_000
+
+
+def _fleet(**kw):
+    args = {"stale_after": 30, "ttl": 3600, "max_nodes": 4, "max_peers": 100}
+    args.update(kw)
+    return FleetState(**args)
+
+
+def _row(name, rx=0, hs=NOW):
+    return [name, "203.0.113.1:51820", "10.6.0.2", rx, 0, hs]
+
+
+def test_full_then_deltas_in_sequence():
+    fleet = _fleet()
+    assert fleet.apply({"node": "a", "seq": 1, "full": True, "upsert": [_row("p1"), _row("p2")]}, NOW)
+    assert fleet.apply({"node": "a", "seq": 2, "upsert": [_row("p1", rx=50)], "remove": ["p2"]}, NOW)
+
+    assert set(fleet.nodes["a"].peers) == {"p1"}
+    assert fleet.nodes["a"].peers["p1"][3] == 50
+    assert fleet.expected_seq("a") == 3
+
+
+def test_gap_or_unknown_node_asks_for_full_resend():
+    fleet = _fleet()
+    assert not fleet.apply({"node": "a", "seq": 1, "upsert": [_row("p1")]}, NOW)  # never sent a full batch
+    assert fleet.apply({"node": "a", "seq": 1, "full": True, "upsert": [_row("p1")]}, NOW)
+    assert not fleet.apply({"node": "a", "seq": 3, "upsert": [_row("p2")]}, NOW)
+    assert set(fleet.nodes["a"].peers) == {"p1"}
+
+    # a full batch is accepted at any seq and replaces the node's peers
+    assert fleet.apply({"node": "a", "seq": 9, "full": True, "upsert": [_row("p3")]}, NOW)
+    assert set(fleet.nodes["a"].peers) == {"p3"}
+
+
+def test_malformed_batch_changes_nothing():
+    fleet = _fleet()
+    fleet.apply({"node": "a", "seq": 1, "full": True, "upsert": [_row("p1")]}, NOW)
+    with pytest.raises(ValueError):
+        fleet.apply({"node": "a", "seq": 2, "upsert": [_row("p2"), ["p3", "", "", "x", 0, 0]]}, NOW)
+    assert set(fleet.nodes["a"].peers) == {"p1"}
+    assert fleet.expected_seq("a") == 2
+
+
+def test_limits_and_expiry():
+    fleet = _fleet(max_nodes=2, max_peers=2)
+    fleet.apply({"node": "a", "seq": 1, "full": True, "upsert": [_row("p1"), _row("p2"), _row("p3")]}, NOW)
+    assert len(fleet.nodes["a"].peers) == 2
+    fleet.apply({"node": "b", "seq": 1, "full": True}, NOW)
+    with pytest.raises(FleetFull):
+        fleet.apply({"node": "c", "seq": 1, "full": True}, NOW)
+    # once "a" has been silent for the TTL it makes room
+    fleet.apply({"node": "b", "seq": 2}, NOW + 4000)
+    assert fleet.apply({"node": "c", "seq": 1, "full": True}, NOW + 4000)
+    assert set(fleet.nodes) == {"b", "c"}
+
+
+def test_view_labels_nodes_and_skips_stale_from_connected():
+    fleet = _fleet()
+    fleet.apply({"node": "a", "seq": 1, "full": True, "total": 5, "upsert": [_row("p1")]}, NOW)
+    fleet.apply({"node": "b", "seq": 1, "full": True, "total": 3, "upsert": [_row("p1")]}, NOW - 60)
+
+    view = fleet.view(NOW)
+    assert view["total"] == 8
+    assert view["connected"] == 1  # b's peer is connected, but b is stale
+    assert sorted((c["node"], c["name"], c["stale"]) for c in view["list"]) == [("a", "p1", False), ("b", "p1", True)]
+    assert [(n["node"], n["stale"]) for n in view["nodes"]] == [("a", False), ("b", True)]
+
+
+def test_agent_sends_only_changes_after_a_full_batch():
+    agent = Agent("http://hub", "a", "secret")
+    clients = [{"name": "p1", "rx_raw": 1}, {"name": "p2", "rx_raw": 2}]
+    batch, rows = agent.build_batch(clients, 2)
+    assert batch["full"] and len(batch["upsert"]) == 2
+
+    agent.sent, agent.seq, agent.full = rows, batch["seq"], False
+    batch, _ = agent.build_batch([{"name": "p1", "rx_raw": 10}], 1)
+    assert not batch["full"]
+    assert batch["seq"] == 2
+    assert [r[0] for r in batch["upsert"]] == ["p1"]
+    assert batch["remove"] == ["p2"]
+
+    fleet = _fleet()
+    fleet.apply({"node": "a", "seq": 1, "full": True, "upsert": list(rows.values())}, NOW)
+    assert fleet.apply(batch, NOW)
+    assert set(fleet.nodes["a"].peers) == {"p1"}
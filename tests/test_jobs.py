@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app import jobs as jobs_module
+from app.auth import create_session_for_user
+from app.jobs import JobError, JobQueue, handler
+
+
+@handler("test_ok")
+def _ok(ctx, value):
+    ctx.progress("working")
+    return {"value": value, "secret": "s3cret@example.net"}
+
+
+@handler("test_flaky")
+def _flaky(ctx):
+    raise JobError("try again")
+
+
+@handler("test_fatal")
+def _fatal(ctx):
+    raise JobError("no point retrying", retry=False)
+
+
+RUNS = []
+
+
+@handler("test_slow")
+def _slow(ctx, tag):
+    RUNS.append(tag)
+    time.sleep(0.2)
+    return {"tag": tag}
+
+
+def test_coalescing(db):
+    first, created = db.enqueue_job("toggle_config", "peer1", {"enable": False}, coalesce="replace")
+    assert created
+    second, created = db.enqueue_job("toggle_config", "peer1", {"enable": True}, coalesce="replace")
+    assert (second, created) == (first, False)
+    assert db.get_job(first)["params"] == {"enable": True}
+
+    delete, _ = db.enqueue_job("delete_config", "peer1", {}, coalesce="keep", supersedes=("toggle_config",))
+    assert db.get_job(first)["status"] == "cancelled"
+    assert db.enqueue_job("delete_config", "peer1", {}, coalesce="keep") == (delete, False)
+
+
+def test_one_running_job_per_target(db):
+    a, _ = db.enqueue_job("test_ok", "peer1", {"value": 1})
+    db.enqueue_job("test_ok", "peer1", {"value": 2})
+    c, _ = db.enqueue_job("test_ok", "peer2", {"value": 3})
+    assert db.claim_job(1e12)["id"] == a
+    assert db.claim_job(1e12)["id"] == c  # peer1's second job waits for the first
+    assert db.claim_job(1e12) is None
+
+
+def _run(queue, job_id, db):
+    job = db.claim_job(1e12)
+    assert job["id"] == job_id
+    asyncio.run(queue._run(job))
+    return db.get_job(job_id)
+
+
+def test_run_success_retry_and_failure(db):
+    queue = JobQueue(workers=1, max_attempts=2, retention=60)
+
+    job_id, _ = db.enqueue_job("test_ok", "t", {"value": 7})
+    job = _run(queue, job_id, db)
+    assert job["status"] == "done" and job["result"]["value"] == 7 and job["progress"] is None
+
+    job_id, _ = db.enqueue_job("test_flaky", "t", {})
+    job = _run(queue, job_id, db)
+    assert job["status"] == "queued" and job["error"] == "try again"
+    db.update_job(job_id, run_after=0)  # skip the backoff
+    job = _run(queue, job_id, db)
+    assert job["status"] == "failed" and job["attempts"] == 2
+
+    job_id, _ = db.enqueue_job("test_fatal", "t", {})
+    assert _run(queue, job_id, db)["status"] == "failed"
+
+
+def test_takeover_recovers_before_any_claim(db, monkeypatch):
+    RUNS.clear()
+    # a fresh job, and one the previous runner died in the middle of
+    db.enqueue_job("test_slow", "peer2", {"tag": "fresh"})
+    stale, _ = db.enqueue_job("test_slow", "peer1", {"tag": "stale"})
+    db.update_job(stale, status="running")
+
+    real_requeue = jobs_module.requeue_running_jobs
+
+    def slow_requeue(exclude=()):
+        time.sleep(0.1)  # give the other worker every chance to claim in between
+        return real_requeue(exclude)
+
+    monkeypatch.setattr(jobs_module, "requeue_running_jobs", slow_requeue)
+    queue = JobQueue(workers=2, max_attempts=1, retention=60)
+
+    async def run():
+        await queue.start(lambda: True, None)
+        await asyncio.sleep(1.0)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert sorted(RUNS) == ["fresh", "stale"]  # each ran exactly once
+    assert db.get_job(stale)["status"] == "done"
+
+
+def test_requeue_spares_jobs_still_running_here(db):
+    a, _ = db.enqueue_job("test_ok", "peer1", {"value": 1})
+    b, _ = db.enqueue_job("test_ok", "peer2", {"value": 2})
+    db.claim_job(1e12)
+    db.claim_job(1e12)
+    assert db.requeue_running_jobs(exclude=(a,)) == 1
+    assert (db.get_job(a)["status"], db.get_job(b)["status"]) == ("running", "queued")
+
+
+def test_broadcast_carries_no_job_details(db, monkeypatch):
+    monkeypatch.setattr(jobs_module, "WATCH_INTERVAL", 0.01)
+    queue = JobQueue(workers=1, max_attempts=1, retention=60)
+    sent = []
+
+    async def broadcast(msg):
+        sent.append(msg)
+
+    async def run():
+        queue._broadcast = broadcast
+        watch = asyncio.create_task(queue._watch())
+        await asyncio.sleep(0.02)
+        job_id, _ = db.enqueue_job("test_ok", "email:someone@example.net", {"value": 1})
+        await queue._run(db.claim_job(1e12))
+        await asyncio.sleep(0.05)
+        watch.cancel()
+        return job_id
+
+    job_id = asyncio.run(run())
+    assert sent
+    assert all(msg == {"type": "job", "id": job_id, "kind": "test_ok", "status": msg["status"]} for msg in sent)
+    assert sent[-1]["status"] == "done"
+
+
+@pytest.fixture
+def job_id(db):
+    db.upsert_user("alice")
+    db.upsert_user("bob")
+    job_id, _ = db.enqueue_job("test_ok", "t", {"value": "mail body"}, created_by="alice")
+    return job_id
+
+
+def test_job_endpoint_needs_a_session(client, job_id):
+    assert client.get(f"/api/jobs/{job_id}").status_code == 401
+
+
+@pytest.mark.parametrize("user,status", [("alice", 200), ("bob", 404), ("root", 200)])
+def test_job_endpoint_is_for_admins_and_the_creator(client, db, job_id, user, status):
+    db.upsert_user("root", "admin")
+    client.cookies.set("session", create_session_for_user(user))
+    r = client.get(f"/api/jobs/{job_id}")
+    assert r.status_code == status
+    if status == 200:
+        assert r.json()["status"] == "queued"
+        assert "params" not in r.json()
+
+
+@pytest.mark.parametrize("outcome", ["done", "failed"])
+def test_mail_params_are_erased_when_finished(db, monkeypatch, outcome):
+    from app import admin
+
+    def send(to, subject, body):
+        if outcome == "failed":
+            raise JobError("relay refused", retry=False)
+
+    monkeypatch.setattr(admin, "send_email", send)
+    job_id, _ = db.enqueue_job("send_email", "email:a@example.net",
+                               {"to": "a@example.net", "subject": "Hi", "body": "Temporary password: hunter2"})
+    job = _run(JobQueue(workers=1, max_attempts=3, retention=60), job_id, db)
+    assert job["status"] == outcome and job["params"] is None
+    conn = db.get_conn()
+    (raw,) = conn.execute("SELECT params FROM jobs WHERE id=?", (job_id,)).fetchone()
+    conn.close()
+    assert raw is None
+
+
+def test_params_kept_while_a_mail_is_retried(db, monkeypatch):
+    from app import admin
+
+    def send(to, subject, body):
+        raise OSError("relay down")
+
+    monkeypatch.setattr(admin, "send_email", send)
+    job_id, _ = db.enqueue_job("send_email", "email:a@example.net", {"to": "a@example.net", "subject": "Hi", "body": "x"})
+    job = _run(JobQueue(workers=1, max_attempts=3, retention=60), job_id, db)
+    assert job["status"] == "queued" and job["params"]["to"] == "a@example.net"
+
+
+def test_submit_from_a_thread_wakes_the_workers(db, monkeypatch):
+    monkeypatch.setattr(jobs_module, "POLL_INTERVAL", 30.0)  # only a wake-up can get the job run in time
+    queue = JobQueue(workers=1, max_attempts=1, retention=60)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        loop.set_debug(True)  # asyncio debug mode rejects Event.set() from another thread
+        await queue.start(lambda: True, None)
+        await asyncio.sleep(0.2)  # the worker is idle, waiting on _wake
+        job_id = await asyncio.to_thread(queue.submit, "test_ok", "t", {"value": 1})
+        for _ in range(100):
+            if db.get_job(job_id)["status"] == "done":
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return job_id
+
+    # a lost wake-up can wedge the loop, so the test waits for it in a thread with a deadline
+    result = {}
+    runner = threading.Thread(target=lambda: result.update(job_id=asyncio.run(run())), daemon=True)
+    runner.start()
+    runner.join(10)
+    assert "job_id" in result and db.get_job(result["job_id"])["status"] == "done"
@@ -0,0 +1,63 @@
+import asyncio
+import gzip
+import json
+
+import pytest
+
+from app import main
+from app.wsmanager import WSManager
+
+SNAPSHOT = {"total": 1, "connected": 0, "list": [{"name": "phone" * 300}], "ts": 1700000000}
+
+
+@pytest.fixture
+def live(client, monkeypatch):
+    manager = WSManager()
+    manager._set_snapshot(dict(SNAPSHOT, version=5), json.dumps(dict(SNAPSHOT, version=5)))
+    monkeypatch.setattr(main, "wsmanager", manager)
+    return manager
+
+
+def test_long_poll_times_out_with_204(client, live):
+    r = client.get("/api/clients", params={"since": 5, "timeout": 0})
+    assert r.status_code == 204 and r.headers["x-snapshot-version"] == "5"
+
+
+def test_long_poll_gzips_once(client, live):
+    r = client.get("/api/clients", params={"since": 4}, headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200 and r.headers["content-encoding"] == "gzip"
+    assert r.json()["version"] == 5  # decodes with a single gunzip
+    assert gzip.decompress(live.body("gzip")) == live.body()
+
+
+@pytest.mark.parametrize("header", ["gzip;q=0", "identity", "br, gzip; q=0.0"])
+def test_long_poll_honours_refused_gzip(client, live, header):
+    r = client.get("/api/clients", params={"since": 4}, headers={"Accept-Encoding": header})
+    assert r.status_code == 200 and "content-encoding" not in r.headers
+    assert r.content == live.body()
+
+
+def test_plain_clients_are_still_compressed(client, live):
+    r = client.get("/api/clients", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip" and r.json()["total"] == 1
+
+
+def test_waiters_wake_on_publish():
+    manager = WSManager()
+
+    async def run():
+        waiter = asyncio.create_task(manager.wait_newer(0, 5))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        manager._set_snapshot({"version": 1}, '{"version":1}')
+        assert await waiter
+        assert await manager.wait_newer(7, 0)  # a restarted version sequence counts as newer
+
+    asyncio.run(run())
+    assert manager.body("sse") == b'id: 1\nevent: snapshot\ndata: {"version":1}\n\n'
+    assert manager.body("sse") is manager.body("sse")  # encoded once per version
+
+
+@pytest.mark.parametrize("timeout", ["nan", "inf", "-1", "61"])
+def test_long_poll_timeout_is_bounded(client, live, timeout):
+    assert client.get("/api/clients", params={"since": 5, "timeout": timeout}).status_code == 422
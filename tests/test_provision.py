@@ -0,0 +1,231 @@
+import base64
+import fcntl
+import ipaddress
+import os
+import subprocess
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app import jobs, pivpn, provision
+from app.provision import (
+    AddressPool,
+    ApplyError,
+    Provisioner,
+    ProvisionError,
+    _x25519_base,
+    parse_bulk_csv,
+)
+
+SERVER_CONF = """[Interface]
+PrivateKey = c2VydmVy
+Address = 10.6.0.1/24
+ListenPort = 51820
+### begin old ###
+[Peer]
+PublicKey = b2xk
+PresharedKey = cHNr
+AllowedIPs = 10.6.0.2/32
+### end old ###
+"""
+
+
+@pytest.fixture
+def pivpn_tree(tmp_path):
+    wg_dir = tmp_path / "wireguard"
+    (wg_dir / "keys").mkdir(parents=True)
+    (wg_dir / "configs").mkdir()
+    (wg_dir / "keys" / "server_pub").write_text("U0VSVkVSUFVC\n")
+    (wg_dir / "wg0.conf").write_text(SERVER_CONF)
+    (wg_dir / "configs" / "clients.txt").write_text("old b2xk 1700000000 10.6.0.2\n")
+    (wg_dir / "configs" / "old.conf").write_text("[Interface]\nAddress = 10.6.0.2/24\n")
+    # a disabled client that only shows up through its renamed config
+    (wg_dir / "configs" / "gone.disabled").write_text("[Interface]\nAddress = 10.6.0.9/24\n")
+    setup = tmp_path / "setupVars.conf"
+    setup.write_text("pivpnNET=10.6.0.0\nsubnetClass=24\npivpnHOST=vpn.example.net\npivpnPORT=51820\n"
+                     "pivpnDNS1=9.9.9.9\nALLOWED_IPS=\"0.0.0.0/0\"\n")
+    return wg_dir, setup
+
+
+def _provisioner(pivpn_tree, apply_cmd=("true",)):
+    wg_dir, setup = pivpn_tree
+    return Provisioner(wg_dir=wg_dir, config_dir=wg_dir / "configs", setup_vars=setup, iface="wg0",
+                       apply_cmd=apply_cmd)
+
+
+def _snapshot(root):
+    return {p: p.read_bytes() for p in sorted(root.rglob("*")) if p.is_file()}
+
+
+def test_pool_skips_reserved_and_used_addresses():
+    pool = AddressPool(ipaddress.IPv4Network("10.6.0.0/29"))
+    pool.mark("10.6.0.3")
+    got = [str(pool.allocate()) for _ in range(4)]
+    assert got == ["10.6.0.2", "10.6.0.4", "10.6.0.5", "10.6.0.6"]
+    with pytest.raises(ProvisionError):
+        pool.allocate()
+
+
+def test_pool_skips_full_bytes():
+    pool = AddressPool(ipaddress.IPv4Network("10.6.0.0/24"))
+    for i in range(2, 200):
+        pool.mark(f"10.6.0.{i}")
+    assert str(pool.allocate()) == "10.6.0.200"
+
+
+def test_pure_python_x25519_matches_rfc7748():
+    # RFC 7748 section 6.1, Alice's key pair
+    private = bytes.fromhex("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a")
+    public = bytes.fromhex("8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")
+    assert _x25519_base(private) == public
+
+
+def test_validate_rejects_the_whole_batch(pivpn_tree):
+    wg_dir, _ = pivpn_tree
+    before = _snapshot(wg_dir)
+    with pytest.raises(ProvisionError) as e:
+        _provisioner(pivpn_tree).create(["ok-1", "old", "gone", ".hidden", "ok-1", "bad name"])
+    msg = str(e.value)
+    assert "'old': already exists" in msg
+    assert "'gone': already exists" in msg
+    assert "'.hidden'" in msg and "'bad name'" in msg
+    assert "'ok-1': duplicated in batch" in msg
+    assert _snapshot(wg_dir) == before
+
+
+def test_create_writes_pivpn_files(pivpn_tree):
+    wg_dir, _ = pivpn_tree
+    created = _provisioner(pivpn_tree).create(["laptop", "phone"])
+
+    # .2 belongs to "old", .9 to the disabled client
+    assert [(c["name"], c["ip"]) for c in created] == [("laptop", "10.6.0.3"), ("phone", "10.6.0.4")]
+    server = (wg_dir / "wg0.conf").read_text()
+    assert server.startswith(SERVER_CONF)
+    assert "### begin laptop ###" in server and "AllowedIPs = 10.6.0.4/32" in server
+    conf = (wg_dir / "configs" / "laptop.conf").read_text()
+    assert "Address = 10.6.0.3/24" in conf
+    assert "PublicKey = U0VSVkVSUFVC" in conf
+    assert "Endpoint = vpn.example.net:51820" in conf
+    assert (wg_dir / "configs" / "clients.txt").read_text().splitlines()[-1].startswith(
+        f"phone {created[1]['public_key']} ")
+    priv = (wg_dir / "keys" / "laptop_priv").read_text().strip()
+    assert (wg_dir / "keys" / "laptop_priv").stat().st_mode & 0o777 == 0o600
+    pub = base64.b64encode(_x25519_base(base64.b64decode(priv))).decode()
+    assert (wg_dir / "keys" / "laptop_pub").read_text().strip() == pub == created[0]["public_key"]
+
+
+def test_write_failure_rolls_back(pivpn_tree, monkeypatch):
+    wg_dir, _ = pivpn_tree
+    before = _snapshot(wg_dir)
+    real = provision._write_private
+
+    def fail_on_second_config(path, text):
+        if path.name == "b.conf":
+            raise OSError(28, "No space left on device")
+        real(path, text)
+
+    monkeypatch.setattr(provision, "_write_private", fail_on_second_config)
+    with pytest.raises(ProvisionError) as e:
+        _provisioner(pivpn_tree).create(["a", "b"])
+    assert not isinstance(e.value, ApplyError)
+    assert "No space left" in str(e.value)
+    assert _snapshot(wg_dir) == before
+
+
+def test_failure_after_server_rewrite_restores_it(pivpn_tree, monkeypatch):
+    wg_dir, _ = pivpn_tree
+    before = _snapshot(wg_dir)
+
+    def copy_fails(self, peers, created):
+        raise PermissionError(13, "Permission denied")
+
+    monkeypatch.setattr(Provisioner, "_copy_to_home", copy_fails)
+    with pytest.raises(ProvisionError):
+        _provisioner(pivpn_tree).create(["a"])
+    assert _snapshot(wg_dir) == before
+
+
+@pytest.mark.parametrize("cmd", [("false",), ("/nonexistent/wg-reload",)])
+def test_reload_failure_keeps_the_peers(pivpn_tree, cmd):
+    wg_dir, _ = pivpn_tree
+    with pytest.raises(ApplyError):
+        _provisioner(pivpn_tree, apply_cmd=cmd).create(["a"])
+    assert (wg_dir / "configs" / "a.conf").exists()
+    assert "### begin a ###" in (wg_dir / "wg0.conf").read_text()
+
+
+def test_parse_bulk_csv():
+    rows = parse_bulk_csv("name,user\nlaptop, alice\n\n# comment\nphone\n")
+    assert rows == [{"name": "laptop", "user": "alice"}, {"name": "phone", "user": None}]
+
+
+def test_bulk_endpoint_links_normalised_names(admin_client, db, monkeypatch):
+    calls = []
+
+    def fake_provision(names):
+        calls.append(names)
+        return [{"name": n, "ip": "10.6.0.3", "public_key": "k"} for n in names]
+
+    monkeypatch.setattr("app.main.provision_clients", fake_provision)
+    db.upsert_user("alice")
+    r = admin_client.post("/admin/bulk_clients", json=[{"name": " laptop ", "user": "alice"}, "phone"])
+    assert r.status_code == 200
+    assert calls == [["laptop", "phone"]]
+    assert db.get_client_owners() == {"laptop": "alice"}
+
+
+def test_bulk_endpoint_links_when_only_the_reload_failed(admin_client, db, monkeypatch):
+    def reload_fails(names):
+        raise ApplyError("Peers written but reload failed: boom")
+
+    monkeypatch.setattr("app.main.provision_clients", reload_fails)
+    db.upsert_user("alice")
+    r = admin_client.post("/admin/bulk_clients", content="laptop,alice\n", headers={"content-type": "text/csv"})
+    assert r.status_code == 500
+    assert db.get_client_owners() == {"laptop": "alice"}
+
+
+def _lock_is_held():
+    fd = os.open(pivpn.PIVPN_LOCK, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return False
+    except OSError:
+        return True
+    finally:
+        os.close(fd)
+
+
+def test_create_waits_for_other_writers_and_rereads(pivpn_tree):
+    wg_dir, _ = pivpn_tree
+    result = {}
+    with pivpn.pivpn_lock():
+        worker = threading.Thread(target=lambda: result.update(peers=_provisioner(pivpn_tree).create(["laptop"])))
+        worker.start()
+        time.sleep(0.2)
+        assert "peers" not in result  # still waiting for the lock
+        # meanwhile `pivpn -a` in another worker adds a peer on the next free address
+        with open(wg_dir / "wg0.conf", "a") as f:
+            f.write("### begin phone ###\n[Peer]\nPublicKey = cGhvbmU=\nAllowedIPs = 10.6.0.3/32\n### end phone ###\n")
+    worker.join(5)
+    server = (wg_dir / "wg0.conf").read_text()
+    assert "### begin phone ###" in server and "### begin laptop ###" in server
+    assert result["peers"][0]["ip"] == "10.6.0.4"
+
+
+def test_pivpn_commands_run_under_the_lock(db, monkeypatch):
+    held = []
+
+    def run(cmd, **kwargs):
+        held.append((cmd[1], _lock_is_held()))
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+    monkeypatch.setattr(subprocess, "run", run)
+    monkeypatch.setattr(jobs, "config_exists", lambda name: False)
+    jobs._add_client(SimpleNamespace(progress=lambda message: None), "phone")
+    pivpn.delete_config("phone")
+    pivpn.set_client_enabled("phone", False)
+    assert held == [("-a", True), ("-r", True), ("-off", True)]
+    assert not _lock_is_held()
@@ -0,0 +1,124 @@
+import asyncio
+import subprocess
+
+import pytest
+
+from app import jobs as jobs_module
+from app import pivpn, wsmanager
+from app.quotas import QuotaTracker, period_start
+
+DAY = period_start("day", 1_700_000_000)
+NOW = DAY + 3600
+
+
+@pytest.fixture
+def tracker(db, config_dir):
+    (config_dir / "clients.txt").write_text("phone S0VZMQ== 1700000000 10.6.0.2\nlaptop S0VZMg== 1700000000 10.6.0.3\n")
+    return QuotaTracker(checkpoint_interval=30)
+
+
+def test_peer_quota_disables_at_the_limit(tracker, db):
+    db.set_quota("peer", "phone", "day", 1000)
+    tracker.add("phone", 600, NOW, "S0VZMQ==")
+    assert tracker.drain_actions() == []
+    tracker.add("phone", 600, NOW + 1, "S0VZMQ==")
+    tracker.add("phone", 600, NOW + 2, "S0VZMQ==")
+    assert tracker.drain_actions() == [("phone", False)]  # once, however much more it moves
+    assert db.get_quota_blocks() == {"phone": ("peer", "phone")}
+
+    tracker.checkpoint()
+    assert tracker.usage()[("peer", "phone")]["used"] == 1800
+
+
+def test_usage_follows_the_public_key(tracker, db):
+    db.set_quota("peer", "phone", "day", 1000)
+    # the config is gone, so the collector only knows the peer by its virtual IP
+    tracker.add("10.6.0.2", 2000, NOW, "S0VZMQ==")
+    assert tracker.drain_actions() == [("phone", False)]
+    # keys pivpn does not know fall back to the name
+    tracker.add("10.6.0.9", 5000, NOW, "dW5rbm93bg==")
+    assert tracker.drain_actions() == []
+
+
+def test_user_quota_disables_all_their_peers(tracker, db):
+    db.upsert_user("alice")
+    db.link_clients([("phone", "alice"), ("laptop", "alice")])
+    db.set_quota("user", "alice", "day", 1000)
+    tracker.add("phone", 400, NOW, "S0VZMQ==")
+    tracker.add("laptop", 700, NOW, "S0VZMg==")
+    assert sorted(tracker.drain_actions()) == [("laptop", False), ("phone", False)]
+
+
+def test_release_on_rollover_raise_and_delete(tracker, db):
+    db.set_quota("peer", "phone", "day", 1000)
+    db.set_quota("peer", "laptop", "day", 1000)
+    tracker.add("phone", 2000, NOW, "S0VZMQ==")
+    tracker.add("laptop", 2000, NOW, "S0VZMg==")
+    tracker.drain_actions()
+
+    db.set_quota("peer", "phone", "day", 5000)
+    db.delete_quota("peer", "laptop")
+    tracker.sync(NOW + 60)
+    assert sorted(tracker.drain_actions()) == [("laptop", True), ("phone", True)]
+    assert db.get_quota_blocks() == {}
+
+    tracker.add("phone", 4000, NOW + 61, "S0VZMQ==")
+    assert tracker.drain_actions() == [("phone", False)]
+    tracker.tick(DAY + 86400 + 1)
+    assert tracker.drain_actions() == [("phone", True)]
+    assert tracker.usage()[("peer", "phone")]["used"] == 0
+
+
+def test_release_only_frees_the_quotas_own_blocks(tracker, db):
+    db.upsert_user("alice")
+    db.link_clients([("phone", "alice"), ("laptop", "alice")])
+    db.set_quota("user", "alice", "day", 1000)
+    db.set_quota("peer", "laptop", "day", 1000)
+    tracker.add("laptop", 2000, NOW, "S0VZMg==")  # laptop's own quota blocks it first
+    tracker.add("phone", 2000, NOW, "S0VZMQ==")
+    tracker.drain_actions()
+    db.delete_quota("user", "alice")
+    tracker.sync(NOW + 60)
+    # only the user quota's block goes; laptop is still held by its own quota
+    assert tracker.drain_actions() == [("phone", True)]
+
+
+def test_collector_submits_pivpn_off(tracker, db, config_dir, monkeypatch):
+    db.set_quota("peer", "phone", "day", 1000)
+    peer = {"name": "phone", "rx_raw": 0, "tx_raw": 0, "latest_handshake": 0, "connected": False,
+            "remote_ip": "", "public_key": "S0VZMQ==", "interface": "wg0"}
+    snapshots = iter([dict(peer), dict(peer, rx_raw=5000)])
+    monkeypatch.setattr(wsmanager, "get_connected_clients", lambda: [next(snapshots)])
+    monkeypatch.setattr(wsmanager, "interface_epoch", lambda iface: "7")
+    monkeypatch.setattr(wsmanager, "quotas", tracker)
+    submitted = []
+    monkeypatch.setattr(wsmanager.jobs, "submit", lambda *args: submitted.append(args))
+
+    manager = wsmanager.WSManager()
+    manager._fresh_install = False
+    manager._counters = {"S0VZMQ==": ("7", 0, 0)}
+    asyncio.run(manager.poll_once())
+    asyncio.run(manager.poll_once())
+    assert submitted == [("set_client_enabled", "phone", {"name": "phone", "enable": False}, "quota")]
+
+
+@pytest.mark.parametrize("enable,flag", [(False, "-off"), (True, "-on")])
+def test_set_client_enabled_runs_pivpn(db, monkeypatch, enable, flag):
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, "", "")
+
+    monkeypatch.setattr(pivpn.subprocess, "run", run)
+    job_id, _ = db.enqueue_job("set_client_enabled", "phone", {"name": "phone", "enable": enable})
+    queue = jobs_module.JobQueue(workers=1, max_attempts=1, retention=60)
+    asyncio.run(queue._run(db.claim_job(1e12)))
+    assert calls == [["pivpn", flag, "-y", "phone"]]
+    assert db.get_job(job_id)["result"] == {"enabled": enable}
+
+
+def test_delete_cancels_a_pending_enable(db):
+    job_id, _ = db.enqueue_job("set_client_enabled", "phone", {"name": "phone", "enable": True})
+    jobs_module.jobs.submit("delete_config", "phone", {"name": "phone"})
+    assert db.get_job(job_id)["status"] == "cancelled"
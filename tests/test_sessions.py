@@ -0,0 +1,96 @@
+import pytest
+
+from app.sessions import REKEY_AFTER, SessionTracker, concurrency, uptime
+
+T0 = 1_700_000_000
+
+
+def _peer(name, connected, hs, rx=0, tx=0):
+    return {"name": name, "connected": connected, "latest_handshake": hs, "rx_raw": rx, "tx_raw": tx,
+            "remote_ip": "203.0.113.5:51820"}
+
+
+def _rows(db):
+    conn = db.get_conn()
+    rows = [dict(r) for r in conn.execute("SELECT * FROM peer_sessions ORDER BY id")]
+    conn.close()
+    return rows
+
+
+def test_open_and_close_on_transitions(db):
+    tracker = SessionTracker()
+    tracker.update([_peer("a", True, T0, rx=100, tx=10), _peer("b", False, 0)], T0 + 5)
+    tracker.update([_peer("a", True, T0 + 120, rx=500, tx=50), _peer("b", False, 0)], T0 + 125)
+    assert len(_rows(db)) == 1  # ticks without transitions write nothing
+
+    tracker.update([_peer("a", False, T0 + 120, rx=900, tx=90), _peer("b", False, 0)], T0 + 600)
+    (row,) = _rows(db)
+    assert (row["client_name"], row["start_ts"], row["endpoint"]) == ("a", T0, "203.0.113.5:51820")
+    # down at most REKEY_AFTER after the last handshake, not when we noticed
+    assert row["end_ts"] == T0 + 120 + REKEY_AFTER
+    assert (row["rx_bytes"], row["tx_bytes"]) == (800, 80)
+
+
+def test_vanished_peer_and_counter_reset(db):
+    tracker = SessionTracker()
+    tracker.update([_peer("a", True, T0, rx=1000), _peer("b", True, T0, rx=1000)], T0)
+    tracker.update([_peer("a", True, T0 + 60, rx=1500), _peer("b", False, T0, rx=200)], T0 + 400)
+    tracker.update([], T0 + 500)  # "a" removed from the interface
+
+    rows = {r["client_name"]: r for r in _rows(db)}
+    assert rows["a"]["end_ts"] == T0 + 60 + REKEY_AFTER and rows["a"]["rx_bytes"] == 500
+    assert rows["b"]["rx_bytes"] == 200  # counters restarted, so all of them are this session's
+
+
+def test_open_sessions_survive_a_new_collector(db):
+    SessionTracker().update([_peer("a", True, T0)], T0)
+    successor = SessionTracker()
+    successor.update([_peer("a", True, T0 + 100)], T0 + 100)
+    assert len(_rows(db)) == 1
+    successor.update([_peer("a", False, T0 + 100)], T0 + 1000)
+    assert _rows(db)[0]["end_ts"] == T0 + 100 + REKEY_AFTER
+
+
+def test_uptime_clips_to_the_window():
+    sessions = [(0, 100), (150, 250), (900, None)]
+    assert uptime(sessions, 50, 1000, now=950) == 50 + 100 + 50
+
+
+def test_concurrency_peaks_per_bucket():
+    sessions = [(0, 100), (50, 150), (60, 70), (300, None)]
+    points = concurrency(sessions, 0, 400, 100, now=350)
+    assert [p["peak"] for p in points] == [3, 1, 0, 1]
+    assert [p["ts"] for p in points] == [0, 100, 200, 300]
+
+
+def test_sessions_pages_do_not_skip_shared_start_seconds(client, db):
+    db.record_session_transitions([("a", T0, "", 0, 0)] * 3 + [("a", T0 - 10, "", 0, 0)] * 2, [])
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["before"] = cursor
+        body = client.get("/api/client/a/sessions", params=params).json()
+        seen += [r["id"] for r in body["items"]]
+        cursor = body["next"]
+        if cursor is None:
+            break
+    assert sorted(seen) == [1, 2, 3, 4, 5] and len(seen) == 5
+    assert client.get("/api/client/a/sessions", params={"before": "soon"}).status_code == 400
+
+
+@pytest.mark.parametrize("url", [
+    "/api/client/a/uptime?hours=0",
+    "/api/client/a/uptime?hours=-5",
+    "/api/client/a/uptime?hours=1000000",
+    "/api/sessions/concurrency?bucket=0",
+    "/api/sessions/concurrency?hours=-1",
+    "/api/sessions/concurrency?bucket=99999999",
+])
+def test_window_parameters_are_validated(client, url):
+    assert client.get(url).status_code == 422
+
+
+def test_uptime_endpoint(client, db):
+    assert client.get("/api/client/a/uptime", params={"hours": 2}).json()["uptime_seconds"] == 0
+    assert len(client.get("/api/sessions/concurrency", params={"hours": 1, "bucket": 600}).json()["points"]) == 6
@@ -0,0 +1,42 @@
+from app.settings import Settings, load_settings, read_env_file
+
+
+def test_env_file_syntax(tmp_path):
+    env = tmp_path / "dashboard.env"
+    env.write_text(
+        "# comment\n"
+        "\n"
+        "PORT=9000\n"
+        "export WG_INTERFACE = wg1\n"
+        "SMTP_FROM=\"vpn@example.net\"\n"
+        "not a setting\n"
+    )
+    assert read_env_file(env) == {"PORT": "9000", "WG_INTERFACE": "wg1", "SMTP_FROM": "vpn@example.net"}
+    assert read_env_file(tmp_path / "missing.env") == {}
+
+
+def test_environment_overrides_env_file(tmp_path):
+    env = tmp_path / "dashboard.env"
+    env.write_text("PORT=9000\nWG_INTERFACE=wg1\n")
+    s = load_settings({"WG_DASHBOARD_ENV": str(env), "PORT": "9100"})
+    assert s.port == 9100
+    assert s.wg_interface == "wg1"
+
+
+def test_values_are_coerced_to_the_default_type(tmp_path):
+    s = load_settings({
+        "WG_DASHBOARD_ENV": str(tmp_path / "none.env"),
+        "POLL_INTERVAL": "2.5",
+        "JOB_WORKERS": "4",
+        "WG_CMD": "wg show all dump",
+        "ALERT_EMAIL": "a@example.net b@example.net",
+    })
+    assert s.poll_interval == 2.5
+    assert s.job_workers == 4
+    assert s.wg_cmd == ("wg", "show", "all", "dump")
+    assert s.alert_email == ("a@example.net", "b@example.net")
+
+
+def test_invalid_value_keeps_the_default(tmp_path):
+    s = load_settings({"WG_DASHBOARD_ENV": str(tmp_path / "none.env"), "PORT": "eighty"})
+    assert s.port == Settings().port